@@ -0,0 +1,418 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+from telebot import types, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+import bot as core
+from bot import (
+    is_owner, is_admin, track_chat, invalidate_member_count, get_user_permission_status,
+    render_folder_list, render_folder_page, render_search_page, remember_search,
+    search_queries, search_queries_lock, search_music, random_music, catalog, catalog_search,
+    playlist, current_play, start_queue, stop_queue, queue_step, queue_upcoming,
+    add_admin_db, remove_admin_db, ban_admin, unban_admin, set_admin_limit, remove_admin_limit,
+    render_dashboard, render_preview, render_gp_list, render_adminlist, admin_roster,
+    send_scheduler, retry_after_seconds, update_chat_id,
+    OWNER_ID, SCHEDULED_METHODS, SEND_MAX_RETRIES, INLINE_PAGE_SIZE, INLINE_CACHE_TIME,
+)
+
+# ================= ASYNC RUNTIME =================
+# An asyncio front end over bot.py's data layer: python async_bot.py runs the
+# same bot on AsyncTeleBot. API calls are coroutines sharing bot.py's outbound
+# scheduler buckets, blocking SQLite work runs on a small thread pool, and each
+# chat's updates are still handled in order. Handlers that haven't been ported
+# fall through to the sync handlers in bot.py on a bridge thread pool.
+ASYNC_DB_THREADS = int(os.getenv("ASYNC_DB_THREADS", "4"))
+ASYNC_BRIDGE_THREADS = int(os.getenv("ASYNC_BRIDGE_THREADS", "8"))
+ASYNC_REQUEST_LIMIT = int(os.getenv("ASYNC_REQUEST_LIMIT", "1000"))   # open API connections
+
+asyncio_helper.REQUEST_LIMIT = ASYNC_REQUEST_LIMIT
+if core.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = core.TELEGRAM_API_URL + "/bot{0}/{1}"
+
+abot = AsyncTeleBot(core.TOKEN, parse_mode="HTML")
+db_executor = ThreadPoolExecutor(ASYNC_DB_THREADS, thread_name_prefix="async-db")
+bridge_executor = ThreadPoolExecutor(ASYNC_BRIDGE_THREADS, thread_name_prefix="async-bridge")
+
+async def db(func, *args):
+    """Run a blocking bot.py helper on the DB thread pool, charging the wait to the running handler"""
+    counters = core.async_handler.get()
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+    finally:
+        if counters:
+            counters.db_time += time.perf_counter() - started
+
+async def bridge(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(bridge_executor, func, *args)
+
+_async_process_request = asyncio_helper._process_request
+
+async def scheduled_process_request(token, url, method='get', params=None, files=None, **kwargs):
+    """asyncio_helper._process_request behind the same limits as the sync bot"""
+    counters = core.async_handler.get()
+    started = time.perf_counter()
+    try:
+        return await scheduled_call(token, url, method, params, files, **kwargs)
+    finally:
+        if counters:
+            counters.api_time += time.perf_counter() - started
+
+async def scheduled_call(token, url, method, params, files, **kwargs):
+    if not url.startswith(SCHEDULED_METHODS):
+        return await _async_process_request(token, url, method, params, files, **kwargs)
+    chat_id = (params or {}).get('chat_id')
+    for attempt in range(SEND_MAX_RETRIES + 1):
+        await send_scheduler.acquire_async(chat_id)
+        try:
+            return await _async_process_request(token, url, method, dict(params) if params else params, files, **kwargs)
+        except asyncio_helper.ApiTelegramException as e:
+            wait = retry_after_seconds(e)
+            if wait is None:
+                raise
+            if attempt == SEND_MAX_RETRIES:
+                send_scheduler.dropped(core.LANE_INTERACTIVE)
+                raise
+            print(f"429 on {url} to {chat_id}, retrying in {wait}s")
+            send_scheduler.rate_limited(chat_id, core.LANE_INTERACTIVE, wait)
+
+asyncio_helper._process_request = scheduled_process_request
+
+_async_get_updates = asyncio_helper.get_updates
+
+async def captured_get_updates(*args, **kwargs):
+    updates = await _async_get_updates(*args, **kwargs)
+    if updates:
+        core.capture_updates(updates)
+    return updates
+
+if core.CAPTURE_DIR:
+    asyncio_helper.get_updates = captured_get_updates
+
+# Per-chat ordering: updates of one chat wait on that chat's lock in arrival order
+chat_locks = {}      # {chat_id: [lock, users]}
+_process_new_updates = abot.process_new_updates
+
+async def handle_in_order(chat_id, update):
+    entry = chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            await _process_new_updates([update])
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del chat_locks[chat_id]
+
+async def process_new_updates(updates):
+    for update in updates:
+        core.remember_update_users(update)
+    await asyncio.gather(*(handle_in_order(update_chat_id(u), u) for u in updates))
+
+abot.process_new_updates = process_new_updates
+
+# ================= TRACKING =================
+@abot.message_handler(content_types=['new_chat_members'])
+async def welcome_new_member(message):
+    track_chat(message.chat)
+    invalidate_member_count(message.chat.id)
+    if not getattr(core, 'welcome_mode_enabled', False):
+        return
+    for new_member in message.new_chat_members:
+        if not new_member.is_bot:
+            name = new_member.first_name
+            username = f"@{new_member.username}" if new_member.username else name
+            welcome_message = getattr(core, 'welcome_text', "🎉 ကြိုဆိုပါတယ် {name}! Group ကို လာရောက်ပါရှင့်အတွက် ကျေးဇူးတင်ပါတယ်။")
+            await abot.reply_to(message, welcome_message.replace("{name}", name).replace("{username}", username))
+
+@abot.message_handler(commands=['start'])
+async def start_cmd(m):
+    track_chat(m.chat)
+    user_status = get_user_permission_status(m.from_user.id)
+    await abot.reply_to(m, f"💞 Bot စတင်ပြီးပါပြီ /help ကြည့်ပါ\nမသိတာရှိရင် Ownerကိုလာမေးပါ @mgcharlie\n\n{user_status}")
+
+# ================= MUSIC =================
+async def send_track(chat_id, row, icon="🎵"):
+    """Send a (id, file_id, title, artist) row and remember it as playing"""
+    await abot.send_audio(chat_id, row[1], caption=f"{icon} {row[2]} - {row[3]}")
+    current_play[chat_id] = row[0]
+
+async def show_browser_view(call, text, markup):
+    try:
+        await abot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except asyncio_helper.ApiTelegramException as e:
+        if "message is not modified" not in str(e):
+            raise
+
+@abot.message_handler(commands=['music'])
+async def music_menu_cmd(message):
+    text, markup = await db(render_folder_list)
+    if not text:
+        return await abot.reply_to(message, "⚠️ No folders")
+    await abot.send_message(message.chat.id, text, reply_markup=markup)
+
+@abot.message_handler(commands=['play'])
+async def play_cmd(message):
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        return await abot.reply_to(message, "❌ Usage: /play id|title")
+    param = args[1]
+    if param.isdigit():
+        entry = catalog.get(int(param))
+        row = (int(param), entry[2], entry[0], entry[1]) if entry else None
+    else:
+        results = await db(search_music, param, 1)
+        row = results[0] if results else None
+    if row:
+        await send_track(message.chat.id, row)
+    else:
+        await abot.reply_to(message, "⚠️ Music not found")
+
+@abot.message_handler(commands=['random'])
+async def random_music_cmd(message):
+    args = message.text.split()
+    folder_id = None
+    if len(args) > 1:
+        try:
+            folder_id = int(args[1])
+        except ValueError:
+            return await abot.reply_to(message, "❌ Usage: /random [folder_id]")
+    row = random_music(folder_id)
+    if row:
+        await send_track(message.chat.id, row)
+    else:
+        await abot.reply_to(message, "⚠️ No musics found")
+
+@abot.message_handler(commands=['search'])
+async def search_music_cmd(message):
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        return await abot.reply_to(message, "❌ Usage: /search query")
+    query = args[1]
+    text, markup = await db(render_search_page, query, 0)
+    if not text:
+        return await abot.reply_to(message, "⚠️ No music found")
+    sent = await abot.reply_to(message, text, reply_markup=markup)
+    if markup:
+        remember_search(sent.chat.id, sent.message_id, query)
+
+@abot.callback_query_handler(func=lambda c: c.data.startswith("msearch:"))
+async def search_page_callback(call):
+    offset = int(call.data.split(":")[1])
+    key = (call.message.chat.id, call.message.message_id)
+    with search_queries_lock:
+        query = search_queries.get(key)
+    if query is None:
+        return await abot.answer_callback_query(call.id, "⚠️ Search expired, please /search again")
+    await abot.answer_callback_query(call.id)
+    text, markup = await db(render_search_page, query, offset)
+    if text:
+        await abot.edit_message_text(text, key[0], key[1], reply_markup=markup)
+
+@abot.message_handler(commands=['next', 'skip'])
+async def next_music_cmd(message):
+    chat_id = message.chat.id
+    if chat_id not in playlist and not start_queue(chat_id):
+        return await abot.reply_to(message, "⚠️ No musics found")
+    row = queue_step(chat_id, 1)
+    if row:
+        await send_track(chat_id, row, "⏭️")
+    else:
+        await abot.reply_to(message, "⚠️ No musics found")
+
+@abot.message_handler(commands=['prev'])
+async def prev_music_cmd(message):
+    row = queue_step(message.chat.id, -1)
+    if row:
+        await send_track(message.chat.id, row, "⏮️")
+    else:
+        await abot.reply_to(message, "⚠️ No previous track in the queue")
+
+@abot.message_handler(commands=['queue'])
+async def queue_cmd(message):
+    chat_id = message.chat.id
+    args = message.text.split()
+    if len(args) > 1:
+        if args[1] == "stop":
+            stop_queue(chat_id)
+            return await abot.reply_to(message, "⏹ Queue cleared")
+        try:
+            folder_id = None if args[1] == "all" else int(args[1])
+        except ValueError:
+            return await abot.reply_to(message, "❌ Usage: /queue [folder_id|all|stop]")
+        queue = start_queue(chat_id, folder_id)
+        if not queue:
+            return await abot.reply_to(message, "⚠️ No musics found")
+        source = "whole library" if folder_id is None else f"Folder ID {folder_id}"
+        return await abot.reply_to(message, f"🔀 Shuffle queue started: {len(queue['ids'])} tracks from {source}\nUse /next, /prev and /queue")
+
+    queue = playlist.get(chat_id)
+    if not queue:
+        return await abot.reply_to(message, "⚠️ No queue. Start one with /queue [folder_id|all] or /next")
+    source = "Whole library" if queue['folder_id'] is None else f"Folder ID {queue['folder_id']}"
+    text = f"🎶 <b>Queue</b> ({source})\nPosition: {queue['position'] + 1}/{len(queue['ids'])}\n"
+    mid = current_play.get(chat_id)
+    if mid in catalog:
+        text += f"Now: {catalog[mid][0]} - {catalog[mid][1]}\n"
+    upcoming = queue_upcoming(chat_id)
+    if upcoming:
+        text += "\nUp next:\n"
+        for i, row in enumerate(upcoming, 1):
+            text += f"{i}. {row[2]} - {row[3]}\n"
+    await abot.reply_to(message, text)
+
+@abot.callback_query_handler(func=lambda c: c.data.startswith("folder_member:"))
+async def folder_member_callback(call):
+    folder_id = int(call.data.split(":")[1])
+    text, markup = await db(render_folder_page, folder_id)
+    if not text:
+        return await abot.answer_callback_query(call.id, "⚠️ No musics in this folder")
+    await abot.answer_callback_query(call.id)
+    await show_browser_view(call, text, markup)
+
+@abot.callback_query_handler(func=lambda c: c.data.startswith("fpage:"))
+async def folder_page_callback(call):
+    await abot.answer_callback_query(call.id)
+    _, folder_id, direction, anchor = call.data.split(":")
+    text, markup = await db(render_folder_page, int(folder_id), direction, int(anchor))
+    if text:
+        await show_browser_view(call, text, markup)
+
+@abot.callback_query_handler(func=lambda c: c.data == "music_folders")
+async def music_folders_callback(call):
+    await abot.answer_callback_query(call.id)
+    text, markup = await db(render_folder_list)
+    if text:
+        await show_browser_view(call, text, markup)
+
+@abot.callback_query_handler(func=lambda c: c.data.startswith("play:"))
+async def play_callback(call):
+    mid = int(call.data.split(":")[1])
+    entry = catalog.get(mid)
+    if not entry:
+        return await abot.answer_callback_query(call.id, "⚠️ Music not found")
+    await send_track(call.message.chat.id, (mid, entry[2], entry[0], entry[1]))
+    await abot.answer_callback_query(call.id, f"▶️ Playing {entry[0]}")
+
+@abot.inline_handler(func=lambda q: True)
+async def inline_music_query(query):
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+    ids = catalog_search(query.query)
+    results = []
+    for mid in ids[offset:offset + INLINE_PAGE_SIZE]:
+        entry = catalog.get(mid)
+        if entry:
+            title, artist, file_id, _ = entry
+            results.append(types.InlineQueryResultCachedAudio(str(mid), file_id, caption=f"🎵 {title} - {artist}"))
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(ids) else ""
+    await abot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
+# ================= ADMIN MANAGEMENT =================
+OWNER_ONLY = "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး"
+
+@abot.message_handler(commands=['add_admin', 'remove_admin', 'unban_admin', 'ban_admin', 'admin_unlimit'])
+async def admin_change_cmd(m):
+    if not is_owner(m.from_user.id):
+        return await abot.reply_to(m, OWNER_ONLY)
+    command = m.text.split()[0].split('@')[0][1:]
+    args = m.text.split()
+    if len(args) < 2:
+        return await abot.reply_to(m, f"❌ /{command} id သုံးပါ")
+    try:
+        user_id = int(args[1])
+    except ValueError:
+        return await abot.reply_to(m, "❌ Invalid user ID")
+    if command == 'ban_admin' and user_id == OWNER_ID:
+        return await abot.reply_to(m, "❌ Owner ကို ban မလုပ်ဘူး")
+    action, done = {
+        'add_admin': (add_admin_db, "✔️ Admin ထည့်ပြီးပါပြီ"),
+        'remove_admin': (remove_admin_db, f"✔️ Admin {user_id} ဖယ်ရှားပြီးပါပြီ"),
+        'ban_admin': (ban_admin, f"✅ Admin {user_id} ကို ban လုပ်ပြီးပါပြီ"),
+        'unban_admin': (unban_admin, f"✔️ Admin {user_id} ban ဖြုတ်ပြီးပါပြီ"),
+        'admin_unlimit': (remove_admin_limit, f"✅ Admin {user_id} ကို limit ဖျက်ပြီးပါပြီ"),
+    }[command]
+    try:
+        await db(action, user_id)
+    except Exception as e:
+        print(f"Error in /{command}: {e}")
+        return await abot.reply_to(m, "❌ Error")
+    await abot.reply_to(m, done)
+
+@abot.message_handler(commands=['admin_limit'])
+async def admin_limit_cmd(m):
+    if not is_owner(m.from_user.id):
+        return await abot.reply_to(m, OWNER_ONLY)
+    args = m.text.split()
+    if len(args) < 3:
+        return await abot.reply_to(m, "❌ /admin_limit user_id daily_limit သုံးပါ")
+    try:
+        user_id, limit = int(args[1]), int(args[2])
+        await db(set_admin_limit, user_id, limit)
+    except Exception:
+        return await abot.reply_to(m, "❌ Invalid user ID or limit")
+    await abot.reply_to(m, f"✅ Admin {user_id} ကို daily limit {limit} သတ်ပြီးပါပြီ")
+
+@abot.message_handler(commands=['adminlist'])
+async def adminlist_cmd(m):
+    if not is_admin(m.from_user.id):
+        return await abot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
+    # The roster fetches missing profiles on its own pool; cached calls return at once
+    admins = [entry for entry in await bridge(admin_roster) if entry.is_admin]
+    if not admins:
+        return await abot.reply_to(m, "⚠️ No admins found")
+    await abot.reply_to(m, render_adminlist(admins))
+
+# ================= DASHBOARDS =================
+@abot.message_handler(commands=['dashboard'])
+async def dashboard_cmd(m):
+    if not is_owner(m.from_user.id):
+        return await abot.reply_to(m, OWNER_ONLY)
+    text, markup = await db(render_dashboard)
+    await abot.send_message(m.chat.id, text, reply_markup=markup)
+
+@abot.message_handler(commands=['preview'])
+async def preview_cmd(m):
+    if not is_admin(m.from_user.id):
+        return await abot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
+    await abot.reply_to(m, await db(render_preview, m.from_user.id))
+
+@abot.message_handler(commands=['gp_list'])
+async def gp_list_cmd(m):
+    if not is_admin(m.from_user.id):
+        return await abot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
+    text = await db(render_gp_list)
+    await abot.reply_to(m, text or "⚠️ No groups tracked yet")
+
+# ================= SYNC FALLBACK =================
+# Everything not ported above (templates, love/fight modes, auto replies,
+# broadcasts...) runs through bot.py's own handlers on a bridge thread.
+@abot.message_handler(func=lambda m: True, content_types=telebot.util.content_type_media + telebot.util.content_type_service)
+async def sync_message_fallback(m):
+    await bridge(core.bot.process_new_messages, [m])
+
+@abot.callback_query_handler(func=lambda c: True)
+async def sync_callback_fallback(call):
+    await bridge(core.bot.process_new_callback_query, [call])
+
+core.instrument_handlers(abot, skip={'sync_message_fallback', 'sync_callback_fallback'})
+
+# ================= RUN BOT =================
+async def main():
+    core.start_background_workers()
+    print("🤖 Bot is running (asyncio)...")
+    print(f"👑 Owner ID: {OWNER_ID}")
+    try:
+        await abot.infinity_polling()
+    finally:
+        if asyncio_helper.session_manager.session:
+            await asyncio_helper.session_manager.session.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from bench_runtimes import ADMIN_IDS, OWNER_ID, WORDS, percentile, seed_database, unthrottle
+from fake_api import FakeBotAPI, arm_rate_limits
+
+# ================= HANDLER BENCHMARK =================
+# Replays a synthetic update stream through the real bot.py handlers, polling
+# a local fake Bot API, and reports throughput, per-update handler latency,
+# DB time and API calls per update plus a per-handler breakdown (from the
+# HANDLER METRICS counters). Results go to a JSON file; pass --compare with an
+# earlier one to see what a change did.
+#
+#   python bench.py --scenario mixed --updates 3000 --latency 0.02
+#   python bench.py --scenario chatter --compare bench_results/chatter-before.json
+
+CHATTER = ["hi", "lol", "ok", "good night", "ဟုတ်လား", "haha", "where are you?", "😂", "same", "let's go"]
+TROLL_USERS = range(2000, 2003)    # trolled in every 4th chat
+FUNNY_PAIR = (2003, 2004)          # funny pair in every 6th chat
+CHAT_USERS = 40                    # chatter comes from 2000..2000+CHAT_USERS
+
+SCENARIOS = {
+    # weights over update kinds
+    "mixed": {"chatter": 40, "music": 25, "callback": 15, "join": 10, "owner": 10},
+    "chatter": {"chatter": 100},
+    "music": {"music": 70, "callback": 30},
+    "joins": {"join": 60, "chatter": 40},
+    "callbacks": {"callback": 100},
+}
+
+class Stream:
+    """Reproducible update dicts for one scenario"""
+
+    def __init__(self, chats, tracks, seed=1):
+        self.rng = random.Random(seed)
+        self.chats, self.tracks = chats, tracks
+        self.next_id = 0
+
+    def _id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def _chat(self):
+        chat_id = -1000000 - self.rng.randrange(self.chats)
+        return {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"}
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"}
+
+    def _message(self, text, user_id, **extra):
+        message = {"message_id": self._id(), "date": int(time.time()), "chat": self._chat(),
+                   "from": self._user(user_id), **extra}
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": self._id(), "message": message}
+
+    def chatter(self):
+        return self._message(self.rng.choice(CHATTER), 2000 + self.rng.randrange(CHAT_USERS))
+
+    def music(self):
+        rng = self.rng
+        text = rng.choice(["/random", "/random", "/next", "/music", "/queue", "/prev",
+                           f"/play {rng.randint(1, self.tracks)}", f"/search {rng.choice(WORDS)}"])
+        return self._message(text, 3000 + rng.randrange(500))
+
+    def owner(self):
+        return self._message(self.rng.choice(["/gp_list", "/dashboard", "/adminlist", "/preview"]), OWNER_ID)
+
+    def join(self):
+        members = [self._user(5000 + self.rng.randrange(100000)) for _ in range(self.rng.choice([1, 1, 1, 2, 3]))]
+        return self._message(None, members[0]["id"], new_chat_members=members)
+
+    def callback(self):
+        rng = self.rng
+        folder = rng.randint(1, 20)
+        data = rng.choice(["music_folders", f"folder_member:{folder}", f"play:{rng.randint(1, self.tracks)}",
+                           f"fpage:{folder}:{rng.choice('ab')}:{rng.randint(1, self.tracks)}"])
+        user = self._user(3000 + rng.randrange(500))
+        message = {"message_id": self._id(), "date": int(time.time()), "chat": self._chat(),
+                   "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"}, "text": "🎵"}
+        return {"update_id": self._id(), "callback_query": {
+            "id": str(self._id()), "chat_instance": "bench", "data": data, "from": user, "message": message}}
+
+    def updates(self, scenario, count):
+        kinds = SCENARIOS[scenario]
+        names, weights = list(kinds), list(kinds.values())
+        return [getattr(self, self.rng.choices(names, weights)[0])() for _ in range(count)]
+
+# ================= WORKER (child process) =================
+def seed_tables(tracks, chats):
+    seed_database(tracks, chats)
+    import bot as core
+    for i in range(10):
+        core.add_message_template(f"bench template {i}")
+        core.add_love_message(f"bench love {i}")
+    for uid in range(2000, 2000 + CHAT_USERS, 3):
+        core.set_nickname(uid, f"Nick{uid}")
+
+def run_worker(count, chats, timeout, seed=1):
+    import bot as core
+    unthrottle(core)
+    random.seed(seed)    # handlers pick random tracks and templates
+    for i in range(0, chats, 4):
+        core.troll_targets[-1000000 - i] = {uid: 0 for uid in TROLL_USERS}
+    for i in range(0, chats, 6):
+        core.funny_pairs[-1000000 - i] = FUNNY_PAIR
+
+    received, handled, done = {}, [], []
+    dispatch, process = core.bot.process_new_updates, core._process_updates
+
+    def timed_dispatch(updates):
+        now = time.monotonic()
+        for update in updates:
+            received[update.update_id] = now
+        dispatch(updates)
+
+    def timed_process(updates):
+        started = time.perf_counter()
+        try:
+            process(updates)
+        finally:
+            handled.append(time.perf_counter() - started)
+            now = time.monotonic()
+            done.extend(now - received[update.update_id] for update in updates)
+    core.bot.process_new_updates = timed_dispatch
+    core._process_updates = timed_process
+
+    started = time.monotonic()
+    threading.Thread(target=core.bot.infinity_polling, kwargs={"timeout": 1, "long_polling_timeout": 1},
+                     daemon=True).start()
+    while len(done) < count and time.monotonic() - started < timeout:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - started
+    core.flush_tracked_chats()
+
+    handlers = {}
+    metrics = core.collect_handler_metrics()
+    for name, m in sorted(metrics.items(), key=lambda item: -item[1].latency.total):
+        h = m.latency
+        if h.count:
+            handlers[name] = {"calls": h.count, "avg_ms": round(h.total / h.count * 1000, 3),
+                              "p95_ms_le": h.quantile(0.95) * 1000, "db_ms": round(m.db_time / h.count * 1000, 3),
+                              "api_ms": round(m.api_time / h.count * 1000, 3), "errors": sum(m.errors.values())}
+    n = max(1, len(done))
+    return {
+        "handled": len(done),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(done) / elapsed, 1),
+        "p50_ms": round(percentile(handled, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(handled, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(handled, 0.99) * 1000, 2),
+        "end_to_end_p50_ms": round(percentile(done, 0.50) * 1000, 1),
+        "end_to_end_p99_ms": round(percentile(done, 0.99) * 1000, 1),
+        "db_ms_per_update": round(sum(m.db_time for m in metrics.values()) / n * 1000, 3),
+        "handlers": handlers,
+    }
+
+# ================= DRIVER =================
+SUMMARY_KEYS = ["updates_per_sec", "p50_ms", "p95_ms", "p99_ms", "end_to_end_p99_ms",
+                "db_ms_per_update", "api_calls_per_update"]
+
+def worker_env(api, db_path):
+    return dict(os.environ, BOT_TOKEN="123:bench", DB_PATH=str(db_path), TELEGRAM_API_URL=api.url,
+                METRICS_PORT="0", CAPTURE_DIR="")
+
+def seed_worker_db(env, tracks, chats):
+    subprocess.run([sys.executable, __file__, "--worker", "seed", "--tracks", str(tracks), "--chats", str(chats)],
+                   env=env, check=True, capture_output=True)
+
+def start_worker(env, count, chats, timeout, seed):
+    """Bot process that polls the fake API until count updates are handled"""
+    return subprocess.Popen(
+        [sys.executable, __file__, "--worker", "run", "--updates", str(count), "--chats", str(chats),
+         "--timeout", str(timeout), "--seed", str(seed)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def finish_worker(proc, api, name, timeout):
+    """Wait for a worker and add the fake API's call counts to its stats"""
+    stdout, stderr = proc.communicate(timeout=timeout + 60)
+    lines = [line for line in stdout.splitlines() if line.startswith("{")]
+    if proc.returncode or not lines:
+        raise RuntimeError(f"{name} worker failed:\n{stdout}\n{stderr}")
+    stats = json.loads(lines[-1])
+    api_calls = {method: n for method, n in api.calls.items() if method != "getUpdates"}
+    stats["api_calls_per_update"] = round(sum(api_calls.values()) / max(1, stats["handled"]), 3)
+    stats["api_calls"] = dict(sorted(api_calls.items()))
+    stats["rate_limited"] = sum(api.failed.values())
+    return stats
+
+def run_scenario(api, args, scenario, tmp):
+    env = worker_env(api, Path(tmp) / f"{scenario}.db")
+    seed_worker_db(env, args.tracks, args.chats)
+    api.reset_stats()
+    arm_rate_limits(api, args.rate_limit)
+    api.push_updates(Stream(args.chats, args.tracks, args.seed).updates(scenario, args.updates))
+    proc = start_worker(env, args.updates, args.chats, args.timeout, args.seed)
+    return finish_worker(proc, api, scenario, args.timeout)
+
+def print_result(scenario, stats, previous=None):
+    print(f"\n== {scenario}: {stats['handled']} updates in {stats['seconds']}s")
+    for key in SUMMARY_KEYS:
+        line = f"  {key:<22}{stats[key]:>10}"
+        if previous and previous.get(key):
+            line += f"   ({(stats[key] - previous[key]) / previous[key] * 100:+.1f}% vs {previous[key]})"
+        print(line)
+    print(f"  {'handler':<28}{'calls':>7}{'avg ms':>9}{'db ms':>8}{'api ms':>8}{'errors':>7}")
+    for name, h in list(stats["handlers"].items())[:12]:
+        print(f"  {name:<28}{h['calls']:>7}{h['avg_ms']:>9}{h['db_ms']:>8}{h['api_ms']:>8}{h['errors']:>7}")
+
+def parse_latencies(items):
+    """{method: seconds} from METHOD=SECONDS options"""
+    latencies = {}
+    for item in items:
+        method, _, seconds = item.partition("=")
+        latencies[method] = float(seconds)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot.py handlers against a fake Bot API")
+    parser.add_argument("--scenario", choices=list(SCENARIOS) + ["all"], default="mixed")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--tracks", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API seconds per call")
+    parser.add_argument("--method-latency", action="append", default=[], metavar="METHOD=SECONDS",
+                        help="per-method latency, e.g. sendAudio=0.2 (repeatable)")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="METHOD=TIMES",
+                        help="answer the first TIMES calls of METHOD with a 429 to exercise retries (repeatable)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--out", help="results file (default bench_results/bench-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--worker", choices=["seed", "run"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == "seed":
+        return seed_tables(args.tracks, args.chats)
+    if args.worker:
+        print(json.dumps(run_worker(args.updates, args.chats, args.timeout, args.seed)))
+        sys.stdout.flush()
+        os._exit(0)
+
+    latencies = parse_latencies(args.method_latency)
+    previous = json.loads(Path(args.compare).read_text())["results"] if args.compare else {}
+
+    api = FakeBotAPI(latency=args.latency, latencies=latencies).start()
+    scenarios = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in scenarios:
+            results[scenario] = run_scenario(api, args, scenario, tmp)
+            print_result(scenario, results[scenario], previous.get(scenario))
+    api.stop()
+
+    out = Path(args.out or f"bench_results/bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    config = {k: v for k, v in vars(args).items() if k not in ("worker", "out", "compare")}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"config": config, "results": results}, indent=2))
+    print(f"\nResults written to {out}")
+
+if __name__ == "__main__":
+    main()
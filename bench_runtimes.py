@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from fake_api import FakeBotAPI, arm_rate_limits
+
+# ================= RUNTIME BENCHMARK =================
+# Runs the sync (bot.py) and asyncio (async_bot.py) runtimes against the fake
+# Bot API with the same synthetic update stream and compares them. Each
+# runtime polls getUpdates in its own process over a freshly seeded database,
+# with the outbound rate limits lifted so the runtime itself is measured.
+#
+#   python bench_runtimes.py --updates 2000 --chats 200 --latency 0.05
+
+WORDS = ["love", "night", "rain", "dream", "heart", "sky", "fire", "ocean", "star", "road"]
+OWNER_ID = 7402783150
+ADMIN_IDS = [1001, 1002, 1003, 1004, 1005]
+
+def synthetic_updates(count, chats, tracks, seed=1):
+    """A reproducible mix of music, admin and dashboard traffic"""
+    rng = random.Random(seed)
+    mix = [
+        (30, lambda: "/random"),
+        (20, lambda: "/next"),
+        (10, lambda: f"/play {rng.randint(1, tracks)}"),
+        (10, lambda: f"/search {rng.choice(WORDS)}"),
+        (8, lambda: "/music"),
+        (7, lambda: "/queue"),
+        (5, lambda: "/gp_list"),
+        (4, lambda: "/dashboard"),
+        (3, lambda: "/adminlist"),
+        (3, lambda: "/preview"),
+    ]
+    weights = [w for w, _ in mix]
+    updates = []
+    for i in range(1, count + 1):
+        chat_id = -1000000 - rng.randrange(chats)
+        text = rng.choices(mix, weights)[0][1]()
+        user_id = OWNER_ID if text in ("/gp_list", "/dashboard", "/adminlist", "/preview") else 2000 + rng.randrange(500)
+        updates.append({"update_id": i, "message": {
+            "message_id": i, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "text": text, "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        }})
+    return updates
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0
+
+# ================= WORKER (child process) =================
+def seed_database(tracks, chats):
+    import bot as core
+    with core.db_transaction() as db:
+        db.executemany("INSERT INTO folders (name, description) VALUES (?, ?)",
+                       [(f"Folder {i}", "bench") for i in range(1, 21)])
+        db.executemany("INSERT INTO musics (title, artist, file_id, folder_id) VALUES (?, ?, ?, ?)",
+                       [(f"{WORDS[i % len(WORDS)].title()} Song {i}", f"Artist {i % 50}", f"file-{i}", i % 20 + 1)
+                        for i in range(1, tracks + 1)])
+        db.executemany("INSERT OR IGNORE INTO chats (chat_id, chat_type, title, is_active) VALUES (?, 'supergroup', ?, 1)",
+                       [(-1000000 - i, f"Group {i}") for i in range(chats)])
+        db.executemany("INSERT OR IGNORE INTO admins (id) VALUES (?)", [(i,) for i in ADMIN_IDS])
+
+def unthrottle(core):
+    """Lift the outbound limits; the fake API doesn't enforce any"""
+    core.SEND_PRIVATE_RATE = core.SEND_GROUP_RATE = 1e9
+    core.SEND_PRIVATE_BURST = core.SEND_GROUP_BURST = 1e9
+    core.send_scheduler.bucket = core.TokenBucket(1e9)
+
+def run_worker(runtime, count, timeout):
+    import bot as core
+    unthrottle(core)
+    received, done = {}, []
+    peak_threads = [threading.active_count()]
+
+    def sample_threads():
+        while True:
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.05)
+    threading.Thread(target=sample_threads, daemon=True).start()
+
+    def arrived(updates):
+        now = time.monotonic()
+        for update in updates:
+            received[update.update_id] = now
+
+    def finished(updates):
+        now = time.monotonic()
+        done.extend(now - received[update.update_id] for update in updates)
+
+    started = time.monotonic()
+    if runtime == "sync":
+        dispatch, process = core.bot.process_new_updates, core._process_updates
+
+        def timed_dispatch(updates):
+            arrived(updates)
+            dispatch(updates)
+
+        def timed_process(updates):
+            process(updates)
+            finished(updates)
+        core.bot.process_new_updates = timed_dispatch
+        core._process_updates = timed_process
+        threading.Thread(target=core.bot.infinity_polling, kwargs={"timeout": 1, "long_polling_timeout": 1},
+                         daemon=True).start()
+        while len(done) < count and time.monotonic() - started < timeout:
+            time.sleep(0.01)
+    else:
+        import asyncio
+        import async_bot
+
+        dispatch, process = async_bot.abot.process_new_updates, async_bot._process_new_updates
+
+        async def timed_dispatch(updates):
+            arrived(updates)
+            await dispatch(updates)
+
+        async def timed_process(updates):
+            await process(updates)
+            finished(updates)
+        async_bot.abot.process_new_updates = timed_dispatch
+        async_bot._process_new_updates = timed_process
+
+        async def main():
+            polling = asyncio.create_task(async_bot.abot.polling(timeout=1, request_timeout=5))
+            while len(done) < count and time.monotonic() - started < timeout:
+                await asyncio.sleep(0.01)
+            polling.cancel()
+        asyncio.run(main())
+    elapsed = time.monotonic() - started
+    return {
+        "runtime": runtime,
+        "handled": len(done),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(done) / elapsed, 1),
+        "p50_ms": round(percentile(done, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(done, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(done, 0.99) * 1000, 1),
+        "peak_threads": peak_threads[0],
+    }
+
+# ================= DRIVER =================
+def run_runtime(runtime, api, updates, env, timeout, rate_limits=()):
+    api.reset_stats()
+    arm_rate_limits(api, rate_limits)
+    api.push_updates(updates)
+    result = subprocess.run(
+        [sys.executable, __file__, "--worker", runtime, "--updates", str(len(updates)), "--timeout", str(timeout)],
+        env=env, capture_output=True, text=True, timeout=timeout + 60)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode or not lines:
+        raise RuntimeError(f"{runtime} worker failed:\n{result.stdout}\n{result.stderr}")
+    stats = json.loads(lines[-1])
+    api_calls = sum(n for method, n in api.calls.items() if method != "getUpdates")
+    stats["api_calls_per_update"] = round(api_calls / max(1, stats["handled"]), 2)
+    stats["max_in_flight"] = api.max_in_flight
+    stats["rate_limited"] = sum(api.failed.values())
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sync and asyncio runtimes against a fake Bot API")
+    parser.add_argument("--runtime", choices=["sync", "async", "both"], default="both")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--tracks", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake API seconds per call")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="METHOD=TIMES",
+                        help="answer the first TIMES calls of METHOD with a 429 to exercise retries (repeatable)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--out", default="bench_results/runtimes.json")
+    parser.add_argument("--worker", choices=["sync", "async", "seed"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == "seed":
+        return seed_database(args.tracks, args.chats)
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.updates, args.timeout)))
+        sys.stdout.flush()
+        os._exit(0)
+
+    api = FakeBotAPI(latency=args.latency).start()
+    runtimes = ["sync", "async"] if args.runtime == "both" else [args.runtime]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for runtime in runtimes:
+            db_path = Path(tmp) / f"{runtime}.db"
+            env = dict(os.environ, BOT_TOKEN="123:bench", DB_PATH=str(db_path), TELEGRAM_API_URL=api.url)
+            subprocess.run([sys.executable, __file__, "--worker", "seed", "--tracks", str(args.tracks),
+                            "--chats", str(args.chats)], env=env, check=True, capture_output=True)
+            updates = synthetic_updates(args.updates, args.chats, args.tracks)
+            stats = run_runtime(runtime, api, updates, env, args.timeout, args.rate_limit)
+            results.append(stats)
+            print(f"{runtime:>5}: {stats['updates_per_sec']:>8} upd/s  p50 {stats['p50_ms']}ms  "
+                  f"p95 {stats['p95_ms']}ms  p99 {stats['p99_ms']}ms  "
+                  f"{stats['api_calls_per_update']} calls/upd  {stats['max_in_flight']} in flight  "
+                  f"{stats['peak_threads']} threads  {stats['rate_limited']} 429s")
+    api.stop()
+
+    report = {"config": {k: v for k, v in vars(args).items() if k != "worker"}, "results": results}
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.out).write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,33 @@ import telebot
 from telebot import types
 import sqlite3
 import threading
+import asyncio
+import contextvars
 import time
+import atexit
 import os
+import sys
+import json
+import gzip
+import hashlib
+import html
+import io
+import tracemalloc
+import hmac
+import secrets
+from pathlib import Path
+from contextlib import contextmanager
+from functools import wraps
 import random
+import re
+import bisect
+from array import array
+from collections import Counter, OrderedDict, namedtuple, deque
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -17,57 +41,368 @@ OWNER_ID = 7402783150
 if not TOKEN:
     print("❌ Error: BOT_TOKEN environment variable is required")
     exit(1)
+
+# Self-hosted Bot API server, or the fake API used by the benchmarks
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
     
-bot = telebot.TeleBot(TOKEN, parse_mode="HTML")
+# Updates are handled by the per-chat dispatcher below, not telebot's pool
+bot = telebot.TeleBot(TOKEN, parse_mode="HTML", threaded=False)
 
 # ================= DATABASE =================
-conn = sqlite3.connect("bot.db", check_same_thread=False)
-cursor = conn.cursor()
-
-# Original tables
-cursor.execute("CREATE TABLE IF NOT EXISTS admins (id INTEGER PRIMARY KEY)")
-cursor.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT)")
-cursor.execute("CREATE TABLE IF NOT EXISTS nicknames (user_id INTEGER PRIMARY KEY, nickname TEXT)")
-
-# New tables for enhanced features
-cursor.execute("CREATE TABLE IF NOT EXISTS love_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT)")
-cursor.execute("CREATE TABLE IF NOT EXISTS admin_limits (user_id INTEGER PRIMARY KEY, daily_limit INTEGER DEFAULT 100, used_today INTEGER DEFAULT 0, last_reset DATE)")
-cursor.execute("CREATE TABLE IF NOT EXISTS banned_admins (user_id INTEGER PRIMARY KEY, banned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
-
-# Music System tables
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS folders (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT UNIQUE,
-    description TEXT DEFAULT ''
-)
-""")
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS musics (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    title TEXT,
-    artist TEXT DEFAULT '',
-    file_id TEXT,
-    folder_id INTEGER,
-    FOREIGN KEY(folder_id) REFERENCES folders(id)
-)
-""")
-
-# Group tracking table
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS chats (
-        chat_id INTEGER PRIMARY KEY,
-        chat_type TEXT NOT NULL,
-        title TEXT,
-        username TEXT,
-        member_count INTEGER DEFAULT 0,
-        bot_joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        is_active BOOLEAN DEFAULT 1
-    )
-""")
+# One writer connection guarded by db_write_lock, plus one read-only
+# connection per thread. The DB runs in WAL mode so readers never wait on the
+# writer and always see the last committed state.
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_STATEMENT_CACHE = 256   # prepared statements kept per connection
+DB_CACHE_KB = 16000        # page cache per connection
+
+def _open_db(readonly=False):
+    if readonly:
+        uri = Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        db = sqlite3.connect(uri, uri=True, isolation_level=None, cached_statements=DB_STATEMENT_CACHE)
+    else:
+        db = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                             cached_statements=DB_STATEMENT_CACHE)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA temp_store=MEMORY")
+    db.execute("PRAGMA busy_timeout=5000")
+    db.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+    return db
+
+writer_db = _open_db()
+db_write_lock = threading.RLock()
+db_commits = 0    # bumped after every commit; caches compare it to know when to reload
+_reader = threading.local()
+class ThreadMetrics:
+    """One thread's handler counters and the handler it is running (see HANDLER METRICS)"""
+    __slots__ = ('current', 'handlers')
+
+    def __init__(self):
+        self.current = None
+        self.handlers = {}    # {handler name: HandlerCounters}, written by this thread only
+
+thread_metrics = []    # [(thread, ThreadMetrics)] for every thread that touched handler_context
+thread_metrics_lock = threading.Lock()
+
+class HandlerContext(threading.local):
+    def __init__(self):
+        self.state = ThreadMetrics()
+        with thread_metrics_lock:
+            thread_metrics.append((threading.current_thread(), self.state))
+
+# DB and API helpers charge their time to the running handler
+handler_context = HandlerContext()
+
+def charge_db_time(started):
+    metrics = handler_context.state.current
+    if metrics:
+        metrics.db_time += time.perf_counter() - started
+
+def charge_api_time(started):
+    metrics = handler_context.state.current
+    if metrics:
+        metrics.api_time += time.perf_counter() - started
+
+def _reader_db():
+    db = getattr(_reader, "db", None)
+    if db is None:
+        db = _reader.db = _open_db(readonly=True)
+    return db
+
+def db_read(sql, params=()):
+    """Run a SELECT on this thread's read-only connection and return all rows"""
+    started = time.perf_counter()
+    try:
+        return _reader_db().execute(sql, params).fetchall()
+    finally:
+        charge_db_time(started)
 
-conn.commit()
+def db_read_one(sql, params=()):
+    started = time.perf_counter()
+    try:
+        return _reader_db().execute(sql, params).fetchone()
+    finally:
+        charge_db_time(started)
+
+def db_scalar(sql, params=(), default=None):
+    """First column of the first row, e.g. for COUNT(*)"""
+    row = db_read_one(sql, params)
+    return row[0] if row and row[0] is not None else default
+
+@contextmanager
+def db_transaction():
+    """Hold the writer for several statements and commit them together"""
+    started = time.perf_counter()
+    try:
+        with db_write_lock:
+            writer_db.execute("BEGIN IMMEDIATE")
+            try:
+                yield writer_db
+            except BaseException:
+                writer_db.execute("ROLLBACK")
+                raise
+            writer_db.execute("COMMIT")
+            global db_commits
+            db_commits += 1
+    finally:
+        charge_db_time(started)
+
+def db_write(sql, params=()):
+    """Run one write statement in its own transaction; returns the cursor"""
+    with db_transaction() as db:
+        return db.execute(sql, params)
+
+def db_write_many(sql, seq):
+    with db_transaction() as db:
+        return db.executemany(sql, seq)
+
+# ================= SCHEMA MIGRATIONS =================
+# Migrations run once each, in order, in their own transaction, and record
+# themselves in schema_version. Append new ones; never edit an applied one.
+def row_counter_triggers(table, name):
+    """Triggers keeping counters[name] equal to the row count of table"""
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table} BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = '{name}';
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table} BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = '{name}';
+        END
+        """,
+    ]
+
+MIGRATIONS = [
+    (1, "base tables", [
+        # Original tables
+        "CREATE TABLE IF NOT EXISTS admins (id INTEGER PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT)",
+        "CREATE TABLE IF NOT EXISTS nicknames (user_id INTEGER PRIMARY KEY, nickname TEXT)",
+
+        # New tables for enhanced features
+        "CREATE TABLE IF NOT EXISTS love_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT)",
+        "CREATE TABLE IF NOT EXISTS admin_limits (user_id INTEGER PRIMARY KEY, daily_limit INTEGER DEFAULT 100, used_today INTEGER DEFAULT 0, last_reset DATE)",
+        "CREATE TABLE IF NOT EXISTS banned_admins (user_id INTEGER PRIMARY KEY, banned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+
+        # Music System tables
+        """
+        CREATE TABLE IF NOT EXISTS folders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE,
+            description TEXT DEFAULT ''
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS musics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            artist TEXT DEFAULT '',
+            file_id TEXT,
+            folder_id INTEGER,
+            FOREIGN KEY(folder_id) REFERENCES folders(id)
+        )
+        """,
+
+        # Group tracking table
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            chat_type TEXT NOT NULL,
+            title TEXT,
+            username TEXT,
+            member_count INTEGER DEFAULT 0,
+            bot_joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1
+        )
+        """,
+    ]),
+    (2, "indexes for folder browsing, chat lists and file lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_musics_folder ON musics(folder_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chats_active_seen ON chats(is_active, last_seen)",
+        "CREATE INDEX IF NOT EXISTS idx_musics_file ON musics(file_id)",
+    ]),
+    (3, "full-text index over music titles and artists", [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS musics_fts USING fts5(
+            title, artist,
+            content='musics', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS musics_fts_insert AFTER INSERT ON musics BEGIN
+            INSERT INTO musics_fts(rowid, title, artist) VALUES (new.id, new.title, new.artist);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS musics_fts_delete AFTER DELETE ON musics BEGIN
+            INSERT INTO musics_fts(musics_fts, rowid, title, artist) VALUES ('delete', old.id, old.title, old.artist);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS musics_fts_update AFTER UPDATE OF title, artist ON musics BEGIN
+            INSERT INTO musics_fts(musics_fts, rowid, title, artist) VALUES ('delete', old.id, old.title, old.artist);
+            INSERT INTO musics_fts(rowid, title, artist) VALUES (new.id, new.title, new.artist);
+        END
+        """,
+        "INSERT INTO musics_fts(musics_fts) VALUES ('rebuild')",
+    ]),
+    (4, "persisted per-chat play queues", [
+        """
+        CREATE TABLE IF NOT EXISTS chat_queues (
+            chat_id INTEGER PRIMARY KEY,
+            folder_id INTEGER,
+            seed INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT -1,
+            track_ids BLOB NOT NULL
+        )
+        """,
+    ]),
+    (5, "resumable broadcast jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            from_chat_id INTEGER,
+            message_id INTEGER,
+            text TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            PRIMARY KEY (job_id, chat_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(job_id, status)",
+    ]),
+    (6, "trigger-maintained counters for the dashboard screens", [
+        "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID",
+        "ALTER TABLE folders ADD COLUMN track_count INTEGER NOT NULL DEFAULT 0",
+        """
+        INSERT OR REPLACE INTO counters (name, value) VALUES
+            ('admins', (SELECT COUNT(*) FROM admins)),
+            ('banned_admins', (SELECT COUNT(*) FROM banned_admins)),
+            ('admin_limits', (SELECT COUNT(*) FROM admin_limits)),
+            ('messages', (SELECT COUNT(*) FROM messages)),
+            ('love_messages', (SELECT COUNT(*) FROM love_messages)),
+            ('folders', (SELECT COUNT(*) FROM folders)),
+            ('musics', (SELECT COUNT(*) FROM musics)),
+            ('chats', (SELECT COUNT(*) FROM chats)),
+            ('active_chats', (SELECT COUNT(*) FROM chats WHERE is_active=1)),
+            ('active_members', (SELECT COALESCE(SUM(member_count), 0) FROM chats WHERE is_active=1))
+        """,
+        "UPDATE folders SET track_count = (SELECT COUNT(*) FROM musics WHERE folder_id = folders.id)",
+        *row_counter_triggers("admins", "admins"),
+        *row_counter_triggers("banned_admins", "banned_admins"),
+        *row_counter_triggers("admin_limits", "admin_limits"),
+        *row_counter_triggers("messages", "messages"),
+        *row_counter_triggers("love_messages", "love_messages"),
+        *row_counter_triggers("folders", "folders"),
+        """
+        CREATE TRIGGER IF NOT EXISTS musics_count_insert AFTER INSERT ON musics BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'musics';
+            UPDATE folders SET track_count = track_count + 1 WHERE id = new.folder_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS musics_count_delete AFTER DELETE ON musics BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'musics';
+            UPDATE folders SET track_count = track_count - 1 WHERE id = old.folder_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS musics_count_move AFTER UPDATE OF folder_id ON musics
+        WHEN old.folder_id IS NOT new.folder_id BEGIN
+            UPDATE folders SET track_count = track_count - 1 WHERE id = old.folder_id;
+            UPDATE folders SET track_count = track_count + 1 WHERE id = new.folder_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chats_count_insert AFTER INSERT ON chats BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'chats';
+            UPDATE counters SET value = value + 1 WHERE name = 'active_chats' AND new.is_active = 1;
+            UPDATE counters SET value = value + COALESCE(new.member_count, 0) WHERE name = 'active_members' AND new.is_active = 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chats_count_delete AFTER DELETE ON chats BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'chats';
+            UPDATE counters SET value = value - 1 WHERE name = 'active_chats' AND old.is_active = 1;
+            UPDATE counters SET value = value - COALESCE(old.member_count, 0) WHERE name = 'active_members' AND old.is_active = 1;
+        END
+        """,
+        # The chat flush rewrites is_active on every upsert; only real changes count
+        """
+        CREATE TRIGGER IF NOT EXISTS chats_count_update AFTER UPDATE OF is_active, member_count ON chats
+        WHEN old.is_active IS NOT new.is_active OR old.member_count IS NOT new.member_count BEGIN
+            UPDATE counters SET value = value + (CASE WHEN new.is_active = 1 THEN 1 ELSE 0 END)
+                                              - (CASE WHEN old.is_active = 1 THEN 1 ELSE 0 END)
+            WHERE name = 'active_chats';
+            UPDATE counters SET value = value + (CASE WHEN new.is_active = 1 THEN COALESCE(new.member_count, 0) ELSE 0 END)
+                                              - (CASE WHEN old.is_active = 1 THEN COALESCE(old.member_count, 0) ELSE 0 END)
+            WHERE name = 'active_members';
+        END
+        """,
+    ]),
+]
+
+def run_migrations():
+    """Apply every migration newer than the stored schema version"""
+    with db_transaction() as db:
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    current = db_scalar("SELECT MAX(version) FROM schema_version", default=0)
+    for version, name, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        with db_transaction() as db:
+            for sql in statements:
+                db.execute(sql)
+            db.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+        print(f"🗄️ Applied migration {version}: {name}")
+
+run_migrations()
+
+# Queries on the message path or behind big screens; --explain prints their plans
+HOT_QUERIES = [
+    ("folder tracks", "SELECT id,title,artist FROM musics WHERE folder_id=?", (1,)),
+    ("counters", "SELECT name, value FROM counters", ()),
+    ("delete folder tracks", "DELETE FROM musics WHERE folder_id=?", (1,)),
+    ("tracked chats", "SELECT chat_id, chat_type, title, username, member_count, bot_joined_date, last_seen, is_active FROM chats ORDER BY is_active DESC, last_seen DESC", ()),
+    ("active chats", "SELECT chat_id, member_count FROM chats WHERE is_active=1", ()),
+    ("track by file_id", "SELECT id FROM musics WHERE file_id=?", ("",)),
+    ("folder page", "SELECT m.id, m.title, m.artist, f.name FROM musics m JOIN folders f ON f.id = m.folder_id WHERE m.folder_id=? AND m.id>? ORDER BY m.id LIMIT ?", (1, 0, 11)),
+    ("folder page back", "SELECT m.id, m.title, m.artist, f.name FROM musics m JOIN folders f ON f.id = m.folder_id WHERE m.folder_id=? AND m.id<? ORDER BY m.id DESC LIMIT ?", (1, 100, 11)),
+    ("music search", "SELECT rowid FROM musics_fts WHERE musics_fts MATCH ? ORDER BY bm25(musics_fts, 10.0, 5.0) LIMIT 10", ('"a"*',)),
+]
+
+def explain_hot_queries():
+    """Print EXPLAIN QUERY PLAN for HOT_QUERIES to confirm they use indexes"""
+    for label, sql, params in HOT_QUERIES:
+        print(f"-- {label}\n{sql}")
+        for row in db_read("EXPLAIN QUERY PLAN " + sql, params):
+            print(f"   {row[-1]}")
 
 # ================= STATES =================
 running_threads = {}  # Fight mode threads
@@ -83,70 +418,352 @@ hide_targets = {}        # {chat_id: set(user_ids)}
 
 # Music System states
 current_play = {}  # chat_id : music_id
-playlist = {}      # chat_id : list of music_ids
+playlist = {}      # chat_id : queue dict, see PLAY QUEUES
+
+# ================= ROLE REGISTRY =================
+# Permission checks run on almost every command, so roles live in an
+# immutable snapshot. Readers just grab the current `roles` object; the role
+# helpers write to the DB and then swap in a new snapshot with a higher
+# version, which other caches can compare against to notice changes.
+RoleSnapshot = namedtuple("RoleSnapshot", "version owner admins banned limits")
+roles = RoleSnapshot(0, OWNER_ID, frozenset(), frozenset(), MappingProxyType({}))
+roles_lock = threading.Lock()  # serializes role writers, readers never take it
+
+def _publish_roles(**changes):
+    global roles
+    roles = roles._replace(version=roles.version + 1, **changes)
+
+def load_roles():
+    """Load admins, bans and limits from the DB into a fresh snapshot"""
+    with roles_lock:
+        admins = frozenset(row[0] for row in db_read("SELECT id FROM admins"))
+        banned = frozenset(row[0] for row in db_read("SELECT user_id FROM banned_admins"))
+        limits = {row[0]: tuple(row[1:]) for row in db_read(
+            "SELECT user_id, daily_limit, used_today, last_reset FROM admin_limits")}
+        _publish_roles(admins=admins, banned=banned, limits=MappingProxyType(limits))
+
+def get_admin_limit(uid):
+    """(daily_limit, used_today, last_reset) or None if the admin has no limit"""
+    return roles.limits.get(uid)
 
 # ================= HELPERS =================
 def is_owner(uid):
     return uid == OWNER_ID
 
 def is_admin(uid):
-    if is_banned_admin(uid):
+    current = roles
+    if uid in current.banned:
         return False
-    cursor.execute("SELECT id FROM admins WHERE id=?", (uid,))
-    return cursor.fetchone() is not None or is_owner(uid)
+    return uid in current.admins or uid == current.owner
 
 def add_admin_db(uid):
-    cursor.execute("INSERT OR IGNORE INTO admins (id) VALUES (?)", (uid,))
-    conn.commit()
+    with roles_lock:
+        db_write("INSERT OR IGNORE INTO admins (id) VALUES (?)", (uid,))
+        _publish_roles(admins=roles.admins | {uid})
 
 def remove_admin_db(uid):
-    cursor.execute("DELETE FROM admins WHERE id=?", (uid,))
-    conn.commit()
+    with roles_lock:
+        db_write("DELETE FROM admins WHERE id=?", (uid,))
+        _publish_roles(admins=roles.admins - {uid})
 
 def add_message_template(text):
-    cursor.execute("INSERT INTO messages (text) VALUES (?)", (text,))
-    conn.commit()
+    db_write("INSERT INTO messages (text) VALUES (?)", (text,))
 
 def list_message_templates():
-    cursor.execute("SELECT id, text FROM messages")
-    return cursor.fetchall()
+    return db_read("SELECT id, text FROM messages")
 
 def remove_message(mid):
-    cursor.execute("DELETE FROM messages WHERE id=?", (mid,))
-    conn.commit()
+    db_write("DELETE FROM messages WHERE id=?", (mid,))
+
+# Nicknames are served from memory: the whole table is loaded at startup and
+# set/remove write through to it. A table past NICKNAME_PRELOAD_MAX is filled
+# lazily instead, caching misses too, and dropped when it doubles that size.
+NICKNAME_PRELOAD_MAX = 50000
+nicknames = {}              # {user_id: nickname, or None for a cached miss}
+nicknames_complete = False  # whole table loaded, an absent id has no nickname
+nicknames_lock = threading.Lock()
+nicknames_version = 0    # bumped on every nickname change, see ADMIN ROSTER
+
+def load_nicknames():
+    global nicknames, nicknames_complete
+    with nicknames_lock:
+        rows = db_read("SELECT user_id, nickname FROM nicknames LIMIT ?", (NICKNAME_PRELOAD_MAX + 1,))
+        nicknames_complete = len(rows) <= NICKNAME_PRELOAD_MAX
+        nicknames = dict(rows) if nicknames_complete else {}
+    print(f"👤 Loaded {len(nicknames)} nicknames" if nicknames_complete else "👤 Nicknames are loaded on demand")
 
 def set_nickname(user_id, nickname):
-    cursor.execute("INSERT OR REPLACE INTO nicknames (user_id,nickname) VALUES (?,?)", (user_id, nickname))
-    conn.commit()
+    global nicknames_version
+    with nicknames_lock:
+        db_write("INSERT OR REPLACE INTO nicknames (user_id,nickname) VALUES (?,?)", (user_id, nickname))
+        nicknames[user_id] = nickname
+        nicknames_version += 1
 
 def remove_nickname(user_id):
-    cursor.execute("DELETE FROM nicknames WHERE user_id=?", (user_id,))
-    conn.commit()
+    global nicknames_version
+    with nicknames_lock:
+        db_write("DELETE FROM nicknames WHERE user_id=?", (user_id,))
+        nicknames[user_id] = None
+        nicknames_version += 1
 
 def get_nickname(user_id):
-    cursor.execute("SELECT nickname FROM nicknames WHERE user_id=?", (user_id,))
-    row = cursor.fetchone()
-    return row[0] if row else None
+    try:
+        return nicknames[user_id]
+    except KeyError:
+        if nicknames_complete:
+            return None
+    with nicknames_lock:
+        if user_id not in nicknames:
+            if len(nicknames) >= 2 * NICKNAME_PRELOAD_MAX:
+                nicknames.clear()
+            row = db_read_one("SELECT nickname FROM nicknames WHERE user_id=?", (user_id,))
+            nicknames[user_id] = row[0] if row else None
+        return nicknames[user_id]
 
 def mention(user_id, name):
     return f"<a href='tg://user?id={user_id}'>{name}</a>"
 
 # ================= LOVE MESSAGE HELPERS =================
 def add_love_message(text):
-    cursor.execute("INSERT INTO love_messages (text) VALUES (?)", (text,))
-    conn.commit()
+    db_write("INSERT INTO love_messages (text) VALUES (?)", (text,))
 
 def list_love_messages():
-    cursor.execute("SELECT id, text FROM love_messages")
-    return cursor.fetchall()
+    return db_read("SELECT id, text FROM love_messages")
 
 def remove_love_message(mid):
-    cursor.execute("DELETE FROM love_messages WHERE id=?", (mid,))
-    conn.commit()
+    db_write("DELETE FROM love_messages WHERE id=?", (mid,))
 
 # ================= MUSIC SYSTEM HELPERS =================
+SEARCH_PAGE_SIZE = 10
+search_queries = OrderedDict()  # {(chat_id, message_id): query} for /search paging
+search_queries_lock = threading.Lock()
+SEARCH_QUERIES_MAX = 500
+
+def fts_query(text):
+    """Turn free text into an FTS5 query where every word must match as a prefix"""
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in text.split())
+
+def search_music(query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Best matches first (bm25, title weighted over artist): [(id, file_id, title, artist)]"""
+    match = fts_query(query)
+    if not match:
+        return []
+    return db_read("""
+        SELECT m.id, m.file_id, m.title, m.artist
+        FROM musics_fts JOIN musics m ON m.id = musics_fts.rowid
+        WHERE musics_fts MATCH ?
+        ORDER BY bm25(musics_fts, 10.0, 5.0)
+        LIMIT ? OFFSET ?
+    """, (match, limit, offset))
+
+def render_search_page(query, offset):
+    """Text and paging buttons for one page of /search results, or (None, None)"""
+    # One extra row tells us whether a next page exists
+    results = search_music(query, SEARCH_PAGE_SIZE + 1, offset)
+    if not results:
+        return None, None
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+    text = "🔍 Search Results:\n"
+    for r in results:
+        text += f"{r[0]} - {r[2]} by {r[3]}\n"
+    text += f"\nPage {offset // SEARCH_PAGE_SIZE + 1}"
+    text += "\nUse /play <id> to play a song"
+    buttons = []
+    if offset > 0:
+        buttons.append(types.InlineKeyboardButton("◀️ Prev", callback_data=f"msearch:{max(offset - SEARCH_PAGE_SIZE, 0)}"))
+    if has_next:
+        buttons.append(types.InlineKeyboardButton("Next ▶️", callback_data=f"msearch:{offset + SEARCH_PAGE_SIZE}"))
+    markup = None
+    if buttons:
+        markup = types.InlineKeyboardMarkup()
+        markup.row(*buttons)
+    return text, markup
+
+def remember_search(chat_id, message_id, query):
+    with search_queries_lock:
+        search_queries[(chat_id, message_id)] = query
+        while len(search_queries) > SEARCH_QUERIES_MAX:
+            search_queries.popitem(last=False)
+
+# ================= MUSIC CATALOG =================
+# An in-memory copy of the musics table with a sorted (token, id) list for
+# prefix lookups, so inline queries never touch SQLite. The music write
+# helpers below keep it in step with the DB and bump catalog_version.
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = 30       # seconds Telegram may cache an inline answer
+INLINE_MAX_MATCHES = 500     # results kept per query after ranking
+catalog = {}                 # {music_id: (title, artist, file_id, folder_id)}
+catalog_tokens = []          # sorted [(token, music_id)]
+catalog_version = 0
+catalog_lock = threading.RLock()
+# Random picks: dense arrays of ids plus id -> index maps, so add/remove are
+# O(1) (swap with the last element) and a pick is one randrange.
+track_ids = array('q')
+track_pos = {}               # {music_id: index in track_ids}
+folder_track_ids = {}        # {folder_id: array('q')}
+folder_track_pos = {}        # {folder_id: {music_id: index}}
+inline_results = OrderedDict()  # {(query, catalog_version): [music_id, ...]}
+INLINE_RESULTS_MAX = 256
+_TOKEN_SPLIT = re.compile(r"[\s\-_,.;:!?()\[\]{}/\\&+\"'|]+")
+
+def catalog_tokenize(*texts):
+    tokens = set()
+    for text in texts:
+        tokens.update(t for t in _TOKEN_SPLIT.split((text or "").casefold()) if t)
+    return tokens
+
+def _pool_add(pool, pos, mid):
+    pos[mid] = len(pool)
+    pool.append(mid)
+
+def _pool_remove(pool, pos, mid):
+    i = pos.pop(mid, None)
+    if i is None:
+        return
+    last = pool.pop()
+    if last != mid:
+        pool[i] = last
+        pos[last] = i
+
+def _catalog_insert(mid, title, artist, file_id, folder_id):
+    catalog[mid] = (title, artist, file_id, folder_id)
+    for token in catalog_tokenize(title, artist):
+        bisect.insort(catalog_tokens, (token, mid))
+    _pool_add(track_ids, track_pos, mid)
+    _pool_add(folder_track_ids.setdefault(folder_id, array('q')), folder_track_pos.setdefault(folder_id, {}), mid)
+
+def _catalog_delete(mid):
+    entry = catalog.pop(mid, None)
+    if entry is None:
+        return None
+    for token in catalog_tokenize(entry[0], entry[1]):
+        i = bisect.bisect_left(catalog_tokens, (token, mid))
+        if i < len(catalog_tokens) and catalog_tokens[i] == (token, mid):
+            del catalog_tokens[i]
+    _pool_remove(track_ids, track_pos, mid)
+    folder_id = entry[3]
+    if folder_id in folder_track_ids:
+        _pool_remove(folder_track_ids[folder_id], folder_track_pos[folder_id], mid)
+        if not folder_track_ids[folder_id]:
+            del folder_track_ids[folder_id], folder_track_pos[folder_id]
+    return entry
+
+def _catalog_changed():
+    global catalog_version
+    catalog_version += 1
+
+def load_catalog():
+    """Build the catalog, its token index and the random-pick arrays from the musics table"""
+    global catalog, catalog_tokens, track_ids, track_pos, folder_track_ids, folder_track_pos
+    rows = db_read("SELECT id, title, artist, file_id, folder_id FROM musics")
+    entries = {row[0]: tuple(row[1:]) for row in rows}
+    tokens = sorted((token, mid) for mid, e in entries.items() for token in catalog_tokenize(e[0], e[1]))
+    ids, pos, folder_ids, folder_pos = array('q'), {}, {}, {}
+    for mid, e in entries.items():
+        _pool_add(ids, pos, mid)
+        _pool_add(folder_ids.setdefault(e[3], array('q')), folder_pos.setdefault(e[3], {}), mid)
+    with catalog_lock:
+        catalog, catalog_tokens = entries, tokens
+        track_ids, track_pos, folder_track_ids, folder_track_pos = ids, pos, folder_ids, folder_pos
+        _catalog_changed()
+
+def random_music(folder_id=None):
+    """(id, file_id, title, artist) of a uniformly random track, or None"""
+    with catalog_lock:
+        pool = track_ids if folder_id is None else folder_track_ids.get(folder_id)
+        if not pool:
+            return None
+        mid = pool[random.randrange(len(pool))]
+        title, artist, file_id, _ = catalog[mid]
+    return mid, file_id, title, artist
+
+def _prefix_range(prefix):
+    """[lo, hi) of the catalog_tokens entries whose token starts with prefix"""
+    lo = bisect.bisect_left(catalog_tokens, (prefix,))
+    hi = bisect.bisect_left(catalog_tokens, (prefix + chr(0x10FFFF),), lo)
+    return lo, hi
+
+def catalog_search(query):
+    """Music ids whose title/artist words start with every query word, best first"""
+    q = " ".join(query.casefold().split())
+    key = (q, catalog_version)
+    with catalog_lock:
+        cached = inline_results.get(key)
+        if cached is not None:
+            inline_results.move_to_end(key)
+            return cached
+        words = catalog_tokenize(query)
+        if not words:
+            # No query: newest tracks first
+            ids = sorted(catalog, reverse=True)[:INLINE_MAX_MATCHES]
+        else:
+            # Intersect the words' id sets, smallest prefix range first; cap only after ranking
+            ranges = sorted((_prefix_range(w) for w in words), key=lambda r: r[1] - r[0])
+            lo, hi = ranges[0]
+            matches = {mid for _, mid in catalog_tokens[lo:hi]}
+            for lo, hi in ranges[1:]:
+                if not matches:
+                    break
+                matches &= {mid for _, mid in catalog_tokens[lo:hi]}
+            # Tracks whose title starts with the query rank first, then by title
+            ids = sorted(matches, key=lambda mid: (not (catalog[mid][0] or "").casefold().startswith(q),
+                                                   (catalog[mid][0] or "").casefold()))[:INLINE_MAX_MATCHES]
+        inline_results[key] = ids
+        while len(inline_results) > INLINE_RESULTS_MAX:
+            inline_results.popitem(last=False)
+        return ids
+
+# Music write helpers: every change to musics goes through these
+def add_music(title, artist, file_id, folder_id):
+    with catalog_lock:
+        mid = db_write("INSERT INTO musics (title,artist,file_id,folder_id) VALUES (?,?,?,?)",
+                       (title, artist, file_id, folder_id)).lastrowid
+        _catalog_insert(mid, title, artist, file_id, folder_id)
+        _catalog_changed()
+    return mid
+
+def update_music(mid, title, artist):
+    """Returns False if the music does not exist"""
+    with catalog_lock:
+        if db_write("UPDATE musics SET title=?, artist=? WHERE id=?", (title, artist, mid)).rowcount == 0:
+            return False
+        old = _catalog_delete(mid)
+        if old:
+            _catalog_insert(mid, title, artist, old[2], old[3])
+        _catalog_changed()
+    return True
+
+def remove_musics(ids):
+    with catalog_lock:
+        db_write_many("DELETE FROM musics WHERE id=?", [(mid,) for mid in ids])
+        for mid in ids:
+            _catalog_delete(mid)
+        _catalog_changed()
+
+def create_folder(name, description=''):
+    """Raises sqlite3.IntegrityError if the name is taken"""
+    with catalog_lock:
+        db_write("INSERT INTO folders (name, description) VALUES (?, ?)", (name, description))
+        _catalog_changed()
+
+def update_folder(folder_id, name, description=''):
+    with catalog_lock:
+        db_write("UPDATE folders SET name=?, description=? WHERE id=?", (name, description, folder_id))
+        _catalog_changed()
+
+def delete_folder(folder_id):
+    with catalog_lock:
+        with db_transaction() as db:
+            db.execute("DELETE FROM musics WHERE folder_id=?", (folder_id,))
+            db.execute("DELETE FROM folders WHERE id=?", (folder_id,))
+        for mid in list(folder_track_ids.get(folder_id, ())):
+            _catalog_delete(mid)
+        _catalog_changed()
+
 def owner_only(func):
     """Decorator for owner-only commands"""
+    @wraps(func)
     def wrapper(message):
         if message.from_user.id != OWNER_ID:
             return bot.reply_to(message, "❌ Owner သီးသန့်ပါ မင်းသုံးလို့မရဘူး")
@@ -155,6 +772,7 @@ def owner_only(func):
 
 def admin_or_owner_only(func):
     """Decorator for admin or owner commands"""
+    @wraps(func)
     def wrapper(message):
         if not is_admin(message.from_user.id):
             return bot.reply_to(message, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
@@ -170,49 +788,600 @@ def get_user_permission_status(user_id):
     else:
         return "👤 Member"
 
+# ================= PLAY QUEUES =================
+# A chat's queue is {'folder_id', 'ids', 'seed', 'position'}: a copy of the
+# track id array (not a shuffled copy), a seed, and the position in the
+# shuffle order. The order itself is computed per step by a seeded
+# permutation, so starting a queue does no shuffling and /prev just walks the
+# position back. Changes are written to chat_queues by the flush loop.
+dirty_queues = {}  # {chat_id: True if the id snapshot must be (re)written}
+queue_lock = threading.Lock()
+
+MIX64 = (1 << 64) - 1
+
+def _round_mix(seed, r, x):
+    """splitmix64 finalizer over (seed, round, x): fixed integer math, so the
+    order of a persisted queue is the same on every Python build"""
+    z = (seed * 0x9E3779B97F4A7C15 + r * 0xD1B54A32D192ED03 + x) & MIX64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MIX64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MIX64
+    return z ^ (z >> 31)
+
+def _shuffle_index(i, n, seed):
+    """Where position i lands in a seeded pseudo-random permutation of range(n)"""
+    # Small Feistel network over the next even power of two, with cycle
+    # walking to stay inside range(n); on average fewer than 4 rounds trips.
+    # Not hash(): chat_queues stores seed and position and rebuilds the order
+    # on restart, so the round function must not change between interpreters.
+    bits = max((n - 1).bit_length(), 2)
+    bits += bits % 2
+    half = bits // 2
+    mask = (1 << half) - 1
+    while True:
+        left, right = i >> half, i & mask
+        for r in range(4):
+            left, right = right, left ^ (_round_mix(seed, r, right) & mask)
+        i = (left << half) | right
+        if i < n:
+            return i
+
+def _new_queue(folder_id):
+    with catalog_lock:
+        pool = track_ids if folder_id is None else folder_track_ids.get(folder_id)
+        if not pool:
+            return None
+        ids = array('q', pool)
+    return {'folder_id': folder_id, 'ids': ids, 'seed': random.getrandbits(32), 'position': -1}
+
+def _queue_track(queue, position):
+    mid = queue['ids'][_shuffle_index(position, len(queue['ids']), queue['seed'])]
+    entry = catalog.get(mid)
+    return (mid, entry[2], entry[0], entry[1]) if entry else None
+
+def start_queue(chat_id, folder_id=None):
+    """Start a no-repeat shuffle over the library or one folder; None if empty"""
+    queue = _new_queue(folder_id)
+    if queue:
+        with queue_lock:
+            playlist[chat_id] = queue
+            dirty_queues[chat_id] = True
+    return queue
+
+def stop_queue(chat_id):
+    with queue_lock:
+        if playlist.pop(chat_id, None) is not None:
+            dirty_queues[chat_id] = True
+
+def queue_step(chat_id, step):
+    """Move the queue by step (1 or -1); (id, file_id, title, artist) or None"""
+    with queue_lock:
+        queue = playlist.get(chat_id)
+        if queue is None:
+            return None
+        position = queue['position']
+        while True:
+            position += step
+            if position < 0:
+                return None
+            if position >= len(queue['ids']):
+                # Round finished, reshuffle whatever the source holds now
+                queue = _new_queue(queue['folder_id'])
+                if queue is None:
+                    return None
+                playlist[chat_id] = queue
+                dirty_queues[chat_id] = True
+                position = 0
+            # Tracks removed since the queue started are skipped
+            track = _queue_track(queue, position)
+            if track:
+                break
+        queue['position'] = position
+        dirty_queues.setdefault(chat_id, False)
+    current_play[chat_id] = track[0]
+    return track
+
+def queue_upcoming(chat_id, count=5):
+    with queue_lock:
+        queue = playlist.get(chat_id)
+        if queue is None:
+            return []
+        upcoming = []
+        position = queue['position'] + 1
+        while position < len(queue['ids']) and len(upcoming) < count:
+            track = _queue_track(queue, position)
+            if track:
+                upcoming.append(track)
+            position += 1
+        return upcoming
+
+def flush_chat_queues():
+    """Persist changed queues in one transaction"""
+    global dirty_queues
+    with queue_lock:
+        if not dirty_queues:
+            return
+        dirty, dirty_queues = dirty_queues, {}
+        replaced, moved, removed = [], [], []
+        for chat_id, full in dirty.items():
+            queue = playlist.get(chat_id)
+            if queue is None:
+                removed.append((chat_id,))
+            elif full:
+                replaced.append((chat_id, queue['folder_id'], queue['seed'], queue['position'], queue['ids'].tobytes()))
+            else:
+                moved.append((queue['position'], chat_id))
+    try:
+        with db_transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO chat_queues (chat_id, folder_id, seed, position, track_ids) VALUES (?, ?, ?, ?, ?)", replaced)
+            db.executemany("UPDATE chat_queues SET position=? WHERE chat_id=?", moved)
+            db.executemany("DELETE FROM chat_queues WHERE chat_id=?", removed)
+    except Exception as e:
+        print(f"Error saving play queues: {e}")
+        with queue_lock:
+            for chat_id, full in dirty.items():
+                dirty_queues[chat_id] = dirty_queues.get(chat_id, False) or full
+
+def load_chat_queues():
+    for chat_id, folder_id, seed, position, blob in db_read("SELECT chat_id, folder_id, seed, position, track_ids FROM chat_queues"):
+        ids = array('q')
+        ids.frombytes(blob)
+        if ids:
+            playlist[chat_id] = {'folder_id': folder_id, 'ids': ids, 'seed': seed, 'position': position}
+
+atexit.register(flush_chat_queues)
+
+# ================= FOLDER BROWSER =================
+# /music views are edited in place. Track pages use keyset pagination on
+# (folder_id, id), and rendered views are kept as (text, keyboard JSON) in a
+# small LRU keyed by view and catalog_version, so any catalog change retires
+# them automatically.
+FOLDER_PAGE_SIZE = 10
+browser_views = OrderedDict()  # {(view..., catalog_version): (text, markup_json)}
+BROWSER_VIEWS_MAX = 256
+browser_views_lock = threading.Lock()
+
+def _cached_view(key, build):
+    key = key + (catalog_version,)
+    with browser_views_lock:
+        view = browser_views.get(key)
+        if view is not None:
+            browser_views.move_to_end(key)
+            return view
+    view = build()
+    with browser_views_lock:
+        browser_views[key] = view
+        while len(browser_views) > BROWSER_VIEWS_MAX:
+            browser_views.popitem(last=False)
+    return view
+
+def render_folder_list():
+    """(text, markup_json) for the folder picker, or (None, None) without folders"""
+    def build():
+        folders = db_read("SELECT id,name,description FROM folders")
+        if not folders:
+            return None, None
+        markup = types.InlineKeyboardMarkup()
+        for f in folders:
+            desc = f" - {f[2]}" if f[2] else ""
+            markup.add(types.InlineKeyboardButton(f"{f[1]}{desc}", callback_data=f"folder_member:{f[0]}"))
+        return "📂 Select a folder:", markup.to_json()
+    return _cached_view(("folders",), build)
+
+def render_folder_page(folder_id, direction="a", anchor=0):
+    """One page of tracks after (a) or before (b) the anchor id; (None, None) if empty"""
+    def build():
+        if direction == "a":
+            rows = db_read("""
+                SELECT m.id, m.title, m.artist, f.name FROM musics m JOIN folders f ON f.id = m.folder_id
+                WHERE m.folder_id=? AND m.id>? ORDER BY m.id LIMIT ?
+            """, (folder_id, anchor, FOLDER_PAGE_SIZE + 1))
+            has_next, has_prev = len(rows) > FOLDER_PAGE_SIZE, anchor > 0
+            rows = rows[:FOLDER_PAGE_SIZE]
+        else:
+            rows = db_read("""
+                SELECT m.id, m.title, m.artist, f.name FROM musics m JOIN folders f ON f.id = m.folder_id
+                WHERE m.folder_id=? AND m.id<? ORDER BY m.id DESC LIMIT ?
+            """, (folder_id, anchor, FOLDER_PAGE_SIZE + 1))
+            has_next, has_prev = True, len(rows) > FOLDER_PAGE_SIZE
+            rows = rows[:FOLDER_PAGE_SIZE][::-1]
+        if not rows:
+            return None, None
+        markup = types.InlineKeyboardMarkup()
+        for m in rows:
+            display_name = f"{m[1]} - {m[2]}" if m[2] else m[1]
+            markup.add(types.InlineKeyboardButton(display_name, callback_data=f"play:{m[0]}"))
+        nav = []
+        if has_prev:
+            nav.append(types.InlineKeyboardButton("◀️ Prev", callback_data=f"fpage:{folder_id}:b:{rows[0][0]}"))
+        nav.append(types.InlineKeyboardButton("⬅️ Folders", callback_data="music_folders"))
+        if has_next:
+            nav.append(types.InlineKeyboardButton("Next ▶️", callback_data=f"fpage:{folder_id}:a:{rows[-1][0]}"))
+        markup.row(*nav)
+        count = len(folder_track_ids.get(folder_id, ()))
+        return f"🎶 <b>{rows[0][3]}</b> ({count} musics)", markup.to_json()
+    return _cached_view(("page", folder_id, direction, anchor), build)
+
+def show_browser_view(call, text, markup):
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except telebot.apihelper.ApiTelegramException as e:
+        # Double taps re-render the same page
+        if "message is not modified" not in str(e):
+            raise
+
+# ================= COUNTERS =================
+# Row counts, active chats, member sums and per-folder track counts are kept
+# current by triggers (migration 6), so the dashboard screens read a handful
+# of rows instead of scanning. The snapshot is reloaded only after a commit.
+CounterSnapshot = namedtuple('CounterSnapshot', 'totals folder_tracks')
+_counter_snapshot = (None, None)    # (db_commits when read, CounterSnapshot)
+
+def counters_snapshot():
+    """Current counters and {folder_id: track_count}; one cached read per commit"""
+    global _counter_snapshot
+    commits, snapshot = _counter_snapshot
+    if commits == db_commits:
+        return snapshot
+    commits = db_commits
+    snapshot = CounterSnapshot(
+        totals=MappingProxyType(dict(db_read("SELECT name, value FROM counters"))),
+        folder_tracks=MappingProxyType(dict(db_read("SELECT id, track_count FROM folders"))),
+    )
+    _counter_snapshot = (commits, snapshot)
+    return snapshot
+
 # ================= ADMIN MANAGEMENT HELPERS =================
 def is_banned_admin(uid):
-    cursor.execute("SELECT user_id FROM banned_admins WHERE user_id=?", (uid,))
-    return cursor.fetchone() is not None
+    return uid in roles.banned
 
 def ban_admin(uid):
-    cursor.execute("INSERT OR IGNORE INTO banned_admins (user_id) VALUES (?)", (uid,))
-    conn.commit()
+    with roles_lock:
+        db_write("INSERT OR IGNORE INTO banned_admins (user_id) VALUES (?)", (uid,))
+        _publish_roles(banned=roles.banned | {uid})
 
 def unban_admin(uid):
-    cursor.execute("DELETE FROM banned_admins WHERE user_id=?", (uid,))
-    conn.commit()
+    with roles_lock:
+        db_write("DELETE FROM banned_admins WHERE user_id=?", (uid,))
+        _publish_roles(banned=roles.banned - {uid})
 
 def set_admin_limit(uid, limit):
-    cursor.execute("INSERT OR REPLACE INTO admin_limits (user_id, daily_limit, used_today, last_reset) VALUES (?, ?, 0, date('now'))", (uid, limit))
-    conn.commit()
+    with roles_lock:
+        # An upsert, not INSERT OR REPLACE: REPLACE's implicit delete skips the counter triggers
+        db_write("""
+            INSERT INTO admin_limits (user_id, daily_limit, used_today, last_reset) VALUES (?, ?, 0, date('now'))
+            ON CONFLICT(user_id) DO UPDATE SET daily_limit=excluded.daily_limit, used_today=0, last_reset=excluded.last_reset
+        """, (uid, limit))
+        row = db_read_one("SELECT daily_limit, used_today, last_reset FROM admin_limits WHERE user_id=?", (uid,))
+        limits = dict(roles.limits)
+        limits[uid] = tuple(row)
+        _publish_roles(limits=MappingProxyType(limits))
 
 def remove_admin_limit(uid):
-    cursor.execute("DELETE FROM admin_limits WHERE user_id=?", (uid,))
-    conn.commit()
+    with roles_lock:
+        db_write("DELETE FROM admin_limits WHERE user_id=?", (uid,))
+        limits = dict(roles.limits)
+        limits.pop(uid, None)
+        _publish_roles(limits=MappingProxyType(limits))
+
+# ================= PROFILE RESOLVER =================
+# Names and @username lookups go through one bounded LRU cache instead of a
+# get_chat round trip each. Every incoming update fills it for free with its
+# senders (remember_update_users); misses are fetched once however many
+# threads ask at the same moment, failures are cached briefly, and
+# resolve_profiles fetches a batch of misses in parallel.
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "20000"))
+PROFILE_TTL = 6 * 60 * 60
+PROFILE_NEGATIVE_TTL = 5 * 60
+PROFILE_FETCH_WORKERS = 8
+Profile = namedtuple("Profile", "id first_name last_name username")
+profile_cache = OrderedDict()    # {user id or "@username": (Profile or None, expires_at)}
+profile_inflight = {}            # {key: Future} for lookups on the wire
+profile_lock = threading.Lock()
+profile_stats = {'hits': 0, 'waits': 0, 'fetches': 0, 'failures': 0, 'passive': 0}    # under profile_lock
+profile_executor = ThreadPoolExecutor(PROFILE_FETCH_WORKERS, thread_name_prefix="profiles")
+
+def profile_key(value):
+    """User ids as ints, usernames as lowercase '@name'"""
+    if isinstance(value, str):
+        value = value.strip()
+        return int(value) if value.lstrip('-').isdigit() else value.lower()
+    return value
+
+def _cache_profile(key, profile, ttl):
+    # Caller holds profile_lock
+    profile_cache[key] = (profile, time.time() + ttl)
+    profile_cache.move_to_end(key)
+    while len(profile_cache) > PROFILE_CACHE_SIZE:
+        profile_cache.popitem(last=False)
+
+def _cache_found(key, profile):
+    _cache_profile(key, profile, PROFILE_TTL)
+    if profile.id != key:
+        _cache_profile(profile.id, profile, PROFILE_TTL)
+    if profile.username:
+        _cache_profile("@" + profile.username.lower(), profile, PROFILE_TTL)
+
+def remember_user(user):
+    """Cache a User seen in an update; skipped while the cached copy is fresh and unchanged"""
+    entry = profile_cache.get(user.id)
+    if entry and entry[0] and entry[0].first_name == user.first_name and entry[0].username == user.username \
+            and entry[1] - time.time() > PROFILE_TTL / 2:
+        return
+    with profile_lock:
+        _cache_found(user.id, Profile(user.id, user.first_name, user.last_name, user.username))
+        profile_stats['passive'] += 1
+
+def remember_update_users(update):
+    message = update.message or update.edited_message
+    if message:
+        if message.from_user:
+            remember_user(message.from_user)
+        if message.reply_to_message and message.reply_to_message.from_user:
+            remember_user(message.reply_to_message.from_user)
+        for member in message.new_chat_members or ():
+            remember_user(member)
+    elif update.callback_query:
+        remember_user(update.callback_query.from_user)
+    elif update.inline_query:
+        remember_user(update.inline_query.from_user)
+
+def _fetch_profile(key, future):
+    profile = None
+    try:
+        chat = bot.get_chat(key)
+        profile = Profile(chat.id, chat.first_name, chat.last_name, chat.username)
+    except Exception:
+        pass
+    finally:
+        with profile_lock:
+            if profile:
+                _cache_found(key, profile)
+            else:
+                profile_stats['failures'] += 1
+                _cache_profile(key, None, PROFILE_NEGATIVE_TTL)
+            profile_inflight.pop(key, None)
+        future.set_result(profile)
+
+def resolve_profiles(values):
+    """{value: Profile or None} for user ids and @usernames; misses are fetched in parallel"""
+    keys = {value: profile_key(value) for value in values}
+    found, waiting, fetch = {}, {}, []
+    now = time.time()
+    with profile_lock:
+        for key in set(keys.values()):
+            entry = profile_cache.get(key)
+            if entry and entry[1] > now:
+                profile_cache.move_to_end(key)
+                found[key] = entry[0]
+            elif key in profile_inflight:
+                waiting[key] = profile_inflight[key]
+            else:
+                waiting[key] = profile_inflight[key] = Future()
+                fetch.append(key)
+        profile_stats['hits'] += len(found)
+        profile_stats['waits'] += len(waiting) - len(fetch)
+        profile_stats['fetches'] += len(fetch)
+    for i, key in enumerate(fetch):
+        # The last miss is fetched on this thread, the rest on the pool
+        if i == len(fetch) - 1:
+            _fetch_profile(key, waiting[key])
+        else:
+            profile_executor.submit(_fetch_profile, key, waiting[key])
+    for key, future in waiting.items():
+        found[key] = future.result()
+    return {value: found[key] for value, key in keys.items()}
+
+def resolve_profile(value):
+    return resolve_profiles([value])[value]
+
+def resolve_user_id(value):
+    """Numeric id as given, or the id behind an @username; LookupError if unknown"""
+    key = profile_key(value)
+    if isinstance(key, int):
+        return key
+    profile = resolve_profile(key)
+    if not profile:
+        raise LookupError(f"Unknown user {value}")
+    return profile.id
+
+def profile_name(user_id):
+    """First name of a user; LookupError if the profile can't be fetched"""
+    profile = resolve_profile(user_id)
+    if not profile:
+        raise LookupError(f"Unknown user {user_id}")
+    return profile.first_name
+
+def profile_stats_text():
+    with profile_lock:
+        s = dict(profile_stats)
+        cached = len(profile_cache)
+    lookups = s['hits'] + s['waits'] + s['fetches']
+    rate = s['hits'] * 100 / lookups if lookups else 0
+    return (f"👤 Profiles: {cached} cached · {rate:.0f}% of {lookups} lookups from cache · "
+            f"{s['waits']} joined a fetch in flight · {s['fetches']} fetched ({s['failures']} failed) · "
+            f"{s['passive']} seen in updates")
+
+# ================= ADMIN ROSTER =================
+# /adminlist, /show_adminId and /remove_adminlist read one roster: admins and
+# banned admins with their nicknames from a single joined query, limits from
+# the role snapshot and profiles from the PROFILE RESOLVER (misses fetched in
+# parallel). Rows
+# are cached until the role snapshot or a nickname changes, so repeat calls
+# make no queries and, while profiles are cached, no API requests.
+RosterEntry = namedtuple("RosterEntry", "user_id is_admin banned_date daily_limit used_today nickname profile")
+roster_lock = threading.Lock()
+_roster_rows = (None, [])    # ((roles version, nicknames version), rows)
+
+def roster_rows():
+    global _roster_rows
+    key = (roles.version, nicknames_version)
+    with roster_lock:
+        if _roster_rows[0] != key:
+            _roster_rows = (key, db_read("""
+                SELECT u.id, EXISTS(SELECT 1 FROM admins a WHERE a.id = u.id),
+                       b.banned_date, n.nickname
+                FROM (SELECT id FROM admins UNION SELECT user_id FROM banned_admins) u
+                LEFT JOIN banned_admins b ON b.user_id = u.id
+                LEFT JOIN nicknames n ON n.user_id = u.id
+                ORDER BY u.id
+            """))
+        return _roster_rows[1]
+
+def admin_roster():
+    """[RosterEntry] for every admin and banned admin"""
+    rows = roster_rows()
+    profiles = resolve_profiles([row[0] for row in rows])
+    entries = []
+    for uid, is_admin_row, banned_date, nickname in rows:
+        daily_limit, used_today, _ = get_admin_limit(uid) or (None, None, None)
+        entries.append(RosterEntry(uid, is_admin_row, banned_date, daily_limit, used_today, nickname, profiles[uid]))
+    return entries
+
+load_roles()
+load_nicknames()
+load_catalog()
+load_chat_queues()
 
 # ================= GROUP TRACKING HELPERS =================
+# track_chat runs for every message, so chat info is buffered in memory
+# (one entry per chat, newer updates overwrite older ones) and written to
+# the chats table in one transaction every CHAT_FLUSH_INTERVAL seconds.
+CHAT_FLUSH_INTERVAL = 5  # seconds
+pending_chats = {}       # {chat_id: (chat_type, title, username, last_seen)}
+pending_chats_lock = threading.Lock()
+
+# Member counts are fetched by a background refresher, never on the message path
+MEMBER_COUNT_TTL = 15 * 60       # seconds before a count is refreshed
+MEMBER_COUNT_WORKERS = 3         # concurrent getChatMemberCount calls
+MEMBER_COUNT_CHECK_INTERVAL = 30 # seconds between refresher sweeps
+member_counts = {}               # {chat_id: (count, fetched_at)}  fetched_at=0 -> loaded from DB
+member_count_due = {}            # {group chat_id: time the next refresh is due}
+dirty_member_counts = {}         # {chat_id: count} waiting for the next flush
+member_count_lock = threading.Lock()
+member_count_wakeup = threading.Event()
+member_count_executor = ThreadPoolExecutor(max_workers=MEMBER_COUNT_WORKERS, thread_name_prefix="member-count")
+
 def track_chat(chat):
-    """Track or update chat information"""
+    """Track or update chat information (buffered, see flush_tracked_chats)"""
     try:
-        # Get member count if possible
-        member_count = 0
-        try:
-            if chat.type in ['group', 'supergroup']:
-                member_count = bot.get_chat_member_count(chat.id)
-        except:
-            pass
-            
-        # Insert or update chat info
-        cursor.execute("""
-            INSERT OR REPLACE INTO chats 
-            (chat_id, chat_type, title, username, member_count, last_seen, is_active) 
-            VALUES (?, ?, ?, ?, ?, datetime('now'), 1)
-        """, (chat.id, chat.type, chat.title, chat.username, member_count))
-        conn.commit()
+        if chat.type in ['group', 'supergroup'] and chat.id not in member_count_due:
+            with member_count_lock:
+                member_count_due.setdefault(chat.id, 0)
+            member_count_wakeup.set()
+
+        last_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with pending_chats_lock:
+            pending_chats[chat.id] = (chat.type, chat.title, chat.username, last_seen)
     except Exception as e:
         print(f"Error tracking chat: {e}")
 
+def flush_tracked_chats():
+    """Write all buffered chat updates and member counts in a single transaction"""
+    global pending_chats, dirty_member_counts
+    with pending_chats_lock:
+        batch, pending_chats = pending_chats, {}
+    with member_count_lock:
+        counts, dirty_member_counts = dirty_member_counts, {}
+    if not batch and not counts:
+        return
+    rows = [(chat_id,) + info for chat_id, info in batch.items()]
+    try:
+        with db_transaction() as db:
+            db.executemany("""
+                INSERT INTO chats (chat_id, chat_type, title, username, member_count, last_seen, is_active)
+                VALUES (?, ?, ?, ?, 0, ?, 1)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    chat_type=excluded.chat_type, title=excluded.title, username=excluded.username,
+                    last_seen=excluded.last_seen, is_active=1
+            """, rows)
+            db.executemany("UPDATE chats SET member_count=? WHERE chat_id=?",
+                           [(count, chat_id) for chat_id, count in counts.items()])
+    except Exception as e:
+        print(f"Error flushing tracked chats: {e}")
+        # Put the batch back without clobbering anything newer
+        with pending_chats_lock:
+            for chat_id, info in batch.items():
+                pending_chats.setdefault(chat_id, info)
+        with member_count_lock:
+            for chat_id, count in counts.items():
+                dirty_member_counts.setdefault(chat_id, count)
+
+def chat_flush_loop():
+    while True:
+        time.sleep(CHAT_FLUSH_INTERVAL)
+        flush_tracked_chats()
+        flush_chat_queues()
+
+def get_member_count(chat_id, default=0):
+    """Return (count, age_seconds) from the cache; age is None if never refreshed"""
+    cached = member_counts.get(chat_id)
+    if not cached:
+        return default, None
+    count, fetched_at = cached
+    return count, (time.time() - fetched_at) if fetched_at else None
+
+def invalidate_member_count(chat_id):
+    """Ask the refresher to fetch this chat's count soon (e.g. after joins)"""
+    with member_count_lock:
+        member_count_due[chat_id] = 0
+    member_count_wakeup.set()
+
+def refresh_member_count(chat_id):
+    # Spread calls out so a sweep does not hit the API in one burst
+    time.sleep(random.uniform(0, 1.0))
+    try:
+        count = bot.get_chat_member_count(chat_id)
+    except Exception as e:
+        # Keep the old count; try again after a full TTL
+        print(f"Error refreshing member count for {chat_id}: {e}")
+        with member_count_lock:
+            member_count_due[chat_id] = time.time() + MEMBER_COUNT_TTL
+        return
+    with member_count_lock:
+        member_counts[chat_id] = (count, time.time())
+        dirty_member_counts[chat_id] = count
+        # Jitter the TTL so chats seen together don't all expire together
+        member_count_due[chat_id] = time.time() + MEMBER_COUNT_TTL * random.uniform(0.8, 1.2)
+
+def member_count_loop():
+    # Start from the counts already stored so reports have something to show
+    try:
+        for chat_id, chat_type, count in db_read(
+                "SELECT chat_id, chat_type, member_count FROM chats WHERE is_active=1"):
+            member_counts.setdefault(chat_id, (count or 0, 0))
+            if chat_type in ('group', 'supergroup'):
+                with member_count_lock:
+                    member_count_due.setdefault(chat_id, 0)
+    except Exception as e:
+        print(f"Error loading member counts: {e}")
+
+    while True:
+        now = time.time()
+        with member_count_lock:
+            due = [chat_id for chat_id, due_at in member_count_due.items() if due_at <= now]
+            # Don't submit a chat again while its refresh is queued or running
+            for chat_id in due:
+                member_count_due[chat_id] = float('inf')
+        for chat_id in due:
+            member_count_executor.submit(refresh_member_count, chat_id)
+        member_count_wakeup.wait(MEMBER_COUNT_CHECK_INTERVAL)
+        member_count_wakeup.clear()
+
+def format_age(seconds):
+    """Short human readable age such as 45s, 3m, 2h"""
+    if seconds is None:
+        return "not refreshed yet"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s ago"
+    if seconds < 3600:
+        return f"{seconds // 60}m ago"
+    if seconds < 86400:
+        return f"{seconds // 3600}h ago"
+    return f"{seconds // 86400}d ago"
+
+atexit.register(flush_tracked_chats)
+
 def get_all_bot_users():
     """Get all users who have interacted with the bot"""
     try:
@@ -220,14 +1389,12 @@ def get_all_bot_users():
         users = set()
         
         # From admins
-        cursor.execute("SELECT id FROM admins")
-        admin_users = cursor.fetchall()
+        admin_users = db_read("SELECT id FROM admins")
         for user in admin_users:
             users.add(user[0])
         
         # From nicknames
-        cursor.execute("SELECT user_id FROM nicknames")
-        nickname_users = cursor.fetchall()
+        nickname_users = db_read("SELECT user_id FROM nicknames")
         for user in nickname_users:
             users.add(user[0])
         
@@ -247,8 +1414,1122 @@ def get_all_bot_users():
 
 def get_tracked_chats():
     """Get all tracked chats"""
-    cursor.execute("SELECT chat_id, chat_type, title, username, member_count, bot_joined_date, last_seen, is_active FROM chats ORDER BY last_seen DESC")
-    return cursor.fetchall()
+    flush_tracked_chats()
+    return db_read("SELECT chat_id, chat_type, title, username, member_count, bot_joined_date, last_seen, is_active FROM chats ORDER BY is_active DESC, last_seen DESC")
+
+# ================= API TRANSPORT =================
+# All sync Bot API calls share one keep-alive requests session (telebot's
+# default is a session per thread, recreated every 10 minutes) with a
+# connection pool sized for every thread that can call the API. Failed calls
+# are retried with jittered backoff only when that can't duplicate anything:
+# connect timeouts for any method, other errors and 5xx only for idempotent
+# methods. Every attempt is timed into a per-method latency histogram.
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "20"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "0"))    # 0 = match the worker count
+API_MAX_RETRIES = 3
+API_RETRY_BACKOFF = 0.25                                # seconds, doubled per retry
+IDEMPOTENT_METHODS = ('get', 'edit', 'delete', 'set')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+telebot.apihelper.CONNECT_TIMEOUT = API_CONNECT_TIMEOUT
+telebot.apihelper.READ_TIMEOUT = API_READ_TIMEOUT
+api_session = None
+api_session_lock = threading.Lock()
+api_stats = {}           # {method: {'latency': Histogram, 'errors': n, 'retries': n}}
+api_stats_lock = threading.Lock()
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        rank, seen = q * self.count, 0
+        for bound, n in zip(LATENCY_BUCKETS + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+def api_pool_size():
+    return API_POOL_SIZE or (DISPATCH_SHARDS * (1 + DISPATCH_MAX_HELPERS) + BROADCAST_WORKERS
+                             + MEMBER_COUNT_WORKERS + PROFILE_FETCH_WORKERS + 4)
+
+def get_api_session():
+    global api_session
+    if api_session is None:
+        with api_session_lock:
+            if api_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=api_pool_size())
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                api_session = session
+    return api_session
+
+def record_api_call(api_method, seconds, error=False, retry=False):
+    with api_stats_lock:
+        stats = api_stats.get(api_method)
+        if stats is None:
+            stats = api_stats[api_method] = {'latency': Histogram(), 'errors': 0, 'retries': 0}
+        stats['latency'].observe(seconds)
+        stats['errors'] += error
+        stats['retries'] += retry
+
+def transport_request(method, url, params=None, files=None, timeout=None, proxies=None):
+    """apihelper.CUSTOM_REQUEST_SENDER over the shared session"""
+    api_method = url.rsplit('/', 1)[-1]
+    idempotent = api_method.startswith(IDEMPOTENT_METHODS) and not files
+    session = get_api_session()
+    for attempt in range(API_MAX_RETRIES + 1):
+        last = attempt == API_MAX_RETRIES
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+        except requests.exceptions.RequestException as e:
+            # A connect timeout never reached Telegram, anything else might have
+            retry = not last and (idempotent or isinstance(e, requests.exceptions.ConnectTimeout))
+            record_api_call(api_method, time.perf_counter() - started, error=True, retry=retry)
+            if not retry:
+                raise
+        else:
+            retry = not last and idempotent and response.status_code >= 500
+            record_api_call(api_method, time.perf_counter() - started, error=response.status_code >= 500, retry=retry)
+            if not retry:
+                return response
+        time.sleep(random.uniform(0, API_RETRY_BACKOFF * 2 ** attempt))
+        for f in (files or {}).values():
+            if hasattr(f, 'seek'):
+                f.seek(0)
+
+telebot.apihelper.CUSTOM_REQUEST_SENDER = transport_request
+
+def api_stats_text():
+    with api_stats_lock:
+        rows = sorted(((method, s['latency'].count, s['latency'].total, s['latency'].quantile(0.5),
+                        s['latency'].quantile(0.95), s['errors'], s['retries']) for method, s in api_stats.items()),
+                      key=lambda row: -row[1])
+    lines = [f"🌐 <b>API Transport</b> (pool {api_pool_size()})\n", "method: calls · avg · p50/p95 · errors · retries"]
+    for method, count, total, p50, p95, errors, retries in rows:
+        lines.append(f"{method}: {count} · {total / count * 1000:.0f}ms · ≤{p50 * 1000:g}/≤{p95 * 1000:g}ms · {errors} · {retries}")
+    lines.append("\n" + profile_stats_text())
+    return "\n".join(lines)
+
+# ================= OUTBOUND SCHEDULER =================
+# Every send/copy/forward/edit call made through telebot goes through one
+# scheduler: a global token bucket (~30 msg/s), a per-chat bucket (1 msg/s in
+# private chats, ~20 msg/min in groups) and two priority lanes, so command
+# replies are served before broadcast traffic. Interactive replies in groups
+# don't wait for the group bucket (they would hold the chat's dispatch shard,
+# stalling every chat hashed to it): they charge it, possibly into debt, so
+# bulk sends to that group slow down instead. A 429 pauses the chat (groups)
+# or the whole bot (private chats) for retry_after and the call is retried
+# instead of surfacing as an error; that pause applies to every lane.
+SEND_RATE = 28                   # messages/sec across all chats
+SEND_BURST = 2                   # small burst so no 1s window goes past ~30
+SEND_PRIVATE_RATE = 1            # messages/sec per private chat
+SEND_PRIVATE_BURST = 3
+SEND_GROUP_RATE = 20 / 60        # messages/sec per group or channel
+SEND_GROUP_BURST = 10
+SEND_MAX_RETRIES = 5             # 429 retries before the error is raised
+SEND_CHAT_BUCKETS = 5000         # per-chat buckets kept (LRU)
+SCHEDULED_METHODS = ('send', 'copy', 'forward', 'edit')
+LANE_INTERACTIVE, LANE_BULK = 0, 1
+LANE_NAMES = ('interactive', 'bulk')
+_send_context = threading.local()
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token and return 0, or return how long to wait for one"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def charge(self):
+        """Take a token without waiting for it, down to -capacity of debt;
+        returns 0, or how long the bucket is still paused after a 429"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens = max(self.tokens - 1, -self.capacity)
+            return 0
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while (after a 429)"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+class SendScheduler:
+    """Global + per-chat rate limiting with priority lanes and wait metrics"""
+
+    def __init__(self):
+        self.bucket = TokenBucket(SEND_RATE, SEND_BURST)
+        self.chat_buckets = OrderedDict()
+        self.cond = threading.Condition()
+        self.queued = [0, 0]        # callers waiting per lane (any stage)
+        self.contending = [0, 0]    # callers waiting on the global bucket
+        self.stats = [dict(sent=0, wait=0.0, max_wait=0.0, max_queued=0, rate_limited=0, dropped=0)
+                      for _ in LANE_NAMES]
+
+    def chat_bucket(self, chat_id):
+        with self.cond:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket:
+                self.chat_buckets.move_to_end(chat_id)
+                return bucket
+            if is_group_chat_id(chat_id):
+                bucket = TokenBucket(SEND_GROUP_RATE, SEND_GROUP_BURST)
+            else:
+                bucket = TokenBucket(SEND_PRIVATE_RATE, SEND_PRIVATE_BURST)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > SEND_CHAT_BUCKETS:
+                self.chat_buckets.popitem(last=False)
+            return bucket
+
+    def waits(self, chat_id, lane):
+        """Yield how long to sleep until this lane may send to chat_id"""
+        started = time.monotonic()
+        stats = self.stats[lane]
+        with self.cond:
+            self.queued[lane] += 1
+            stats['max_queued'] = max(stats['max_queued'], self.queued[lane])
+        try:
+            if chat_id is not None:
+                bucket = self.chat_bucket(chat_id)
+                take = bucket.charge if lane == LANE_INTERACTIVE and is_group_chat_id(chat_id) else bucket.try_acquire
+                while (wait := take()) > 0:
+                    yield wait
+            with self.cond:
+                self.contending[lane] += 1
+            try:
+                while True:
+                    with self.cond:
+                        # Bulk only gets a token when no interactive send is waiting
+                        if lane == LANE_BULK and self.contending[LANE_INTERACTIVE]:
+                            wait = 0.05
+                        else:
+                            wait = self.bucket.try_acquire()
+                    if wait <= 0:
+                        break
+                    yield min(wait, 0.05) if lane == LANE_BULK else wait
+            finally:
+                with self.cond:
+                    self.contending[lane] -= 1
+                    self.cond.notify_all()
+        finally:
+            waited = time.monotonic() - started
+            with self.cond:
+                self.queued[lane] -= 1
+                stats['sent'] += 1
+                stats['wait'] += waited
+                stats['max_wait'] = max(stats['max_wait'], waited)
+
+    def acquire(self, chat_id, lane):
+        """Block until this lane may send to chat_id"""
+        for wait in self.waits(chat_id, lane):
+            time.sleep(wait)
+
+    async def acquire_async(self, chat_id, lane=LANE_INTERACTIVE):
+        """acquire() for the asyncio runtime, sleeping without holding a thread"""
+        for wait in self.waits(chat_id, lane):
+            await asyncio.sleep(wait)
+
+    def rate_limited(self, chat_id, lane, retry_after):
+        """Back off after a 429: group limits are per chat, private ones global"""
+        with self.cond:
+            self.stats[lane]['rate_limited'] += 1
+        if chat_id is not None and is_group_chat_id(chat_id):
+            self.chat_bucket(chat_id).pause(retry_after)
+        else:
+            self.bucket.pause(retry_after)
+
+    def dropped(self, lane):
+        with self.cond:
+            self.stats[lane]['dropped'] += 1
+
+    def snapshot(self):
+        with self.cond:
+            return list(self.queued), [dict(s) for s in self.stats], len(self.chat_buckets)
+
+send_scheduler = SendScheduler()
+
+def is_group_chat_id(chat_id):
+    """Groups/channels have negative ids (or are addressed by @username)"""
+    if isinstance(chat_id, str) and chat_id.startswith('@'):
+        return True
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        return False
+
+@contextmanager
+def send_lane(lane):
+    """Run the sends made by this thread in the given lane"""
+    previous = getattr(_send_context, 'lane', LANE_INTERACTIVE)
+    _send_context.lane = lane
+    try:
+        yield
+    finally:
+        _send_context.lane = previous
+
+# AsyncTeleBot raises its own ApiTelegramException, not a subclass of apihelper's;
+# asyncio_helper needs aiohttp, which the threaded bot doesn't
+try:
+    from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+    API_ERRORS = (telebot.apihelper.ApiTelegramException, AsyncApiTelegramException)
+except ImportError:
+    API_ERRORS = (telebot.apihelper.ApiTelegramException,)
+
+def retry_after_seconds(error):
+    """retry_after from a 429 ApiTelegramException (sync or asyncio), else None"""
+    if isinstance(error, API_ERRORS) and error.error_code == 429:
+        return (error.result_json.get('parameters') or {}).get('retry_after', 1)
+    return None
+
+_api_make_request = telebot.apihelper._make_request
+
+def scheduled_request(token, method_name, method='get', params=None, files=None):
+    """apihelper._make_request with rate limiting and 429 retries for sends"""
+    if not method_name.startswith(SCHEDULED_METHODS):
+        return _api_make_request(token, method_name, method, params, files)
+    chat_id = (params or {}).get('chat_id')
+    lane = getattr(_send_context, 'lane', LANE_INTERACTIVE)
+    for attempt in range(SEND_MAX_RETRIES + 1):
+        send_scheduler.acquire(chat_id, lane)
+        try:
+            # _make_request pops keys out of params, keep ours for a retry
+            return _api_make_request(token, method_name, method, dict(params) if params else params, files)
+        except telebot.apihelper.ApiTelegramException as e:
+            wait = retry_after_seconds(e)
+            if wait is None:
+                raise
+            if attempt == SEND_MAX_RETRIES:
+                send_scheduler.dropped(lane)
+                raise
+            print(f"429 on {method_name} to {chat_id}, retrying in {wait}s")
+            send_scheduler.rate_limited(chat_id, lane, wait)
+            for f in (files or {}).values():
+                if hasattr(f, 'seek'):
+                    f.seek(0)
+
+def timed_request(token, method_name, method='get', params=None, files=None):
+    """Charge the call, rate-limit waits included, to the running handler"""
+    started = time.perf_counter()
+    try:
+        return scheduled_request(token, method_name, method, params, files)
+    finally:
+        charge_api_time(started)
+
+telebot.apihelper._make_request = timed_request
+
+def send_stats_text():
+    queued, stats, chats = send_scheduler.snapshot()
+    lines = ["📡 <b>Outbound Scheduler</b>\n"]
+    for lane, name in enumerate(LANE_NAMES):
+        s = stats[lane]
+        avg = s['wait'] / s['sent'] * 1000 if s['sent'] else 0
+        lines.append(f"<b>{name}</b>: queued {queued[lane]} (max {s['max_queued']})\n"
+                     f"sent {s['sent']} · wait avg {avg:.0f}ms / max {s['max_wait'] * 1000:.0f}ms\n"
+                     f"429s {s['rate_limited']} · dropped {s['dropped']}\n")
+    lines.append(f"Chat buckets: {chats} · global rate {SEND_RATE}/s")
+    return "\n".join(lines)
+
+# ================= UPDATE DISPATCHER =================
+# Updates are sharded by chat id onto DISPATCH_SHARDS workers, so a chat's
+# updates are handled one at a time and in order while different chats run in
+# parallel. Within a shard, chats take turns one update at a time. If every
+# worker of a shard has been stuck on one chat for DISPATCH_HOLD_LIMIT, the
+# watchdog adds a helper worker so the other chats on that shard keep moving.
+DISPATCH_SHARDS = int(os.getenv("DISPATCH_SHARDS", "8"))
+DISPATCH_HOLD_LIMIT = 5          # seconds one chat may hold a shard's workers
+DISPATCH_MAX_HELPERS = 2         # extra workers per shard while handlers are stuck
+DISPATCH_CHECK_INTERVAL = 1
+
+class DispatchShard:
+    """FIFO-per-chat queue served round-robin by one or more workers"""
+
+    def __init__(self, index):
+        self.index = index
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()   # {chat_id: deque(updates)}, in turn order
+        self.running = {}              # {chat_id: started_at}
+        self.depth = 0
+        self.workers = 0
+        self.stats = dict(processed=0, busy=0.0, max_depth=0, max_hold=0.0, slow=0, helpers=0, errors=0)
+
+    def put(self, chat_id, update):
+        with self.cond:
+            self.pending.setdefault(chat_id, deque()).append(update)
+            self.depth += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], self.depth)
+            if not self.workers:
+                self.start_worker()
+            self.cond.notify()
+
+    def start_worker(self, helper=False):
+        self.workers += 1
+        threading.Thread(target=dispatch_worker, args=(self, helper), daemon=True).start()
+
+    def take(self, helper):
+        """Oldest update of the first chat not already being handled"""
+        with self.cond:
+            while True:
+                for chat_id, queue in self.pending.items():
+                    if chat_id in self.running:
+                        continue
+                    update = queue.popleft()
+                    if queue:
+                        self.pending.move_to_end(chat_id)
+                    else:
+                        del self.pending[chat_id]
+                    self.depth -= 1
+                    self.running[chat_id] = time.monotonic()
+                    return chat_id, update
+                if helper:
+                    self.workers -= 1
+                    return None, None
+                self.cond.wait()
+
+    def done(self, chat_id, failed):
+        with self.cond:
+            held = time.monotonic() - self.running.pop(chat_id)
+            self.stats['processed'] += 1
+            self.stats['busy'] += held
+            self.stats['max_hold'] = max(self.stats['max_hold'], held)
+            self.stats['slow'] += held > DISPATCH_HOLD_LIMIT
+            self.stats['errors'] += failed
+            self.cond.notify()
+
+    def check_stuck(self):
+        """Add a helper when every worker is held too long and others wait"""
+        with self.cond:
+            now = time.monotonic()
+            stuck = len(self.running) >= self.workers and all(
+                now - started > DISPATCH_HOLD_LIMIT for started in self.running.values())
+            waiting = any(chat_id not in self.running for chat_id in self.pending)
+            if self.running and stuck and waiting and self.workers <= DISPATCH_MAX_HELPERS:
+                self.stats['helpers'] += 1
+                self.start_worker(helper=True)
+
+dispatch_shards = [DispatchShard(i) for i in range(DISPATCH_SHARDS)]
+_process_updates = bot.process_new_updates
+
+def update_chat_id(update):
+    """The chat an update belongs to, used as its ordering key"""
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message:
+            return message.chat.id
+    if update.callback_query:
+        query = update.callback_query
+        return query.message.chat.id if query.message else query.from_user.id
+    for member in (update.my_chat_member, update.chat_member, update.chat_join_request):
+        if member:
+            return member.chat.id
+    for query in (update.inline_query, update.chosen_inline_result, update.shipping_query,
+                  update.pre_checkout_query, update.poll_answer):
+        if query:
+            user = getattr(query, 'from_user', None) or getattr(query, 'user', None)
+            return user.id if user else 0
+    return 0
+
+def dispatch_updates(updates):
+    """Queue updates on their chat's shard instead of handling them inline"""
+    for update in updates:
+        if update.update_id > bot.last_update_id:
+            bot.last_update_id = update.update_id
+        remember_update_users(update)
+        chat_id = update_chat_id(update)
+        dispatch_shards[hash(chat_id) % DISPATCH_SHARDS].put(chat_id, update)
+
+bot.process_new_updates = dispatch_updates
+
+def dispatch_worker(shard, helper=False):
+    while True:
+        chat_id, update = shard.take(helper)
+        if update is None:
+            return
+        failed = False
+        try:
+            _process_updates([update])
+        except Exception as e:
+            failed = True
+            print(f"Handler error in chat {chat_id}: {e!r}")
+        shard.done(chat_id, failed)
+
+def dispatch_watchdog_loop():
+    while True:
+        time.sleep(DISPATCH_CHECK_INTERVAL)
+        for shard in dispatch_shards:
+            shard.check_stuck()
+
+def dispatch_stats_text():
+    lines = ["🧵 <b>Update Dispatcher</b>\n", "shard: depth (max) · done · avg/max ms · slow · helpers · errors"]
+    for shard in dispatch_shards:
+        with shard.cond:
+            s = dict(shard.stats)
+            depth, workers = shard.depth, shard.workers
+        avg = s['busy'] / s['processed'] * 1000 if s['processed'] else 0
+        lines.append(f"#{shard.index}: {depth} ({s['max_depth']}) · {s['processed']} · "
+                     f"{avg:.0f}/{s['max_hold'] * 1000:.0f} · {s['slow']} · {s['helpers']} · {s['errors']}"
+                     + (f" · {workers} workers" if workers > 1 else ""))
+    lines.append(f"\nHold limit: {DISPATCH_HOLD_LIMIT}s")
+    if CAPTURE_DIR:
+        c = capture_stats
+        lines.append(f"Capture: {c['captured']} captured · {c['written']} written · {c['dropped']} dropped · "
+                     f"{c['files']} files")
+    return "\n".join(lines)
+
+# ================= UPDATE CAPTURE =================
+# Opt-in (CAPTURE_DIR) recording of every incoming update for replay.py. The
+# receive path only appends (time, raw update) to a bounded deque; a writer
+# thread serialises, optionally redacts and appends batches to gzip'd JSONL,
+# rotating by size or age and keeping the newest CAPTURE_KEEP files. Each
+# batch is flushed, so a crash loses at most one flush interval.
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "")          # empty disables capture
+CAPTURE_REDACT = os.getenv("CAPTURE_REDACT", "0") == "1"
+CAPTURE_SALT = os.getenv("CAPTURE_SALT") or os.urandom(16).hex()    # set to keep pseudonyms stable across restarts
+CAPTURE_ROTATE_MB = float(os.getenv("CAPTURE_ROTATE_MB", "64"))
+CAPTURE_ROTATE_SECONDS = int(os.getenv("CAPTURE_ROTATE_SECONDS", "3600"))
+CAPTURE_KEEP = int(os.getenv("CAPTURE_KEEP", "48"))
+CAPTURE_FLUSH_INTERVAL = 1.0
+CAPTURE_BUFFER = 100000    # updates held for the writer before the oldest are dropped
+REDACT_TEXT_KEYS = {"text", "caption", "query", "bio", "description", "question", "phone_number"}
+REDACT_NAME_KEYS = {"first_name", "last_name", "username", "title"}
+capture_buffer = deque(maxlen=CAPTURE_BUFFER)
+capture_lock = threading.Lock()
+capture_stats = {'captured': 0, 'written': 0, 'dropped': 0, 'files': 0}
+capture_file = None
+capture_opened = 0.0
+
+def capture_updates(raw_updates):
+    """Queue raw updates (dicts or JSON text) for the capture writer"""
+    now = time.time()
+    for raw in raw_updates:
+        if len(capture_buffer) == CAPTURE_BUFFER:
+            capture_stats['dropped'] += 1
+        capture_buffer.append((now, raw))
+    capture_stats['captured'] += len(raw_updates)
+
+def redact_text(text):
+    """Mask letters but keep the command word, digits and spacing so handlers take the same paths"""
+    head, sep, tail = text.partition(" ") if text.startswith("/") else ("", "", text)
+    return head + sep + re.sub(r"[^\s\d]", "x", tail)
+
+def redact_name(value):
+    return "n" + hashlib.sha1((CAPTURE_SALT + str(value)).encode()).hexdigest()[:10]
+
+def redact_update(value):
+    """Copy of an update with message text and names masked"""
+    if isinstance(value, list):
+        return [redact_update(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    out = {}
+    for key, item in value.items():
+        if key in REDACT_TEXT_KEYS and isinstance(item, str):
+            out[key] = redact_text(item)
+        elif key in REDACT_NAME_KEYS and isinstance(item, str):
+            out[key] = redact_name(item)
+        else:
+            out[key] = redact_update(item)
+    return out
+
+def open_capture_file():
+    global capture_file, capture_opened
+    folder = Path(CAPTURE_DIR)
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / f"updates-{datetime.now():%Y%m%d-%H%M%S}.jsonl.gz"
+    capture_file = gzip.open(path, "ab", compresslevel=6)
+    capture_opened = time.time()
+    capture_stats['files'] += 1
+    for old in sorted(folder.glob("updates-*.jsonl.gz"))[:-CAPTURE_KEEP]:
+        old.unlink(missing_ok=True)
+
+def write_captured():
+    """Append everything buffered to the current capture file"""
+    global capture_file
+    with capture_lock:
+        if not capture_buffer:
+            return
+        if capture_file and (capture_file.fileobj.tell() > CAPTURE_ROTATE_MB * 1048576
+                             or time.time() - capture_opened > CAPTURE_ROTATE_SECONDS):
+            capture_file.close()
+            capture_file = None
+        if capture_file is None:
+            open_capture_file()
+        lines = []
+        while capture_buffer:
+            received, raw = capture_buffer.popleft()
+            update = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+            if CAPTURE_REDACT:
+                update = redact_update(update)
+            lines.append(json.dumps({"t": round(received, 3), "update": update},
+                                    ensure_ascii=False, separators=(",", ":")))
+        capture_file.write(("\n".join(lines) + "\n").encode())
+        capture_file.flush()
+        capture_stats['written'] += len(lines)
+
+def close_capture():
+    global capture_file
+    write_captured()
+    with capture_lock:
+        if capture_file:
+            capture_file.close()
+            capture_file = None
+
+def capture_loop():
+    while True:
+        time.sleep(CAPTURE_FLUSH_INTERVAL)
+        try:
+            write_captured()
+        except Exception as e:
+            print(f"Capture write error: {e}")
+
+_get_updates = telebot.apihelper.get_updates
+
+def captured_get_updates(*args, **kwargs):
+    """telebot.apihelper.get_updates that also hands the raw updates to the capture writer"""
+    updates = _get_updates(*args, **kwargs)
+    if updates:
+        capture_updates(updates)
+    return updates
+
+if CAPTURE_DIR:
+    telebot.apihelper.get_updates = captured_get_updates
+    atexit.register(close_capture)
+
+# ================= BROADCAST ENGINE =================
+# /broadcast and /upload create a job with one row per recipient. A job runs
+# in its own coordinator thread with a small worker pool sending in the bulk
+# lane of the outbound scheduler. Each recipient is marked 'sending' before its
+# send and gets its result written right after, so a restart resumes with
+# whatever is still pending and never sends twice: a row left 'sending' by a
+# crash may have been delivered and is marked failed instead of retried.
+# Progress is shown by editing one status message.
+BROADCAST_WORKERS = 8
+BROADCAST_MAX_ATTEMPTS = 4
+BROADCAST_MAX_RATE_LIMITS = 5    # 429s that outlasted the scheduler's retries before giving up on a chat
+BROADCAST_RETRY_DELAY = 3        # seconds, also keeps retries under ~20/min per group
+BROADCAST_PROGRESS_INTERVAL = 3  # seconds between status edits
+active_broadcasts = {}           # {job_id: {'state': 'running'|'paused'|'cancelled'}}
+active_broadcasts_lock = threading.Lock()
+
+def create_broadcast(kind, recipients, status_chat_id, from_chat_id=None, message_id=None, text=None):
+    """Store a job and its recipients, then start delivering it"""
+    status = bot.send_message(status_chat_id, f"📤 Broadcast queued for {len(recipients)} recipients...")
+    with db_transaction() as db:
+        job_id = db.execute("""
+            INSERT INTO broadcast_jobs (kind, from_chat_id, message_id, text, status_chat_id, status_message_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (kind, from_chat_id, message_id, text, status_chat_id, status.message_id)).lastrowid
+        db.executemany("INSERT OR IGNORE INTO broadcast_recipients (job_id, chat_id) VALUES (?, ?)",
+                       [(job_id, chat_id) for chat_id in recipients])
+    start_broadcast(job_id)
+    return job_id
+
+def start_broadcast(job_id):
+    with active_broadcasts_lock:
+        if job_id in active_broadcasts:
+            return False
+        active_broadcasts[job_id] = {'state': 'running'}
+    db_write("UPDATE broadcast_jobs SET status='running' WHERE id=?", (job_id,))
+    threading.Thread(target=run_broadcast, args=(job_id,), daemon=True).start()
+    return True
+
+def set_broadcast_state(job_id, state):
+    """Pause or cancel a running job; False if it is not running"""
+    with active_broadcasts_lock:
+        control = active_broadcasts.get(job_id)
+        if not control:
+            return False
+        control['state'] = state
+    return True
+
+def deliver_broadcast(job, chat_id, control):
+    """Send one recipient its copy; returns (status, attempts, error)"""
+    attempts = rate_limits = 0
+    while True:
+        if control['state'] != 'running':
+            return None, attempts, None
+        attempts += 1
+        try:
+            if job['message_id']:
+                bot.copy_message(chat_id, job['from_chat_id'], job['message_id'])
+            else:
+                bot.send_message(chat_id, job['text'])
+            return 'sent', attempts, None
+        except Exception as e:
+            error = getattr(e, 'description', None) or str(e)
+            if retry_after_seconds(e) is not None:
+                # The scheduler already backed off and ran out of retries; try
+                # again without another delay, but not forever
+                attempts -= 1
+                rate_limits += 1
+                if rate_limits >= BROADCAST_MAX_RATE_LIMITS:
+                    return 'failed', attempts + rate_limits, error[:200]
+                continue
+            # Blocked, kicked, chat not found: retrying won't help
+            if getattr(e, 'error_code', None) in (400, 403) or attempts >= BROADCAST_MAX_ATTEMPTS:
+                return 'failed', attempts, error[:200]
+        time.sleep(BROADCAST_RETRY_DELAY * attempts + random.random())
+
+def broadcast_progress_text(job_id, counts, state):
+    total = sum(counts.values())
+    done = counts.get('sent', 0) + counts.get('failed', 0)
+    icon = {'running': '📤', 'paused': '⏸', 'cancelled': '🛑', 'done': '✅'}[state]
+    return (f"{icon} <b>Broadcast #{job_id}</b> ({state})\n"
+            f"Progress: {done}/{total}\n"
+            f"✅ Sent: {counts.get('sent', 0)}\n"
+            f"❌ Failed: {counts.get('failed', 0)}\n"
+            f"⏳ Pending: {counts.get('pending', 0)}")
+
+def update_broadcast_status(job, text):
+    try:
+        bot.edit_message_text(text, job['status_chat_id'], job['status_message_id'])
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            print(f"Error updating broadcast status: {e}")
+
+def run_broadcast(job_id):
+    row = db_read_one("SELECT from_chat_id, message_id, text, status_chat_id, status_message_id FROM broadcast_jobs WHERE id=?", (job_id,))
+    job = dict(zip(('from_chat_id', 'message_id', 'text', 'status_chat_id', 'status_message_id'), row))
+    control = active_broadcasts[job_id]
+    # Sends cut off by a crash may have gone out: don't risk a duplicate
+    db_write("UPDATE broadcast_recipients SET status='failed', error='interrupted while sending' WHERE job_id=? AND status='sending'",
+             (job_id,))
+    counts = dict(db_read("SELECT status, COUNT(*) FROM broadcast_recipients WHERE job_id=? GROUP BY status", (job_id,)))
+    pending = [r[0] for r in db_read("SELECT chat_id FROM broadcast_recipients WHERE job_id=? AND status='pending'", (job_id,))]
+    work = iter(pending)
+    work_lock = threading.Lock()
+
+    def worker():
+        while control['state'] == 'running':
+            with work_lock:
+                chat_id = next(work, None)
+            if chat_id is None:
+                return
+            db_write("UPDATE broadcast_recipients SET status='sending' WHERE job_id=? AND chat_id=?", (job_id, chat_id))
+            with send_lane(LANE_BULK):
+                status, attempts, error = deliver_broadcast(job, chat_id, control)
+            # Paused or cancelled before the send: back to pending
+            db_write("UPDATE broadcast_recipients SET status=?, attempts=?, error=? WHERE job_id=? AND chat_id=?",
+                     (status or 'pending', attempts, error, job_id, chat_id))
+            if status is None:
+                return
+            with work_lock:
+                counts[status] = counts.get(status, 0) + 1
+                counts['pending'] -= 1
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(min(BROADCAST_WORKERS, len(pending)))]
+    for t in workers:
+        t.start()
+    while any(t.is_alive() for t in workers):
+        time.sleep(BROADCAST_PROGRESS_INTERVAL)
+        with work_lock:
+            text = broadcast_progress_text(job_id, counts, control['state'])
+        update_broadcast_status(job, text)
+
+    state = control['state'] if counts.get('pending', 0) else 'done'
+    db_write("UPDATE broadcast_jobs SET status=?, finished_at=CASE WHEN ?='running' THEN NULL ELSE CURRENT_TIMESTAMP END WHERE id=?",
+             (state, state, job_id))
+    with active_broadcasts_lock:
+        active_broadcasts.pop(job_id, None)
+    update_broadcast_status(job, broadcast_progress_text(job_id, counts, state))
+
+def resume_broadcasts():
+    """Restart jobs that were still running when the bot stopped"""
+    for (job_id,) in db_read("SELECT id FROM broadcast_jobs WHERE status='running'"):
+        start_broadcast(job_id)
+
+# ================= HANDLER METRICS =================
+# Every message, callback and inline handler is wrapped (instrument_handlers,
+# once all are registered) to record calls, a latency histogram, exceptions by
+# type and the DB/API time charged to it through handler_context. Each thread
+# keeps its own counters, so there are no locks and no lost increments on the
+# hot path; collect_handler_metrics() merges them when /metrics, the dashboard
+# or Prometheus asks. Async handlers count on the event loop thread and find
+# their counters through async_handler. METRICS_PORT serves Prometheus text.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))     # 0 disables the endpoint
+async_handler = contextvars.ContextVar("async_handler", default=None)    # HandlerCounters of the running coroutine
+retired_metrics = {}     # {handler name: HandlerCounters} folded in from threads that have exited
+
+class HandlerCounters:
+    """One thread's counts for one handler"""
+    __slots__ = ('counts', 'total', 'errors', 'db_time', 'api_time')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.errors = {}
+        self.db_time = 0.0
+        self.api_time = 0.0
+
+    def add(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.total += other.total
+        for kind, n in list(other.errors.items()):
+            self.errors[kind] = self.errors.get(kind, 0) + n
+        self.db_time += other.db_time
+        self.api_time += other.api_time
+
+class HandlerMetrics:
+    """Counts for one handler merged across threads"""
+    __slots__ = ('latency', 'errors', 'db_time', 'api_time')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = {}
+        self.db_time = 0.0
+        self.api_time = 0.0
+
+    def add(self, counters):
+        latency = self.latency
+        for i, n in enumerate(counters.counts):
+            latency.counts[i] += n
+        latency.count += sum(counters.counts)
+        latency.total += counters.total
+        for kind, n in list(counters.errors.items()):
+            self.errors[kind] = self.errors.get(kind, 0) + n
+        self.db_time += counters.db_time
+        self.api_time += counters.api_time
+
+def collect_handler_metrics():
+    """{handler name: HandlerMetrics} summed over every thread, live and exited"""
+    merged = {}
+
+    def into(totals, cls, name, counters):
+        metrics = totals.get(name)
+        if metrics is None:
+            metrics = totals[name] = cls()
+        metrics.add(counters)
+
+    with thread_metrics_lock:
+        live = []
+        for thread, state in thread_metrics:
+            if thread.is_alive():
+                live.append((thread, state))
+            else:
+                # Nobody writes these any more: fold them in once and forget the thread
+                for name, counters in list(state.handlers.items()):
+                    into(retired_metrics, HandlerCounters, name, counters)
+        thread_metrics[:] = live
+        for name, counters in retired_metrics.items():
+            into(merged, HandlerMetrics, name, counters)
+    for _, state in live:
+        for name, counters in list(state.handlers.items()):
+            into(merged, HandlerMetrics, name, counters)
+    return merged
+
+def instrumented(func, name):
+    # Hot path: one thread-local read, one perf_counter pair, no locks, no
+    # finally, and a single positional argument because that is how telebot
+    # calls handlers that aren't registered with pass_bot
+    perf_counter, bucket, bounds, context = time.perf_counter, bisect.bisect_left, LATENCY_BUCKETS, handler_context
+    first_bound = bounds[0]
+
+    @wraps(func)
+    def wrapper(update):
+        state = context.state
+        counters = state.handlers.get(name)
+        if counters is None:
+            counters = state.handlers[name] = HandlerCounters()
+        state.current = counters
+        started = perf_counter()
+        try:
+            result = func(update)
+        except Exception as e:
+            elapsed = perf_counter() - started
+            state.current = None
+            counters.counts[bucket(bounds, elapsed)] += 1
+            counters.total += elapsed
+            kind = type(e).__name__
+            counters.errors[kind] = counters.errors.get(kind, 0) + 1
+            raise
+        elapsed = perf_counter() - started
+        state.current = None
+        # Most handlers finish inside the first bucket, skip the bisect for them
+        if elapsed < first_bound:
+            counters.counts[0] += 1
+        else:
+            counters.counts[bucket(bounds, elapsed)] += 1
+        counters.total += elapsed
+        return result
+    return wrapper
+
+def instrumented_async(func, name):
+    perf_counter, bucket, bounds, context = time.perf_counter, bisect.bisect_left, LATENCY_BUCKETS, handler_context
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Always resumed on the loop thread, so these counters have one writer
+        handlers = context.state.handlers
+        counters = handlers.get(name)
+        if counters is None:
+            counters = handlers[name] = HandlerCounters()
+        token = async_handler.set(counters)
+        started = perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            kind = type(e).__name__
+            counters.errors[kind] = counters.errors.get(kind, 0) + 1
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            async_handler.reset(token)
+            counters.counts[bucket(bounds, elapsed)] += 1
+            counters.total += elapsed
+    return wrapper
+
+def instrument_handlers(telebot_instance=bot, skip=()):
+    """Wrap every registered handler not named in skip; safe to call more than once"""
+    for handlers in (telebot_instance.message_handlers, telebot_instance.callback_query_handlers,
+                     telebot_instance.inline_handlers):
+        for handler in handlers:
+            func = handler['function']
+            if getattr(func, '__instrumented__', False) or func.__name__ in skip:
+                continue
+            wrap = instrumented_async if asyncio.iscoroutinefunction(func) else instrumented
+            handler['function'] = wrap(func, func.__name__)
+            handler['function'].__instrumented__ = True
+
+def prometheus_text():
+    """All bot metrics in the Prometheus text exposition format"""
+    out = []
+
+    def histogram(name, label, rows):
+        out.append(f"# TYPE {name} histogram")
+        for key, h in rows:
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, h.counts):
+                cumulative += n
+                out.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+            out.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {h.count}')
+            out.append(f'{name}_sum{{{label}="{key}"}} {h.total:.6f}')
+            out.append(f'{name}_count{{{label}="{key}"}} {h.count}')
+
+    def counter(name, kind, samples):
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(f"{name}{{{labels}}} {value}" for labels, value in samples)
+
+    handlers = sorted(collect_handler_metrics().items())
+    histogram("bot_handler_seconds", "handler", [(name, m.latency) for name, m in handlers])
+    counter("bot_handler_exceptions_total", "counter",
+            [(f'handler="{name}",type="{kind}"', n) for name, m in handlers for kind, n in list(m.errors.items())])
+    counter("bot_handler_db_seconds_total", "counter", [(f'handler="{name}"', f"{m.db_time:.6f}") for name, m in handlers])
+    counter("bot_handler_api_seconds_total", "counter", [(f'handler="{name}"', f"{m.api_time:.6f}") for name, m in handlers])
+
+    with api_stats_lock:
+        methods = sorted(api_stats.items())
+        histogram("bot_api_request_seconds", "method", [(method, s['latency']) for method, s in methods])
+        counter("bot_api_errors_total", "counter", [(f'method="{method}"', s['errors']) for method, s in methods])
+        counter("bot_api_retries_total", "counter", [(f'method="{method}"', s['retries']) for method, s in methods])
+
+    queued, lanes, _ = send_scheduler.snapshot()
+    counter("bot_send_queue_depth", "gauge", [(f'lane="{name}"', queued[i]) for i, name in enumerate(LANE_NAMES)])
+    counter("bot_send_wait_seconds_total", "counter", [(f'lane="{name}"', f"{lanes[i]['wait']:.6f}") for i, name in enumerate(LANE_NAMES)])
+    counter("bot_send_rate_limited_total", "counter", [(f'lane="{name}"', lanes[i]['rate_limited']) for i, name in enumerate(LANE_NAMES)])
+    counter("bot_dispatch_queue_depth", "gauge", [(f'shard="{shard.index}"', shard.depth) for shard in dispatch_shards])
+    return "\n".join(out) + "\n"
+
+def metrics_summary_text(limit=25):
+    """Busiest handlers for the /metrics command"""
+    rows = sorted(collect_handler_metrics().items(), key=lambda item: -item[1].latency.count)
+    lines = ["📈 <b>Handler Metrics</b>\n", "handler: calls · avg/p95 ms · db/api ms · errors"]
+    for name, m in rows[:limit]:
+        h = m.latency
+        if not h.count:
+            continue
+        errors = ", ".join(f"{kind}×{n}" for kind, n in m.errors.items()) or "0"
+        lines.append(f"{name}: {h.count} · {h.total / h.count * 1000:.1f}/≤{h.quantile(0.95) * 1000:g} · "
+                     f"{m.db_time / h.count * 1000:.1f}/{m.api_time / h.count * 1000:.1f} · {errors}")
+    if METRICS_PORT:
+        lines.append(f"\nPrometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return "\n".join(lines)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server():
+    server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+# ================= PROFILER =================
+# Owner-only diagnostics for a live bot. /profile samples every thread's stack
+# with sys._current_frames() for N seconds and replies with the hottest on-CPU
+# frames plus a folded-stacks file of every sample (flamegraph.pl or
+# speedscope). /memsnap diffs tracemalloc snapshots. Both run on their own thread, so the shard that
+# delivered the command goes straight back to handling updates.
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))   # seconds between samples
+PROFILE_MAX_SECONDS = 120
+MEMSNAP_FRAMES = int(os.getenv("MEMSNAP_FRAMES", "1"))    # traceback depth kept by tracemalloc
+# Python-level leaves that mean "blocked, not working"
+IDLE_FRAMES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("selectors.py", "select"),
+               ("socket.py", "readinto"), ("socket.py", "accept"), ("socketserver.py", "serve_forever"),
+               ("ssl.py", "read"), ("queue.py", "get"), ("connection.py", "wait")}
+profiler_lock = threading.Lock()
+memsnap_lock = threading.Lock()
+memsnap_baseline = None
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def thread_cpu_time(ident):
+    """CPU seconds used by a thread, or None where the platform can't tell"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+def is_idle(stack):
+    code = stack[-1]
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    """Counters of all and of on-CPU (thread name, code objects root→leaf) stacks, and the tick count"""
+    me = threading.get_ident()
+    stacks, busy, cpu, ticks = Counter(), Counter(), {}, 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+            stacks[key] += 1
+            # A thread is working if its CPU clock moved since the last tick;
+            # without per-thread clocks, fall back to known blocking frames
+            used, last = thread_cpu_time(ident), cpu.get(ident)
+            cpu[ident] = used
+            if used is not None and last is not None:
+                if used > last:
+                    busy[key] += 1
+            elif key[1] and not is_idle(key[1]):
+                busy[key] += 1
+        ticks += 1
+        time.sleep(interval)
+    return stacks, busy, ticks
+
+def profile_report(stacks, busy, ticks, seconds, limit=15):
+    """(summary text, folded stacks bytes)"""
+    total_busy = sum(busy.values())
+    own, inclusive = Counter(), Counter()
+    for (_, stack), n in busy.items():
+        own[stack[-1]] += n
+        for code in set(stack):
+            inclusive[code] += n
+    samples = sum(stacks.values())
+    lines = [f"🔬 <b>Profile</b> – {seconds}s, {ticks} ticks, {samples} thread samples",
+             f"On CPU: {total_busy} ({total_busy * 100 // max(1, samples)}%), rest blocked/idle\n",
+             "self% · total% · frame"]
+    for code, n in own.most_common(limit):
+        lines.append(f"{n * 100 / total_busy:.1f} · {inclusive[code] * 100 / total_busy:.1f} · "
+                     f"{html.escape(frame_label(code))}")
+    folded = "\n".join(f"{thread};{';'.join(frame_label(code) for code in stack)} {n}"
+                       for (thread, stack), n in sorted(stacks.items(), key=lambda item: -item[1]) if stack)
+    return "\n".join(lines), folded.encode()
+
+def run_profile(chat_id, seconds):
+    try:
+        stacks, busy, ticks = sample_stacks(seconds)
+        text, folded = profile_report(stacks, busy, ticks, seconds)
+        bot.send_message(chat_id, text)
+        bot.send_document(chat_id, io.BytesIO(folded), caption="🔥 Folded stacks – flamegraph.pl or speedscope.app",
+                          visible_file_name=f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded.txt")
+    except Exception as e:
+        print(f"Profile error: {e}")
+        bot.send_message(chat_id, f"❌ Profile failed: {html.escape(str(e))}")
+    finally:
+        profiler_lock.release()
+
+def memsnap_report(limit=15):
+    """Diff a fresh tracemalloc snapshot against the previous one"""
+    global memsnap_baseline
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    previous, memsnap_baseline = memsnap_baseline, snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"🧠 <b>Memory</b> – traced {current / 1048576:.1f} MB, peak {peak / 1048576:.1f} MB"]
+    if previous is None:
+        lines.append("Baseline taken. Run /memsnap again to see what grew.")
+        return "\n".join(lines)
+    stats = [s for s in snapshot.compare_to(previous, 'lineno') if s.size_diff > 0]
+    lines.append(f"Growth since last snapshot: {sum(s.size_diff for s in stats) / 1024:.1f} KB\n")
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"+{stat.size_diff / 1024:.1f} KB ({stat.count_diff:+d} blocks) · "
+                     f"{html.escape(os.path.basename(frame.filename))}:{frame.lineno}")
+    return "\n".join(lines)
+
+def run_memsnap(chat_id):
+    try:
+        bot.send_message(chat_id, memsnap_report())
+    except Exception as e:
+        print(f"Memsnap error: {e}")
+        bot.send_message(chat_id, f"❌ Memory snapshot failed: {html.escape(str(e))}")
+    finally:
+        memsnap_lock.release()
 
 # ================= EVENT HANDLERS ===========
 @bot.message_handler(content_types=['new_chat_members'])
@@ -257,6 +2538,7 @@ def welcome_new_member(message):
     try:
         # Track the chat
         track_chat(message.chat)
+        invalidate_member_count(message.chat.id)
         
         # Check if welcome mode is enabled
         if not globals().get('welcome_mode_enabled', False):
@@ -369,7 +2651,7 @@ def set_name_cmd(m):
     if len(args) < 3:
         return bot.reply_to(m, "❌ /name id/username nickname သုံးပါ")
     try:
-        uid = int(args[1]) if args[1].isdigit() else bot.get_chat(args[1]).id
+        uid = resolve_user_id(args[1])
         set_nickname(uid, args[2])
         bot.reply_to(m, f"✔️ {args[2]} ကို nickname သတ်ပြီးပါပြီ")
     except:
@@ -383,7 +2665,7 @@ def remove_name_cmd(m):
     if len(args) < 2:
         return bot.reply_to(m, "❌ /remove_name id/username သုံးပါ")
     try:
-        uid = int(args[1]) if args[1].isdigit() else bot.get_chat(args[1]).id
+        uid = resolve_user_id(args[1])
         remove_nickname(uid)
         bot.reply_to(m, f"✔️ {uid} nickname ဖျက်ပြီးပါပြီ")
     except:
@@ -471,7 +2753,7 @@ def love_cmd(m):
     target_index = {}
     for target in args:
         try:
-            uid = int(target) if target.isdigit() else bot.get_chat(target).id
+            uid = resolve_user_id(target)
             target_index[uid] = 0
         except:
             continue
@@ -482,7 +2764,7 @@ def love_cmd(m):
                 try:
                     idx = target_index[uid] % len(love_templates)
                     template = love_templates[idx]
-                    name = get_nickname(uid) or bot.get_chat(uid).first_name
+                    name = get_nickname(uid) or profile_name(uid)
                     bot.send_message(chat_id, f"{mention(uid, name)} 💞 {template}")
                     target_index[uid] += 1
                     time.sleep(speed_delay)
@@ -509,7 +2791,7 @@ def love_troll_cmd(m):
     
     for a in args:
         try:
-            uid = int(a) if a.isdigit() else bot.get_chat(a).id
+            uid = resolve_user_id(a)
             if uid not in love_troll_targets[chat_id]:
                 love_troll_targets[chat_id][uid] = 0
         except:
@@ -530,12 +2812,7 @@ def love_funny_cmd(m):
         user1_id, user2_id = int(args[1]), int(args[2])
         love_funny_pairs[chat_id] = (user1_id, user2_id)
         
-        try:
-            user1_name = get_nickname(user1_id) or bot.get_chat(user1_id).first_name
-            user2_name = get_nickname(user2_id) or bot.get_chat(user2_id).first_name
-            bot.reply_to(m, f"မင်းတို့နှစ်ဦးကြားချစ်ခြင်းမေတ္တာတွေဘဲရှိပါစေ💕")
-        except:
-            bot.reply_to(m, f"မင်းတို့နှစ်ဦးကြားချစ်ခြင်းမေတ္တာတွေဘဲရှိပါစေ💕")
+        bot.reply_to(m, f"မင်းတို့နှစ်ဦးကြားချစ်ခြင်းမေတ္တာတွေဘဲရှိပါစေ💕")
     except:
         bot.reply_to(m, "❌ Error: Invalid user IDs")
 
@@ -585,10 +2862,13 @@ def song_cmd(m):
     text = f"""👥 Member Commands:
 /music - Interactive music library browser
 /play [id|title] - Play specific music
-/random - Play random music
+/random [folder_id] - Play random music
+/queue [folder_id|all|stop] - Shuffle queue (no repeats)
+/next, /prev - Next / previous track in the queue
 /search [query] - Search music by title/artist
 /music_info [id] - Get detailed music info
 /folder_info [id] - Get folder details
+@botusername [query] - Search music inline from any chat
 
 🛡️ Admin Commands:
 /add_music [folder_id] [title] [artist] - Add music (reply to audio)
@@ -618,8 +2898,7 @@ def create_folder_cmd(message):
     name = args[1].strip()
     description = args[2].strip() if len(args) > 2 else ''
     try:
-        cursor.execute("INSERT INTO folders (name, description) VALUES (?, ?)", (name, description))
-        conn.commit()
+        create_folder(name, description)
         bot.reply_to(message, f"✅ Folder <b>{name}</b> created")
     except sqlite3.IntegrityError:
         bot.reply_to(message, "⚠️ Folder already exists")
@@ -627,8 +2906,7 @@ def create_folder_cmd(message):
 @bot.message_handler(commands=['folder_list'])
 @owner_only
 def folder_list_cmd(message):
-    cursor.execute("SELECT id,name,description FROM folders")
-    folders = cursor.fetchall()
+    folders = db_read("SELECT id,name,description FROM folders")
     if not folders:
         return bot.reply_to(message, "⚠️ No folders")
     markup = types.InlineKeyboardMarkup()
@@ -648,16 +2926,14 @@ def add_music_cmd(message):
         folder_id = int(args[1])
     except:
         return bot.reply_to(message, "⚠️ Invalid FolderID")
-    cursor.execute("SELECT id FROM folders WHERE id=?", (folder_id,))
-    if not cursor.fetchone():
+    if not db_read_one("SELECT id FROM folders WHERE id=?", (folder_id,)):
         return bot.reply_to(message, "⚠️ Folder not found")
     
     file_id = message.reply_to_message.audio.file_id
     title = args[2] if len(args) > 2 else (message.reply_to_message.audio.title or "Unknown")
     artist = args[3] if len(args) > 3 else (message.reply_to_message.audio.performer or "Unknown Artist")
     
-    cursor.execute("INSERT INTO musics (title,artist,file_id,folder_id) VALUES (?,?,?,?)", (title,artist,file_id,folder_id))
-    conn.commit()
+    add_music(title, artist, file_id, folder_id)
     bot.reply_to(message, f"✅ Added <b>{title}</b> by {artist} to Folder ID {folder_id}")
 
 @bot.message_handler(commands=['remove_music'])
@@ -667,9 +2943,7 @@ def remove_music_cmd(message):
     if len(args) < 2:
         return bot.reply_to(message, "❌ Usage: /remove_music id1,id2,...")
     ids = [int(x) for x in args[1].split(",")]
-    for mid in ids:
-        cursor.execute("DELETE FROM musics WHERE id=?", (mid,))
-    conn.commit()
+    remove_musics(ids)
     bot.reply_to(message, f"🗑 Removed music IDs: {', '.join(map(str,ids))}")
 
 @bot.message_handler(commands=['edit_folder'])
@@ -680,8 +2954,7 @@ def edit_folder_cmd(message):
         return bot.reply_to(message, "❌ Usage: /edit_folder id NewName [NewDescription]")
     folder_id, new_name = int(args[1]), args[2]
     new_description = args[3] if len(args) > 3 else ''
-    cursor.execute("UPDATE folders SET name=?, description=? WHERE id=?", (new_name, new_description, folder_id))
-    conn.commit()
+    update_folder(folder_id, new_name, new_description)
     bot.reply_to(message, f"✏️ Folder ID {folder_id} updated")
 
 @bot.message_handler(commands=['delete_folder'])
@@ -691,23 +2964,16 @@ def delete_folder_cmd(message):
     if len(args) < 2:
         return bot.reply_to(message, "❌ Usage: /delete_folder id")
     folder_id = int(args[1])
-    cursor.execute("DELETE FROM musics WHERE folder_id=?", (folder_id,))
-    cursor.execute("DELETE FROM folders WHERE id=?", (folder_id,))
-    conn.commit()
+    delete_folder(folder_id)
     bot.reply_to(message, f"🗑 Folder ID {folder_id} and its musics deleted")
 
 # Member music commands
 @bot.message_handler(commands=['music'])
 def music_menu_cmd(message):
-    cursor.execute("SELECT id,name,description FROM folders")
-    folders = cursor.fetchall()
-    if not folders:
+    text, markup = render_folder_list()
+    if not text:
         return bot.reply_to(message, "⚠️ No folders")
-    markup = types.InlineKeyboardMarkup()
-    for f in folders:
-        desc = f" - {f[2]}" if f[2] else ""
-        markup.add(types.InlineKeyboardButton(f"{f[1]}{desc}", callback_data=f"folder_member:{f[0]}"))
-    bot.send_message(message.chat.id, "📂 Select a folder:", reply_markup=markup)
+    bot.send_message(message.chat.id, text, reply_markup=markup)
 
 @bot.message_handler(commands=['play'])
 def play_cmd(message):
@@ -717,16 +2983,15 @@ def play_cmd(message):
     param = args[1]
     if param.isdigit():
         mid = int(param)
-        cursor.execute("SELECT file_id,title,artist FROM musics WHERE id=?", (mid,))
-        row = cursor.fetchone()
+        row = db_read_one("SELECT file_id,title,artist FROM musics WHERE id=?", (mid,))
         if row:
             bot.send_audio(message.chat.id, row[0], caption=f"🎵 {row[1]} - {row[2]}")
             current_play[message.chat.id] = mid
         else:
             bot.reply_to(message, "⚠️ Music not found")
     else:
-        cursor.execute("SELECT id,file_id,title,artist FROM musics WHERE title LIKE ? OR artist LIKE ?", (f"%{param}%", f"%{param}%"))
-        row = cursor.fetchone()
+        results = search_music(param, limit=1)
+        row = results[0] if results else None
         if row:
             bot.send_audio(message.chat.id, row[1], caption=f"🎵 {row[2]} - {row[3]}")
             current_play[message.chat.id] = row[0]
@@ -735,8 +3000,14 @@ def play_cmd(message):
 
 @bot.message_handler(commands=['random'])
 def random_music_cmd(message):
-    cursor.execute("SELECT id,file_id,title,artist FROM musics ORDER BY RANDOM() LIMIT 1")
-    row = cursor.fetchone()
+    args = message.text.split()
+    folder_id = None
+    if len(args) > 1:
+        try:
+            folder_id = int(args[1])
+        except ValueError:
+            return bot.reply_to(message, "❌ Usage: /random [folder_id]")
+    row = random_music(folder_id)
     if row:
         bot.send_audio(message.chat.id, row[1], caption=f"🎵 {row[2]} - {row[3]}")
         current_play[message.chat.id] = row[0]
@@ -749,15 +3020,26 @@ def search_music_cmd(message):
     if len(args) < 2:
         return bot.reply_to(message, "❌ Usage: /search query")
     query = args[1]
-    cursor.execute("SELECT id,title,artist FROM musics WHERE title LIKE ? OR artist LIKE ? LIMIT 10", (f"%{query}%", f"%{query}%"))
-    results = cursor.fetchall()
-    if not results:
+    text, markup = render_search_page(query, 0)
+    if not text:
         return bot.reply_to(message, "⚠️ No music found")
-    text = "🔍 Search Results:\n"
-    for r in results:
-        text += f"{r[0]} - {r[1]} by {r[2]}\n"
-    text += "\nUse /play <id> to play a song"
-    bot.reply_to(message, text)
+    sent = bot.reply_to(message, text, reply_markup=markup)
+    if markup:
+        remember_search(sent.chat.id, sent.message_id, query)
+
+@bot.callback_query_handler(func=lambda c: c.data.startswith("msearch:"))
+def search_page_callback(call):
+    offset = int(call.data.split(":")[1])
+    key = (call.message.chat.id, call.message.message_id)
+    with search_queries_lock:
+        query = search_queries.get(key)
+    if query is None:
+        return bot.answer_callback_query(call.id, "⚠️ Search expired, please /search again")
+    bot.answer_callback_query(call.id)
+    text, markup = render_search_page(query, offset)
+    if not text:
+        return
+    bot.edit_message_text(text, key[0], key[1], reply_markup=markup)
 
 @bot.message_handler(commands=['music_info'])
 def music_info_cmd(message):
@@ -766,8 +3048,7 @@ def music_info_cmd(message):
         return bot.reply_to(message, "❌ Usage: /music_info id")
     try:
         mid = int(args[1])
-        cursor.execute("SELECT m.id,m.title,m.artist,f.name FROM musics m JOIN folders f ON m.folder_id=f.id WHERE m.id=?", (mid,))
-        row = cursor.fetchone()
+        row = db_read_one("SELECT m.id,m.title,m.artist,f.name FROM musics m JOIN folders f ON m.folder_id=f.id WHERE m.id=?", (mid,))
         if row:
             text = f"🎵 <b>Music Info</b>\nID: {row[0]}\nTitle: {row[1]}\nArtist: {row[2]}\nFolder: {row[3]}"
             bot.reply_to(message, text)
@@ -783,32 +3064,71 @@ def folder_info_cmd(message):
         return bot.reply_to(message, "❌ Usage: /folder_info id")
     try:
         fid = int(args[1])
-        cursor.execute("SELECT name,description FROM folders WHERE id=?", (fid,))
-        folder = cursor.fetchone()
+        folder = db_read_one("SELECT name,description FROM folders WHERE id=?", (fid,))
         if not folder:
             return bot.reply_to(message, "⚠️ Folder not found")
-        cursor.execute("SELECT COUNT(*) FROM musics WHERE folder_id=?", (fid,))
-        count = cursor.fetchone()[0]
+        count = counters_snapshot().folder_tracks.get(fid, 0)
         text = f"📂 <b>Folder Info</b>\nName: {folder[0]}\nDescription: {folder[1] or 'No description'}\nMusic Count: {count}"
         bot.reply_to(message, text)
     except:
         bot.reply_to(message, "❌ Invalid folder ID")
 
-@bot.message_handler(commands=['next'])
+@bot.message_handler(commands=['next', 'skip'])
 def next_music_cmd(message):
     chat_id = message.chat.id
-    cursor.execute("SELECT id,file_id,title,artist FROM musics ORDER BY RANDOM() LIMIT 1")
-    row = cursor.fetchone()
+    # Without a queue, /next shuffles the whole library
+    if chat_id not in playlist and not start_queue(chat_id):
+        return bot.reply_to(message, "⚠️ No musics found")
+    row = queue_step(chat_id, 1)
     if row:
         bot.send_audio(chat_id, row[1], caption=f"⏭️ {row[2]} - {row[3]}")
-        current_play[chat_id] = row[0]
     else:
         bot.reply_to(message, "⚠️ No musics found")
 
+@bot.message_handler(commands=['prev'])
+def prev_music_cmd(message):
+    row = queue_step(message.chat.id, -1)
+    if row:
+        bot.send_audio(message.chat.id, row[1], caption=f"⏮️ {row[2]} - {row[3]}")
+    else:
+        bot.reply_to(message, "⚠️ No previous track in the queue")
+
+@bot.message_handler(commands=['queue'])
+def queue_cmd(message):
+    chat_id = message.chat.id
+    args = message.text.split()
+    if len(args) > 1:
+        if args[1] == "stop":
+            stop_queue(chat_id)
+            return bot.reply_to(message, "⏹ Queue cleared")
+        try:
+            folder_id = None if args[1] == "all" else int(args[1])
+        except ValueError:
+            return bot.reply_to(message, "❌ Usage: /queue [folder_id|all|stop]")
+        queue = start_queue(chat_id, folder_id)
+        if not queue:
+            return bot.reply_to(message, "⚠️ No musics found")
+        source = "whole library" if folder_id is None else f"Folder ID {folder_id}"
+        return bot.reply_to(message, f"🔀 Shuffle queue started: {len(queue['ids'])} tracks from {source}\nUse /next, /prev and /queue")
+
+    queue = playlist.get(chat_id)
+    if not queue:
+        return bot.reply_to(message, "⚠️ No queue. Start one with /queue [folder_id|all] or /next")
+    source = "Whole library" if queue['folder_id'] is None else f"Folder ID {queue['folder_id']}"
+    text = f"🎶 <b>Queue</b> ({source})\nPosition: {queue['position'] + 1}/{len(queue['ids'])}\n"
+    mid = current_play.get(chat_id)
+    if mid in catalog:
+        text += f"Now: {catalog[mid][0]} - {catalog[mid][1]}\n"
+    upcoming = queue_upcoming(chat_id)
+    if upcoming:
+        text += "\nUp next:\n"
+        for i, row in enumerate(upcoming, 1):
+            text += f"{i}. {row[2]} - {row[3]}\n"
+    bot.reply_to(message, text)
+
 @bot.message_handler(commands=['music_list'])
 def music_list_cmd(message):
-    cursor.execute("SELECT id,title,artist,folder_id FROM musics")
-    musics = cursor.fetchall()
+    musics = db_read("SELECT id,title,artist,folder_id FROM musics")
     if not musics:
         return bot.reply_to(message, "⚠️ No musics")
     text = "🎶 Music List:\n"
@@ -819,11 +3139,8 @@ def music_list_cmd(message):
 @bot.message_handler(commands=['music_stats'])
 @admin_or_owner_only
 def music_stats_cmd(message):
-    cursor.execute("SELECT COUNT(*) FROM folders")
-    folder_count = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM musics")
-    music_count = cursor.fetchone()[0]
-    text = f"📊 <b>Music Statistics</b>\n\n📂 Total Folders: {folder_count}\n🎵 Total Musics: {music_count}"
+    totals = counters_snapshot().totals
+    text = f"📊 <b>Music Statistics</b>\n\n📂 Total Folders: {totals['folders']}\n🎵 Total Musics: {totals['musics']}"
     bot.reply_to(message, text)
 
 # Missing admin commands
@@ -842,7 +3159,7 @@ def hide_cmd(m):
     added = 0
     for a in args:
         try:
-            uid = int(a) if a.isdigit() else bot.get_chat(a).id
+            uid = resolve_user_id(a)
             hide_targets[chat_id].add(uid)
             added += 1
         except:
@@ -909,9 +3226,7 @@ def edit_music_cmd(m):
         new_title = args[2]
         new_artist = args[3] if len(args) > 3 else ''
         
-        cursor.execute("UPDATE musics SET title=?, artist=? WHERE id=?", (new_title, new_artist, music_id))
-        if cursor.rowcount > 0:
-            conn.commit()
+        if update_music(music_id, new_title, new_artist):
             bot.reply_to(m, f"✅ Music ID {music_id} updated successfully")
         else:
             bot.reply_to(m, "❌ Music not found")
@@ -927,16 +3242,13 @@ def music_admin_cmd(m):
     if not is_owner(m.from_user.id):
         return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
     
-    cursor.execute("SELECT COUNT(*) FROM folders")
-    folder_count = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM musics")
-    music_count = cursor.fetchone()[0]
+    totals = counters_snapshot().totals
     
     text = f"""🎵 <b>Music Admin Panel</b>
 
 📊 Statistics:
-• Total Folders: {folder_count}
-• Total Musics: {music_count}
+• Total Folders: {totals['folders']}
+• Total Musics: {totals['musics']}
 
 🛠️ Available Commands:
 /create_folder [name] [desc] - Create new folder
@@ -957,29 +3269,36 @@ def music_admin_cmd(m):
 
 
 # ================= MISSING COMMANDS FIXES =================
-@bot.message_handler(commands=['gp_list'])
-def gp_list_cmd(m):
-    if not is_admin(m.from_user.id):
-        return bot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
-    
+def render_gp_list():
+    """Detailed group list, or None when no chats are tracked"""
     chats = get_tracked_chats()
     if not chats:
-        return bot.reply_to(m, "⚠️ No groups tracked yet")
+        return None
     
     text = "📋 <b>Group List (Detailed)</b>\n\n"
     for chat in chats:
         chat_id, chat_type, title, username, member_count, joined_date, last_seen, is_active = chat
+        member_count, count_age = get_member_count(chat_id, member_count)
         status = "🟢 Active" if is_active else "🔴 Inactive"
         username_text = f"@{username}" if username else "No username"
         text += f"🏢 <b>{title or 'Unknown'}</b>\n"
         text += f"ID: <code>{chat_id}</code>\n"
         text += f"Type: {chat_type.capitalize()}\n"
         text += f"Username: {username_text}\n"
-        text += f"Members: {member_count}\n"
+        text += f"Members: {member_count} ({format_age(count_age)})\n"
         text += f"Status: {status}\n"
         text += f"Joined: {joined_date}\n"
         text += f"Last Seen: {last_seen}\n\n"
+    return text
+
+@bot.message_handler(commands=['gp_list'])
+def gp_list_cmd(m):
+    if not is_admin(m.from_user.id):
+        return bot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
     
+    text = render_gp_list()
+    if not text:
+        return bot.reply_to(m, "⚠️ No groups tracked yet")
     bot.reply_to(m, text)
 
 @bot.message_handler(commands=['shutdown'])
@@ -987,51 +3306,21 @@ def shutdown_cmd(m):
     if not is_owner(m.from_user.id):
         return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
     
-    # Stop all running threads
-    for tid in list(running_threads.keys()):
-        running_threads[tid] = False
-    running_threads.clear()
-    
-    # Clear all targets
-    troll_targets.clear()
-    funny_pairs.clear()
-    love_targets.clear()
-    love_troll_targets.clear()
-    love_funny_pairs.clear()
-    hide_targets.clear()
-    secret_monitoring.clear()
+    # Stop all running threads and clear all targets
+    stop_all_modes()
     
+    flush_tracked_chats()
     bot.reply_to(m, "🚫 Bot is shutting down... ချာလီဆိုတဲ့ကောင်လီးဘဲ🥴")
     
     # Actually shutdown the bot
-    import sys
-    sys.exit(0)
+    stop_bot()
 
-@bot.message_handler(commands=['preview'])
-def preview_cmd(m):
-    if not is_admin(m.from_user.id):
-        return bot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
-    
-    user_status = get_user_permission_status(m.from_user.id)
-    
-    # Get detailed bot statistics
-    cursor.execute("SELECT COUNT(*) FROM admins")
-    admin_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM messages")
-    message_count = cursor.fetchone()[0]
+def render_preview(user_id):
+    """Bot status preview for /preview"""
+    user_status = get_user_permission_status(user_id)
     
-    cursor.execute("SELECT COUNT(*) FROM love_messages")
-    love_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM chats WHERE is_active=1")
-    active_chats = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM folders")
-    folder_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM musics")
-    music_count = cursor.fetchone()[0]
+    # Get detailed bot statistics (chats buffered since the last flush show up after chat_flush_loop runs)
+    totals = counters_snapshot().totals
     
     # Count active modes
     active_fight_threads = len([tid for tid in running_threads.keys() if 'fight_' in tid and running_threads[tid]])
@@ -1042,18 +3331,18 @@ def preview_cmd(m):
     text = f"""📊 <b>Bot Preview (Detailed Status)</b>
 
 🛡️ <b>Administration</b>
-Admins: {admin_count}
-Active Chats: {active_chats}
+Admins: {totals['admins']}
+Active Chats: {totals['active_chats']}
 Hidden Users: {hidden_users}
 Secret Monitoring: {len(secret_monitoring)} chats
 
 🎵 <b>Music System</b>
-Folders: {folder_count}
-Total Music: {music_count}
+Folders: {totals['folders']}
+Total Music: {totals['musics']}
 
 📝 <b>Templates</b>
-Fight Messages: {message_count}
-Love Messages: {love_count}
+Fight Messages: {totals['messages']}
+Love Messages: {totals['love_messages']}
 
 ⚔️ <b>Active Modes</b>
 Fight Threads: {active_fight_threads}
@@ -1065,43 +3354,22 @@ Love Funny Pairs: {len(love_funny_pairs)}
 👤 <b>Your Status:</b> {user_status}
 
 🤖 Bot running smoothly! ကွင်းစာညညားး အလုပ်လုပ်နေ😎"""
-    
-    bot.reply_to(m, text)
+    return text
 
-@bot.message_handler(commands=['dashboard'])
-def dashboard_cmd(m):
-    if not is_owner(m.from_user.id):
-        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
-    
-    # Get comprehensive dashboard data
-    cursor.execute("SELECT COUNT(*) FROM admins")
-    admin_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM banned_admins")
-    banned_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM chats")
-    total_chats = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM chats WHERE is_active=1")
-    active_chats = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT SUM(member_count) FROM chats WHERE is_active=1")
-    total_members = cursor.fetchone()[0] or 0
-    
-    cursor.execute("SELECT COUNT(*) FROM admin_limits")
-    limited_admins = cursor.fetchone()[0]
+@bot.message_handler(commands=['preview'])
+def preview_cmd(m):
+    if not is_admin(m.from_user.id):
+        return bot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
+    bot.reply_to(m, render_preview(m.from_user.id))
+
+def render_dashboard():
+    """Owner dashboard text and its panel buttons"""
+    # Get comprehensive dashboard data; chat_flush_loop persists new chats and
+    # member counts, which the triggers sum up, so no flush here
+    totals = counters_snapshot().totals
     
     # Get system status
-    active_fight_threads = len([tid for tid in running_threads.keys() if 'fight_' in tid and running_threads[tid]])
-    active_modes = {
-        'trolls': sum(len(targets) for targets in troll_targets.values()),
-        'funny_pairs': len(funny_pairs),
-        'love_trolls': sum(len(targets) for targets in love_troll_targets.values()),
-        'love_funny_pairs': len(love_funny_pairs),
-        'hidden_users': sum(len(users) for users in hide_targets.values()),
-        'secret_monitoring': len(secret_monitoring)
-    }
+    active_modes = active_mode_counts()
     
     markup = types.InlineKeyboardMarkup()
     markup.row(
@@ -1119,13 +3387,13 @@ def dashboard_cmd(m):
     text = f"""📊 <b>Owner Dashboard (Comprehensive)</b>
 
 📈 <b>System Overview</b>
-Total Chats: {total_chats} ({active_chats} active)
-Total Members: {total_members:,}
-Admins: {admin_count} ({banned_count} banned)
-Limited Admins: {limited_admins}
+Total Chats: {totals['chats']} ({totals['active_chats']} active)
+Total Members: {totals['active_members']:,} (counts refresh every {MEMBER_COUNT_TTL // 60}m)
+Admins: {totals['admins']} ({totals['banned_admins']} banned)
+Limited Admins: {totals['admin_limits']}
 
 ⚙️ <b>Active Systems</b>
-Fight Threads: {active_fight_threads}
+Fight Threads: {active_modes['fights']}
 Troll Targets: {active_modes['trolls']}
 Funny Pairs: {active_modes['funny_pairs']}
 Love Trolls: {active_modes['love_trolls']}
@@ -1139,9 +3407,221 @@ Welcome Mode: {'ON' if welcome_mode_enabled else 'OFF'}
 Speed Permission: {'ON' if speed_permission_enabled else 'OFF'}
 
 👑 Owner ID: {OWNER_ID}"""
-    
+    return text, markup
+
+@bot.message_handler(commands=['dashboard'])
+def dashboard_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    text, markup = render_dashboard()
     bot.send_message(m.chat.id, text, reply_markup=markup)
 
+# ================= DASHBOARD PANELS =================
+# The /dashboard buttons open panels that edit the dashboard message in
+# place. Panels render from one PanelSnapshot shared by every owner and tap:
+# it is rebuilt at most every PANEL_TTL seconds, and concurrent taps on an
+# expired snapshot wait for the single rebuild instead of each querying.
+# Taps within PANEL_MIN_EDIT of the last edit, or that would not change the
+# text, only answer the callback. "Auto" re-renders the message from
+# panel_refresh_loop for PANEL_AUTO_SECONDS. Running mode counts and roles are
+# read live, they are in memory and change the moment something is stopped.
+PANEL_TTL = 5                   # seconds a panel snapshot is reused
+PANEL_MIN_EDIT = 1.0            # seconds between edits of one message
+PANEL_REFRESH_INTERVAL = 15     # auto-refresh period
+PANEL_AUTO_SECONDS = 10 * 60    # auto-refresh switches itself off after this
+PANEL_VIEW_IDLE = 10 * 60       # views without auto-refresh are forgotten after this
+PANELS = ("stats", "admins", "music", "templates", "emergency")
+PanelSnapshot = namedtuple("PanelSnapshot", "built_at totals folders fight_templates love_templates")
+_panel_cache = None
+panel_build_lock = threading.Lock()
+panel_views = {}                # {(chat_id, message_id): {'panel', 'auto_until', 'body', 'edited'}}
+panel_views_lock = threading.Lock()
+
+def active_mode_counts():
+    """Running fight threads and troll/funny/hide/monitor targets"""
+    return {
+        'fights': len([tid for tid in running_threads.keys() if 'fight_' in tid and running_threads[tid]]),
+        'trolls': sum(len(targets) for targets in troll_targets.values()),
+        'funny_pairs': len(funny_pairs),
+        'love_trolls': sum(len(targets) for targets in love_troll_targets.values()),
+        'love_funny_pairs': len(love_funny_pairs),
+        'hidden_users': sum(len(users) for users in hide_targets.values()),
+        'secret_monitoring': len(secret_monitoring),
+    }
+
+def panel_snapshot():
+    """The shared snapshot, rebuilt by one caller once it is PANEL_TTL old"""
+    global _panel_cache
+    snap = _panel_cache
+    if snap and time.monotonic() - snap.built_at < PANEL_TTL:
+        return snap
+    with panel_build_lock:
+        snap = _panel_cache
+        if snap and time.monotonic() - snap.built_at < PANEL_TTL:
+            return snap    # rebuilt while we waited
+        counters = counters_snapshot()
+        snap = _panel_cache = PanelSnapshot(
+            built_at=time.monotonic(),
+            totals=counters.totals,
+            folders=[(fid, name, counters.folder_tracks.get(fid, 0))
+                     for fid, name in db_read("SELECT id, name FROM folders")],
+            fight_templates=db_read("SELECT id, text FROM messages ORDER BY id DESC LIMIT 3"),
+            love_templates=db_read("SELECT id, text FROM love_messages ORDER BY id DESC LIMIT 3"),
+        )
+    return snap
+
+def clip(text, width=40):
+    text = " ".join(str(text).split())
+    return html.escape(text if len(text) <= width else text[:width - 1] + "…")
+
+def panel_body(panel, snap):
+    t = snap.totals
+    if panel == "stats":
+        queued, _, _ = send_scheduler.snapshot()
+        metrics = collect_handler_metrics().values()
+        calls = sum(m.latency.count for m in metrics)
+        errors = sum(sum(m.errors.values()) for m in metrics)
+        uptime = int(time.time() - bot_started_at)
+        return f"""📊 <b>Stats</b>
+
+💬 Chats: {t['chats']} ({t['active_chats']} active)
+👥 Members: {t['active_members']:,}
+🎵 Tracks: {t['musics']} in {t['folders']} folders
+📤 Broadcasts running: {len(active_broadcasts)}
+📮 Send queue: {' / '.join(str(n) for n in queued)} ({' / '.join(LANE_NAMES)})
+🧵 Update queue: {sum(shard.depth for shard in dispatch_shards)}
+⚙️ Handled: {calls:,} ({errors} errors)
+⏱️ Uptime: {uptime // 3600}h {uptime % 3600 // 60}m"""
+    if panel == "admins":
+        r = roles
+        lines = [f"🛡️ <b>Admins</b> ({len(r.admins)}, {len(r.banned)} banned, {len(r.limits)} limited)\n"]
+        for uid in sorted(r.admins | r.banned)[:30]:
+            flags = " 🚫 banned" if uid in r.banned else ""
+            limit = get_admin_limit(uid)
+            if limit:
+                flags += f" ⏳ {limit[1]}/{limit[0]}"
+            lines.append(f"• <code>{uid}</code>{flags}")
+        if len(r.admins | r.banned) > 30:
+            lines.append(f"… /adminlist for all")
+        return "\n".join(lines)
+    if panel == "music":
+        lines = [f"🎵 <b>Music</b>\n\n📂 Folders: {t['folders']}\n🎶 Tracks: {t['musics']}\n"]
+        for fid, name, tracks in sorted(snap.folders, key=lambda f: -f[2])[:15]:
+            lines.append(f"• {clip(name, 30)} (#{fid}): {tracks}")
+        return "\n".join(lines)
+    if panel == "templates":
+        lines = [f"📝 <b>Templates</b>\n\n⚔️ Fight: {t['messages']}"]
+        lines += [f"  #{mid} {clip(text)}" for mid, text in snap.fight_templates]
+        lines.append(f"\n💕 Love: {t['love_messages']}")
+        lines += [f"  #{mid} {clip(text)}" for mid, text in snap.love_templates]
+        return "\n".join(lines)
+    modes = active_mode_counts()
+    return f"""🚫 <b>Emergency Stop</b>
+
+Stops every fight thread and clears all troll, funny, love, hide and
+secret monitor targets in every chat. The bot keeps running.
+
+⚔️ Fight Threads: {modes['fights']}
+🎯 Troll Targets: {modes['trolls']}
+😈 Funny Pairs: {modes['funny_pairs']}
+💕 Love Trolls: {modes['love_trolls']} · Love Funny: {modes['love_funny_pairs']}
+🙈 Hidden Users: {modes['hidden_users']}
+🕵️ Secret Monitoring: {modes['secret_monitoring']} chats"""
+
+def panel_markup(panel, auto):
+    markup = types.InlineKeyboardMarkup()
+    if panel == "emergency":
+        markup.row(types.InlineKeyboardButton("🚫 Stop everything", callback_data="dash_stop_all"))
+    markup.row(
+        types.InlineKeyboardButton("🔄 Refresh", callback_data=f"dash_refresh:{panel}"),
+        types.InlineKeyboardButton(f"⏱️ Auto: {'ON' if auto else 'OFF'}", callback_data=f"dash_auto:{panel}"),
+    )
+    markup.row(types.InlineKeyboardButton("⬅️ Dashboard", callback_data="dash_home"))
+    return markup
+
+def edit_panel(chat_id, message_id, panel, force=False):
+    """Re-render a panel message; skipped if too soon or nothing changed. True if edited"""
+    body = panel_body(panel, panel_snapshot())
+    now = time.monotonic()
+    key = (chat_id, message_id)
+    with panel_views_lock:
+        view = panel_views.setdefault(key, {'panel': None, 'auto_until': 0, 'body': None, 'edited': 0})
+        if not force and view['panel'] == panel and (view['body'] == body or now - view['edited'] < PANEL_MIN_EDIT):
+            return False
+        view.update(panel=panel, body=body, edited=now)
+        auto = view['auto_until'] > now
+    text = f"{body}\n\n🕒 Updated {datetime.now():%H:%M:%S}" + (" · auto" if auto else "")
+    try:
+        bot.edit_message_text(text, chat_id, message_id, reply_markup=panel_markup(panel, auto))
+    except telebot.apihelper.ApiTelegramException as e:
+        if "message is not modified" not in str(e):
+            raise
+    return True
+
+def panel_refresh_loop():
+    while True:
+        time.sleep(PANEL_REFRESH_INTERVAL)
+        now = time.monotonic()
+        with panel_views_lock:
+            due = [(key, view['panel'], view['auto_until'] > now)
+                   for key, view in panel_views.items() if view['auto_until']]
+            for key, _, active in due:
+                if not active:
+                    panel_views[key]['auto_until'] = 0
+            idle = [key for key, view in panel_views.items()
+                    if not view['auto_until'] and now - view['edited'] > PANEL_VIEW_IDLE]
+            for key in idle:
+                del panel_views[key]
+        for (chat_id, message_id), panel, active in due:
+            try:
+                with send_lane(LANE_BULK):
+                    # expired views get one last edit to show Auto: OFF
+                    edit_panel(chat_id, message_id, panel, force=not active)
+            except Exception as e:
+                print(f"Panel refresh error: {e}")
+                with panel_views_lock:
+                    panel_views.pop((chat_id, message_id), None)
+
+def stop_all_modes():
+    """Stop fight threads and clear every per-chat mode; returns how many were running"""
+    stopped = sum(active_mode_counts().values())
+    for tid in list(running_threads.keys()):
+        running_threads[tid] = False
+    running_threads.clear()
+    for targets in (troll_targets, funny_pairs, love_targets, love_troll_targets,
+                    love_funny_pairs, hide_targets, secret_monitoring):
+        targets.clear()
+    return stopped
+
+@bot.callback_query_handler(func=lambda c: c.data.startswith("dash_"))
+def dashboard_panel_callback(call):
+    if not is_owner(call.from_user.id):
+        return bot.answer_callback_query(call.id, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး", show_alert=True)
+    chat_id, message_id = call.message.chat.id, call.message.message_id
+    action, _, arg = call.data[len("dash_"):].partition(":")
+    if action == "home":
+        with panel_views_lock:
+            panel_views.pop((chat_id, message_id), None)
+        bot.answer_callback_query(call.id)
+        text, markup = render_dashboard()
+        return show_browser_view(call, text, markup)
+    if action == "stop_all":
+        stopped = stop_all_modes()
+        bot.answer_callback_query(call.id, f"🚫 Stopped {stopped} running modes", show_alert=True)
+        return edit_panel(chat_id, message_id, "emergency", force=True)
+    if action == "auto" and arg in PANELS:
+        with panel_views_lock:
+            view = panel_views.setdefault((chat_id, message_id), {'panel': arg, 'auto_until': 0, 'body': None, 'edited': 0})
+            on = view['auto_until'] <= time.monotonic()
+            view['auto_until'] = time.monotonic() + PANEL_AUTO_SECONDS if on else 0
+        bot.answer_callback_query(call.id, f"⏱️ Auto refresh {'on for ' + str(PANEL_AUTO_SECONDS // 60) + 'm' if on else 'off'}")
+        return edit_panel(chat_id, message_id, arg, force=True)
+    panel = arg if action == "refresh" else action
+    if panel not in PANELS:
+        return bot.answer_callback_query(call.id)
+    edited = edit_panel(chat_id, message_id, panel)
+    bot.answer_callback_query(call.id, None if edited else "✅ Up to date")
+
 @bot.message_handler(commands=['upload'])
 def upload_cmd(m):
     if not is_owner(m.from_user.id):
@@ -1149,88 +3629,48 @@ def upload_cmd(m):
     
     if m.reply_to_message:
         # Broadcast the replied message to all active chats
-        chats = get_tracked_chats()
+        chats = [chat[0] for chat in get_tracked_chats() if chat[7]]  # is_active
         if not chats:
             return bot.reply_to(m, "⚠️ No active chats to broadcast to")
-        
-        success_count = 0
-        fail_count = 0
-        
-        for chat in chats:
-            chat_id = chat[0]
-            if chat[7]:  # is_active
-                try:
-                    if m.reply_to_message.text:
-                        bot.send_message(chat_id, m.reply_to_message.text)
-                    elif m.reply_to_message.photo:
-                        bot.send_photo(chat_id, m.reply_to_message.photo[-1].file_id, 
-                                     caption=m.reply_to_message.caption)
-                    elif m.reply_to_message.video:
-                        bot.send_video(chat_id, m.reply_to_message.video.file_id,
-                                     caption=m.reply_to_message.caption)
-                    elif m.reply_to_message.audio:
-                        bot.send_audio(chat_id, m.reply_to_message.audio.file_id,
-                                     caption=m.reply_to_message.caption)
-                    elif m.reply_to_message.document:
-                        bot.send_document(chat_id, m.reply_to_message.document.file_id,
-                                        caption=m.reply_to_message.caption)
-                    success_count += 1
-                except:
-                    fail_count += 1
-        
-        bot.reply_to(m, f"📤 Broadcast complete!\n✅ Success: {success_count}\n❌ Failed: {fail_count}")
+        create_broadcast('chats', chats, m.chat.id, from_chat_id=m.chat.id, message_id=m.reply_to_message.message_id)
     else:
         bot.reply_to(m, "❌ Reply to a message to broadcast it to all groups")
 
+def render_adminlist(entries):
+    """Admin list text from admin_roster() entries"""
+    text = "🛡️ <b>Admin List (Detailed)</b>\n\n"
+    
+    for i, entry in enumerate(entries, 1):
+        user = entry.profile
+        if user:
+            name = user.first_name
+            username = f"@{user.username}" if user.username else "No username"
+        else:
+            name = "Unknown"
+            username = "No username"
+        
+        status = "🚫 Banned" if entry.banned_date else "✅ Active"
+        limit_text = "No limit" if entry.daily_limit is None else f"{entry.used_today}/{entry.daily_limit} today"
+        
+        text += f"{i}. <b>{name}</b>\n"
+        text += f"ID: <code>{entry.user_id}</code>\n"
+        text += f"Username: {username}\n"
+        text += f"Status: {status}\n"
+        text += f"Limit: {limit_text}\n\n"
+    
+    text += f"\n👑 <b>Owner:</b> {OWNER_ID}\n"
+    text += f"📊 <b>Total Admins:</b> {len(entries)}"
+    return text
+
 @bot.message_handler(commands=['adminlist'])
 def adminlist_cmd(m):
     if not is_admin(m.from_user.id):
         return bot.reply_to(m, "❌ မင်းသုံးခွင့်မရှိဘူးတောသား")
     
-    # Get all admins
-    cursor.execute("SELECT id FROM admins")
-    admin_ids = [row[0] for row in cursor.fetchall()]
-    
-    if not admin_ids:
+    admins = [entry for entry in admin_roster() if entry.is_admin]
+    if not admins:
         return bot.reply_to(m, "⚠️ No admins found")
-    
-    text = "🛡️ <b>Admin List (Detailed)</b>\n\n"
-    
-    for i, admin_id in enumerate(admin_ids, 1):
-        try:
-            # Check if banned
-            cursor.execute("SELECT banned_date FROM banned_admins WHERE user_id=?", (admin_id,))
-            banned_info = cursor.fetchone()
-            
-            # Check limits
-            cursor.execute("SELECT daily_limit, used_today, last_reset FROM admin_limits WHERE user_id=?", (admin_id,))
-            limit_info = cursor.fetchone()
-            
-            # Get admin info
-            try:
-                user = bot.get_chat(admin_id)
-                name = user.first_name
-                username = f"@{user.username}" if user.username else "No username"
-            except:
-                name = "Unknown"
-                username = "No username"
-            
-            status = "🚫 Banned" if banned_info else "✅ Active"
-            limit_text = "No limit" if not limit_info else f"{limit_info[1]}/{limit_info[0]} today"
-            
-            text += f"{i}. <b>{name}</b>\n"
-            text += f"ID: <code>{admin_id}</code>\n"
-            text += f"Username: {username}\n"
-            text += f"Status: {status}\n"
-            text += f"Limit: {limit_text}\n\n"
-            
-        except Exception as e:
-            text += f"{i}. <b>Error loading admin {admin_id}</b>\n\n"
-    
-    text += f"\n👑 <b>Owner:</b> {OWNER_ID}\n"
-    text += f"📊 <b>Total Admins:</b> {len(admin_ids)}"
-    
-    bot.reply_to(m, text)
+    bot.reply_to(m, render_adminlist(admins))
 
 @bot.message_handler(commands=['admin_unlimit'])
 def admin_unlimit_cmd(m):
@@ -1311,6 +3751,13 @@ def owner_help(m):
 /gp_list - Group list (detailed)
 /shutdown - Shutdown bot
 /upload - Broadcast message
+/broadcast_jobs - Broadcast progress, pause/resume/cancel
+/send_stats - Outbound rate limiter stats
+/dispatch_stats - Update worker shard stats
+/api_stats - Telegram API latency per method
+/metrics - Handler calls, latency and errors
+/profile [sec] - Sample all threads, top frames + flamegraph
+/memsnap [stop] - Memory growth since last snapshot
 
 🎵 <b>Music Management</b>
 /create_folder name - Create music folder
@@ -1336,21 +3783,31 @@ Your Status: {user_status}"""
 @bot.callback_query_handler(func=lambda c:c.data.startswith("folder_member:"))
 def folder_member_callback(call):
     folder_id = int(call.data.split(":")[1])
-    cursor.execute("SELECT id,title,artist FROM musics WHERE folder_id=?", (folder_id,))
-    musics = cursor.fetchall()
-    if not musics:
+    text, markup = render_folder_page(folder_id)
+    if not text:
         return bot.answer_callback_query(call.id, "⚠️ No musics in this folder")
-    markup = types.InlineKeyboardMarkup()
-    for m in musics:
-        display_name = f"{m[1]} - {m[2]}" if m[2] else m[1]
-        markup.add(types.InlineKeyboardButton(display_name, callback_data=f"play:{m[0]}"))
-    bot.send_message(call.message.chat.id, "🎶 Musics:", reply_markup=markup)
+    bot.answer_callback_query(call.id)
+    show_browser_view(call, text, markup)
+
+@bot.callback_query_handler(func=lambda c: c.data.startswith("fpage:"))
+def folder_page_callback(call):
+    bot.answer_callback_query(call.id)
+    _, folder_id, direction, anchor = call.data.split(":")
+    text, markup = render_folder_page(int(folder_id), direction, int(anchor))
+    if text:
+        show_browser_view(call, text, markup)
+
+@bot.callback_query_handler(func=lambda c: c.data == "music_folders")
+def music_folders_callback(call):
+    bot.answer_callback_query(call.id)
+    text, markup = render_folder_list()
+    if text:
+        show_browser_view(call, text, markup)
 
 @bot.callback_query_handler(func=lambda c:c.data.startswith("folder_owner:"))
 def folder_owner_callback(call):
     folder_id = int(call.data.split(":")[1])
-    cursor.execute("SELECT id,title,artist FROM musics WHERE folder_id=?", (folder_id,))
-    musics = cursor.fetchall()
+    musics = db_read("SELECT id,title,artist FROM musics WHERE folder_id=?", (folder_id,))
     if not musics:
         return bot.answer_callback_query(call.id, "⚠️ No musics in this folder")
     text = "🎶 Musics in this folder:\n"
@@ -1361,8 +3818,7 @@ def folder_owner_callback(call):
 @bot.callback_query_handler(func=lambda c:c.data.startswith("play:"))
 def play_callback(call):
     mid = int(call.data.split(":")[1])
-    cursor.execute("SELECT file_id,title,artist FROM musics WHERE id=?", (mid,))
-    row = cursor.fetchone()
+    row = db_read_one("SELECT file_id,title,artist FROM musics WHERE id=?", (mid,))
     if row:
         chat_id = call.message.chat.id
         current_play[chat_id] = mid
@@ -1371,6 +3827,24 @@ def play_callback(call):
     else:
         bot.answer_callback_query(call.id, "⚠️ Music not found")
 
+# Inline mode: @bot query answers straight from the in-memory catalog
+@bot.inline_handler(func=lambda q: True)
+def inline_music_query(query):
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+    ids = catalog_search(query.query)
+    page = ids[offset:offset + INLINE_PAGE_SIZE]
+    results = []
+    for mid in page:
+        entry = catalog.get(mid)
+        if entry:
+            title, artist, file_id, _ = entry
+            results.append(types.InlineQueryResultCachedAudio(str(mid), file_id, caption=f"🎵 {title} - {artist}"))
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(ids) else ""
+    bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
 # ================= SPECIAL FEATURES =================
 
 @bot.message_handler(commands=['unhide'])
@@ -1388,7 +3862,7 @@ def unhide_cmd(m):
     unhidden_count = 0
     for a in args:
         try:
-            uid = int(a) if a.isdigit() else bot.get_chat(a).id
+            uid = resolve_user_id(a)
             if uid in hide_targets[chat_id]:
                 hide_targets[chat_id].remove(uid)
                 unhidden_count += 1
@@ -1434,23 +3908,22 @@ def stop_secret_cmd(m):
 def show_admin_id(m):
     if not is_owner(m.from_user.id):
         return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
-    cursor.execute("SELECT id FROM admins")
-    rows = cursor.fetchall()
-    if not rows:
+    admins = [entry for entry in admin_roster() if entry.is_admin]
+    if not admins:
         return bot.reply_to(m, "❌ Admin မရှိပါ")
     text = "👑 <b>Admin ID အသေးစိတ်:</b>\n"
-    for uid in rows:
-        try:
-            user_info = bot.get_chat(uid[0])
-            user_name = get_nickname(uid[0]) or user_info.first_name
-            username = f"@{user_info.username}" if user_info.username else "No username"
-            banned = "🚫" if is_banned_admin(uid[0]) else "✅"
-            text += f"{banned} <b>{user_name}</b>\n"
-            text += f"├ ID: <code>{uid[0]}</code>\n"
-            text += f"├ Username: {username}\n"
-            text += f"└ Mention: {mention(uid[0], user_name)}\n\n"
-        except:
-            text += f"❓ Unknown Admin: <code>{uid[0]}</code>\n\n"
+    for entry in admins:
+        user_info = entry.profile
+        if not user_info:
+            text += f"❓ Unknown Admin: <code>{entry.user_id}</code>\n\n"
+            continue
+        user_name = entry.nickname or user_info.first_name
+        username = f"@{user_info.username}" if user_info.username else "No username"
+        banned = "🚫" if entry.banned_date else "✅"
+        text += f"{banned} <b>{user_name}</b>\n"
+        text += f"├ ID: <code>{entry.user_id}</code>\n"
+        text += f"├ Username: {username}\n"
+        text += f"└ Mention: {mention(entry.user_id, user_name)}\n\n"
     bot.reply_to(m, text)
 
 @bot.message_handler(commands=['add_admin'])
@@ -1501,17 +3974,13 @@ def unban_admin_cmd(m):
 def remove_admin_list(m):
     if not is_owner(m.from_user.id):
         return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
-    cursor.execute("SELECT user_id FROM banned_admins")
-    banned = cursor.fetchall()
+    banned = [entry for entry in admin_roster() if entry.banned_date]
     if not banned:
         return bot.reply_to(m, "❌ Banned admin မရှိပါ")
     text = "🚫 <b>Banned Admin List:</b>\n"
-    for uid in banned:
-        try:
-            user_info = bot.get_chat(uid[0])
-            text += f"• {user_info.first_name} - <code>{uid[0]}</code>\n"
-        except:
-            text += f"• Unknown - <code>{uid[0]}</code>\n"
+    for entry in banned:
+        name = entry.profile.first_name if entry.profile else "Unknown"
+        text += f"• {name} - <code>{entry.user_id}</code>\n"
     bot.reply_to(m, text)
 
 @bot.message_handler(commands=['broadcast'])
@@ -1523,73 +3992,109 @@ def broadcast_cmd(m):
     all_users = get_all_bot_users()
     if not all_users:
         return bot.reply_to(m, "❌ No bot users found for broadcast")
-    
+
     if m.reply_to_message:
-        # Handle different message types
-        replied_msg = m.reply_to_message
-        success_count = 0
-        
-        for user_id in all_users:
-            try:
-                if replied_msg.photo:
-                    bot.send_photo(user_id, replied_msg.photo[-1].file_id, caption=replied_msg.caption)
-                elif replied_msg.video:
-                    bot.send_video(user_id, replied_msg.video.file_id, caption=replied_msg.caption)
-                elif replied_msg.document:
-                    bot.send_document(user_id, replied_msg.document.file_id, caption=replied_msg.caption)
-                elif replied_msg.audio:
-                    bot.send_audio(user_id, replied_msg.audio.file_id, caption=replied_msg.caption)
-                elif replied_msg.sticker:
-                    bot.send_sticker(user_id, replied_msg.sticker.file_id)
-                else:
-                    bot.send_message(user_id, replied_msg.text or replied_msg.caption or "📢 Broadcast Message")
-                success_count += 1
-            except:
-                continue
-                
-        bot.reply_to(m, f"📢 Broadcast completed: {success_count}/{len(all_users)} users")
+        # copy_message handles every content type
+        create_broadcast('users', all_users, m.chat.id, from_chat_id=m.chat.id, message_id=m.reply_to_message.message_id)
     else:
         args = m.text.split(maxsplit=1)
         if len(args) < 2:
             return bot.reply_to(m, "❌ /broadcast message သုံးပါ သို့မဟုတ် media reply လုပ်ပါ")
-        text = args[1]
-        success_count = 0
-        for user_id in all_users:
-            try:
-                bot.send_message(user_id, text)
-                success_count += 1
-            except:
-                continue
-        bot.reply_to(m, f"📢 Text broadcast: {success_count}/{len(all_users)} users")
+        create_broadcast('users', all_users, m.chat.id, text=args[1])
 
-    success_count = 0
-    
-    # Try to forward to users first, then copy content if forward fails
-    for user_id in all_users:
-        try:
-            # Try forwarding first
-            bot.forward_message(user_id, m.chat.id, replied_msg.message_id)
-            success_count += 1
-        except:
-            # If forward fails, try sending content directly
-            try:
-                if replied_msg.photo:
-                    bot.send_photo(user_id, replied_msg.photo[-1].file_id, caption=replied_msg.caption)
-                elif replied_msg.video:
-                    bot.send_video(user_id, replied_msg.video.file_id, caption=replied_msg.caption)
-                elif replied_msg.document:
-                    bot.send_document(user_id, replied_msg.document.file_id, caption=replied_msg.caption)
-                elif replied_msg.audio:
-                    bot.send_audio(user_id, replied_msg.audio.file_id, caption=replied_msg.caption)
-                elif replied_msg.sticker:
-                    bot.send_sticker(user_id, replied_msg.sticker.file_id)
-                else:
-                    bot.send_message(user_id, replied_msg.text or "📤 Uploaded Content")
-                success_count += 1
-            except:
-                continue
-    
-    bot.reply_to(m, f"📤 Upload completed: {success_count}/{len(all_users)} users")
+@bot.message_handler(commands=['broadcast_jobs'])
+def broadcast_jobs_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    jobs = db_read("""
+        SELECT j.id, j.kind, j.status, j.created_at,
+               SUM(r.status='sent'), SUM(r.status='failed'), SUM(r.status IN ('pending', 'sending'))
+        FROM broadcast_jobs j LEFT JOIN broadcast_recipients r ON r.job_id = j.id
+        GROUP BY j.id ORDER BY j.id DESC LIMIT 10
+    """)
+    if not jobs:
+        return bot.reply_to(m, "⚠️ No broadcast jobs")
+    text = "📤 <b>Broadcast Jobs</b>\n\n"
+    for job_id, kind, status, created, sent, failed, pending in jobs:
+        text += f"#{job_id} {kind} – {status} ({created})\n✅ {sent or 0}  ❌ {failed or 0}  ⏳ {pending or 0}\n\n"
+    text += "/broadcast_pause id · /broadcast_resume id · /broadcast_cancel id"
+    bot.reply_to(m, text)
+
+@bot.message_handler(commands=['send_stats'])
+def send_stats_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    bot.reply_to(m, send_stats_text())
+
+@bot.message_handler(commands=['metrics'])
+def metrics_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    bot.reply_to(m, metrics_summary_text())
+
+@bot.message_handler(commands=['api_stats'])
+def api_stats_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    bot.reply_to(m, api_stats_text())
+
+@bot.message_handler(commands=['dispatch_stats'])
+def dispatch_stats_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    bot.reply_to(m, dispatch_stats_text())
+
+@bot.message_handler(commands=['profile'])
+def profile_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    args = m.text.split()
+    seconds = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    if not profiler_lock.acquire(blocking=False):
+        return bot.reply_to(m, "⏳ Profile already running")
+    threading.Thread(target=run_profile, args=(m.chat.id, seconds), daemon=True).start()
+    bot.reply_to(m, f"🔬 Profiling all threads for {seconds}s...")
+
+@bot.message_handler(commands=['memsnap'])
+def memsnap_cmd(m):
+    global memsnap_baseline
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    args = m.text.split()
+    if len(args) > 1 and args[1] == "stop":
+        with memsnap_lock:
+            tracemalloc.stop()
+            memsnap_baseline = None
+        return bot.reply_to(m, "🧠 Memory tracing stopped")
+    if not memsnap_lock.acquire(blocking=False):
+        return bot.reply_to(m, "⏳ Snapshot already in progress")
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMSNAP_FRAMES)
+        memsnap_baseline = None
+    threading.Thread(target=run_memsnap, args=(m.chat.id,), daemon=True).start()
+
+@bot.message_handler(commands=['broadcast_pause', 'broadcast_resume', 'broadcast_cancel'])
+def broadcast_control_cmd(m):
+    if not is_owner(m.from_user.id):
+        return bot.reply_to(m, "❌ Owner ချာလီသီးသန့်ပါ မင်းသုံးလို့မရဘူး")
+    args = m.text.split()
+    try:
+        job_id = int(args[1])
+    except (IndexError, ValueError):
+        return bot.reply_to(m, f"❌ {args[0]} job_id သုံးပါ")
+    action = args[0].split('@')[0][len('/broadcast_'):]
+    if action == 'resume':
+        status = db_scalar("SELECT status FROM broadcast_jobs WHERE id=?", (job_id,))
+        if status not in ('paused', 'running') or not start_broadcast(job_id):
+            return bot.reply_to(m, f"⚠️ Broadcast #{job_id} can't be resumed")
+        return bot.reply_to(m, f"▶️ Broadcast #{job_id} resumed")
+    state = 'paused' if action == 'pause' else 'cancelled'
+    if not set_broadcast_state(job_id, state):
+        if state == 'cancelled' and db_write("UPDATE broadcast_jobs SET status='cancelled' WHERE id=? AND status='paused'", (job_id,)).rowcount:
+            return bot.reply_to(m, f"🛑 Broadcast #{job_id} cancelled")
+        return bot.reply_to(m, f"⚠️ Broadcast #{job_id} is not running")
+    bot.reply_to(m, f"{'⏸' if state == 'paused' else '🛑'} Broadcast #{job_id} {state}")
 
 @bot.message_handler(commands=['speed'])
 def speed_cmd(m):
@@ -1610,7 +4115,7 @@ def speed_cmd(m):
 
 # ================= FIGHT =================
 def send_fight_message(chat_id, uid, template):
-    name = get_nickname(uid) or bot.get_chat(uid).first_name
+    name = get_nickname(uid) or profile_name(uid)
     bot.send_message(chat_id, f"{mention(uid, name)} : {template}")
 
 @bot.message_handler(commands=['fight'])
@@ -1631,7 +4136,7 @@ def fight_cmd(m):
     target_index = {}
     for target in args:
         try:
-            uid = int(target) if target.isdigit() else bot.get_chat(target).id
+            uid = resolve_user_id(target)
             target_index[uid] = 0
         except:
             continue
@@ -1662,7 +4167,7 @@ def troll_cmd(m):
     troll_targets.setdefault(chat_id, {})
     for a in args:
         try:
-            uid = int(a) if a.isdigit() else bot.get_chat(a).id
+            uid = resolve_user_id(a)
             if uid not in troll_targets[chat_id]:
                 troll_targets[chat_id][uid] = 0
         except:
@@ -1678,8 +4183,8 @@ def funny_cmd(m):
     if len(args) < 2:
         return bot.reply_to(m, "❌ /funny id1 id2 သုံးပါ")
     try:
-        id1 = int(args[0]) if args[0].isdigit() else bot.get_chat(args[0]).id
-        id2 = int(args[1]) if args[1].isdigit() else bot.get_chat(args[1]).id
+        id1 = resolve_user_id(args[0])
+        id2 = resolve_user_id(args[1])
         funny_pairs[m.chat.id] = (id1, id2)
         bot.reply_to(m, f"တောသားနှစ်ကောင်ကိုရန်တိုက်ပါပြီ: {id1} > {id2}")
     except:
@@ -1817,7 +4322,7 @@ def handle_auto_reply(m):
         if uid == id1 or uid == id2:
             other_id = id2 if uid == id1 else id1
             try:
-                other_name = get_nickname(other_id) or bot.get_chat(other_id).first_name
+                other_name = get_nickname(other_id) or profile_name(other_id)
                 love_messages = [
                     f"{mention(uid, name)} က {mention(other_id, other_name)} ကို '{m.text}' လို့ချစ်စကားပြောနေတယ် 💖",
                     f"{mention(other_id, other_name)} ရေ... {mention(uid, name)} က မင်းကိုချစ်တဲ့အကြောင်း '{m.text}' လို့ပြောနေတယ်နော် 💝",
@@ -1842,14 +4347,136 @@ def handle_auto_reply(m):
         if uid == id1 or uid == id2:
             other_id = id2 if uid == id1 else id1
             try:
-                other_name = get_nickname(other_id) or bot.get_chat(other_id).first_name
+                other_name = get_nickname(other_id) or profile_name(other_id)
                 bot.reply_to(m, f"{mention(uid, name)} ဒီစောက်တောသားက {mention(other_id, other_name)} မင်းကို '{m.text}' လို့ပြောနေတယ် ငြိမ်ခံမနေနဲ့ ပြန်ပြောလေမအေလိုးတောသား😈")
             except:
                 pass
 
 # ================= RUN BOT =================
+instrument_handlers()
+
+def start_background_workers():
+    """Start the long-running helper threads"""
+    threading.Thread(target=chat_flush_loop, daemon=True).start()
+    threading.Thread(target=member_count_loop, daemon=True).start()
+    threading.Thread(target=dispatch_watchdog_loop, daemon=True).start()
+    threading.Thread(target=panel_refresh_loop, daemon=True).start()
+    if CAPTURE_DIR:
+        threading.Thread(target=capture_loop, daemon=True).start()
+    if METRICS_PORT:
+        start_metrics_server()
+    resume_broadcasts()
+
+# ================= WEBHOOK SERVER =================
+# BOT_MODE=webhook (or --webhook) replaces long polling with a small HTTP
+# server. Telegram POSTs each update to WEBHOOK_PATH; the secret token header
+# is checked, the update is queued on the dispatcher and acknowledged at once.
+# GET /health reports queue depth and update counters. Without WEBHOOK_URL the
+# webhook isn't registered, so recorded updates can be POSTed to it locally.
+# A registered webhook always has a secret: a random one if none is configured.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # public https URL registered with Telegram
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_MAX_BODY = 1 << 20
+webhook_server = None
+webhook_stats = {'received': 0, 'rejected': 0, 'invalid': 0, 'last_update': 0.0}
+bot_started_at = time.time()
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"    # lets Telegram keep its connections open
+
+    def reply(self, status, body=b"", content_type="text/plain", close=False):
+        # close: the request body wasn't (fully) read, so the connection can't be reused
+        self.close_connection = self.close_connection or close
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != WEBHOOK_PATH:
+            return self.reply(404, close=True)
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if WEBHOOK_SECRET and not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            webhook_stats['rejected'] += 1
+            return self.reply(403, close=True)
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= WEBHOOK_MAX_BODY:
+            webhook_stats['invalid'] += 1
+            print(f"Bad webhook update: Content-Length {self.headers.get('Content-Length')!r}")
+            return self.reply(400, close=True)
+        body = self.rfile.read(length)
+        try:
+            text = body.decode("utf-8")
+            update = types.Update.de_json(text)
+        except Exception as e:
+            webhook_stats['invalid'] += 1
+            print(f"Bad webhook update: {e!r}")
+            return self.reply(400)
+        if CAPTURE_DIR:
+            capture_updates([text])
+        dispatch_updates([update])
+        webhook_stats['received'] += 1
+        webhook_stats['last_update'] = time.time()
+        self.reply(200)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.reply(404)
+        last = webhook_stats['last_update']
+        health = {
+            "ok": True,
+            "mode": "webhook",
+            "uptime": round(time.time() - bot_started_at),
+            "queued": sum(shard.depth for shard in dispatch_shards),
+            "received": webhook_stats['received'],
+            "rejected": webhook_stats['rejected'],
+            "invalid": webhook_stats['invalid'],
+            "last_update_age": round(time.time() - last, 1) if last else None,
+        }
+        self.reply(200, json.dumps(health).encode(), "application/json")
+
+    def log_message(self, format, *args):
+        pass
+
+def run_webhook():
+    """Serve updates over HTTP until stop_bot() is called"""
+    global webhook_server, WEBHOOK_SECRET
+    if WEBHOOK_URL:
+        if not WEBHOOK_SECRET:
+            WEBHOOK_SECRET = secrets.token_urlsafe(32)
+            print("🔑 No WEBHOOK_SECRET set, registered the webhook with a random one")
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        print(f"🔗 Webhook set to {WEBHOOK_URL}")
+    webhook_server = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT), WebhookHandler)
+    webhook_server.daemon_threads = True
+    print(f"🌐 Listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    webhook_server.serve_forever()
+
+def stop_bot():
+    """Stop polling or the webhook server so the main thread can exit"""
+    if webhook_server:
+        webhook_server.shutdown()
+    else:
+        bot.stop_polling()
+
 if __name__ == "__main__":
+    if "--explain" in sys.argv:
+        explain_hot_queries()
+        sys.exit(0)
+
+    start_background_workers()
     print("🤖 Bot is running...")
     print(f"👑 Owner ID: {OWNER_ID}")
     print("🔧 All features loaded successfully!")
-    bot.infinity_polling()
\ No newline at end of file
+    if "--webhook" in sys.argv or BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        bot.infinity_polling()
\ No newline at end of file
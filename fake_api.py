@@ -0,0 +1,228 @@
+import argparse
+import email
+import json
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# ================= FAKE BOT API =================
+# A local stand-in for api.telegram.org used by the benchmarks. It serves
+# getUpdates from a queue of pushed updates, answers the methods the bot uses
+# with plausible results after a configurable latency, and counts calls.
+# Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:PORT.
+#
+#   python fake_api.py --port 8081 --latency 0.05
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    """Threaded HTTP server that fakes the Bot API methods the bot calls"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, latencies=None):
+        self.latency = latency
+        self.latencies = latencies or {}    # {method: seconds}, overrides latency
+        self.updates = deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.cond = threading.Condition()
+        self.calls = Counter()
+        self.failures = Counter()           # {method: calls left to fail}
+        self.failure_status = {}
+        self.failure_retry_after = {}
+        self.failed = Counter()             # {method: error responses served}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with api.cond:
+                    api.connections += 1
+
+            def do_GET(self):
+                self.handle_call()
+
+            def do_POST(self):
+                self.handle_call()
+
+            def handle_call(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                params.update(parse_body(self.headers.get("Content-Type", ""), self.rfile.read(length)))
+                status, body = api.call(method, params)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass    # client gave up, e.g. a long poll cut short
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_updates(self, updates):
+        """Queue update dicts for getUpdates, numbering any without an update_id"""
+        with self.cond:
+            for update in updates:
+                if "update_id" not in update:
+                    update = dict(update, update_id=self.next_update_id)
+                self.next_update_id = max(self.next_update_id, update["update_id"] + 1)
+                self.updates.append(update)
+            self.cond.notify_all()
+
+    def pending_updates(self):
+        with self.cond:
+            return len(self.updates)
+
+    def fail(self, method, times=1, status=502, retry_after=None):
+        """Answer the next `times` calls of method with an HTTP error; a 429
+        carries parameters.retry_after like Telegram's flood control"""
+        with self.cond:
+            self.failures[method] += times
+            self.failure_status[method] = status
+            self.failure_retry_after[method] = retry_after if retry_after is not None or status != 429 else 1
+
+    def reset_stats(self):
+        with self.cond:
+            self.calls.clear()
+            self.failed.clear()
+            self.max_in_flight = 0
+
+    def call(self, method, params):
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self.get_updates(params)}
+        with self.cond:
+            self.calls[method] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failing = self.failures[method] > 0
+            if failing:
+                self.failures[method] -= 1
+                self.failed[method] += 1
+                retry_after = self.failure_retry_after[method]
+        try:
+            delay = self.latencies.get(method, self.latency)
+            if delay:
+                time.sleep(delay)
+            if failing:
+                status = self.failure_status[method]
+                body = {"ok": False, "error_code": status, "description": "Fake failure"}
+                if retry_after is not None:
+                    body["description"] = f"Too Many Requests: retry after {retry_after}"
+                    body["parameters"] = {"retry_after": retry_after}
+                return status, body
+            return 200, {"ok": True, "result": self.result(method, params)}
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self.cond:
+            while self.updates and self.updates[0]["update_id"] < offset:
+                self.updates.popleft()
+            while not self.updates and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            self.calls["getUpdates"] += 1
+            return [self.updates[i] for i in range(min(limit, len(self.updates)))]
+
+    def message(self, params, **fields):
+        chat_id = int(params.get("chat_id") or 0)
+        with self.cond:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        message = {"message_id": message_id, "date": int(time.time()), "from": BOT_USER, "chat": fake_chat(chat_id)}
+        message.update(fields)
+        return message
+
+    def result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getChat":
+            return fake_chat(int(params.get("chat_id") or 0))
+        if method == "getChatMemberCount":
+            return 42
+        if method == "copyMessage":
+            with self.cond:
+                self.next_message_id += 1
+                return {"message_id": self.next_message_id}
+        if method == "sendAudio":
+            audio = params.get("audio") if isinstance(params.get("audio"), str) else "uploaded"
+            return self.message(params, audio={"file_id": audio, "file_unique_id": audio[-16:], "duration": 180},
+                                caption=params.get("caption", ""))
+        if method.startswith(("send", "forward")) or (method.startswith("edit") and "chat_id" in params):
+            return self.message(params, text=params.get("text", ""))
+        # answerCallbackQuery, deleteMessage, setWebhook, inline edits...
+        return True
+
+
+def arm_rate_limits(api, items, retry_after=1):
+    """Answer the first TIMES calls of METHOD with a 429, from METHOD=TIMES options"""
+    for item in items:
+        method, _, times = item.partition("=")
+        api.fail(method, int(times or 1), 429, retry_after)
+
+
+def fake_chat(chat_id):
+    if chat_id > 0:
+        return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}", "username": f"user{chat_id}"}
+    return {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"}
+
+
+def parse_body(content_type, body):
+    """Form fields from a urlencoded or multipart request body"""
+    if not body:
+        return {}
+    if content_type.startswith("multipart/form-data"):
+        message = email.message_from_bytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        fields = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            value = part.get_payload(decode=True)
+            fields[name] = value.decode() if part.get_filename() is None else value
+        return fields
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    return dict(parse_qsl(body.decode()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for local benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    args = parser.parse_args()
+    api = FakeBotAPI(args.host, args.port, args.latency)
+    print(f"Fake Bot API on {api.url} (latency {args.latency}s)")
+    api.server.serve_forever()
@@ -0,0 +1,118 @@
+import argparse
+import gzip
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from bench import (finish_worker, parse_latencies, print_result, seed_worker_db, start_worker,
+                   worker_env)
+from fake_api import FakeBotAPI
+
+# ================= CAPTURE REPLAY =================
+# Feeds updates recorded with CAPTURE_DIR back through the real bot.py
+# handlers against the local fake Bot API, at the original pacing, N times
+# faster, or as fast as the bot will take them. Updates are renumbered and
+# replayed in capture order over a copy of the same database with the same
+# random seed, so two runs of one capture see identical traffic; compare them
+# with --compare.
+#
+#   python replay.py captures/ --speed 10 --db bot.db
+#   python replay.py captures/updates-20240101-*.jsonl.gz --fast --compare bench_results/replay-before.json
+
+def capture_paths(sources):
+    paths = []
+    for source in sources:
+        source = Path(source)
+        paths += sorted(source.glob("updates-*.jsonl.gz")) if source.is_dir() else [source]
+    return paths
+
+def read_capture(paths, limit=None):
+    """(received time, update) records in capture order; tolerates a file cut off mid-write"""
+    records = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    records.append((record["t"], record["update"]))
+                    if limit and len(records) >= limit:
+                        return records
+            except (EOFError, json.JSONDecodeError):
+                print(f"⚠️ {path} is truncated, replaying what was readable")
+    return records
+
+def renumbered(records):
+    return [dict(update, update_id=i) for i, (_, update) in enumerate(records, 1)]
+
+def feed(api, records, speed):
+    """Push updates to the fake API on the captured schedule, scaled by speed"""
+    updates = renumbered(records)
+    first, started = records[0][0], time.monotonic()
+    for (received, _), update in zip(records, updates):
+        delay = (received - first) / speed - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+        api.push_updates([update])
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured updates through bot.py against a fake Bot API")
+    parser.add_argument("captures", nargs="+", help="capture files or CAPTURE_DIR folders")
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument("--speed", type=float, default=1.0, help="1 = original timing, 10 = ten times faster")
+    pacing.add_argument("--fast", action="store_true", help="push everything at once")
+    parser.add_argument("--limit", type=int, help="replay only the first N updates")
+    parser.add_argument("--db", help="database to replay against (copied, never modified)")
+    parser.add_argument("--tracks", type=int, default=5000, help="seeded tracks when --db isn't given")
+    parser.add_argument("--chats", type=int, default=200, help="seeded chats when --db isn't given")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API seconds per call")
+    parser.add_argument("--method-latency", action="append", default=[], metavar="METHOD=SECONDS")
+    parser.add_argument("--timeout", type=float, help="seconds to wait for the bot (default: replay length + 300)")
+    parser.add_argument("--out", help="results file (default bench_results/replay-<time>.json)")
+    parser.add_argument("--compare", help="earlier replay results file to diff against")
+    args = parser.parse_args()
+
+    previous = json.loads(Path(args.compare).read_text())["results"]["replay"] if args.compare else None
+    paths = capture_paths(args.captures)
+    records = read_capture(paths, args.limit)
+    if not records:
+        raise SystemExit("No captured updates found")
+    span = records[-1][0] - records[0][0]
+    timeout = args.timeout or (0 if args.fast else span / args.speed) + 300
+    print(f"Replaying {len(records)} updates from {len(paths)} files, captured over {span:.0f}s, "
+          + ("as fast as possible" if args.fast else f"at {args.speed:g}x"))
+
+    api = FakeBotAPI(latency=args.latency, latencies=parse_latencies(args.method_latency)).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "replay.db"
+        env = worker_env(api, db_path)
+        if args.db:
+            shutil.copy(args.db, db_path)
+        else:
+            seed_worker_db(env, args.tracks, args.chats)
+        api.reset_stats()
+        if args.fast:
+            api.push_updates(renumbered(records))
+        # chats=0: no synthetic troll/funny modes, the capture drives everything
+        proc = start_worker(env, len(records), 0, timeout, args.seed)
+        if not args.fast:
+            threading.Thread(target=feed, args=(api, records, args.speed), daemon=True).start()
+        stats = finish_worker(proc, api, "replay", timeout)
+    api.stop()
+
+    print_result("replay", stats, previous)
+    out = Path(args.out or f"bench_results/replay-{datetime.now():%Y%m%d-%H%M%S}.json")
+    config = {"captures": [str(p) for p in paths], "updates": len(records), "speed": None if args.fast else args.speed,
+              "db": args.db, "seed": args.seed, "latency": args.latency, "method_latency": args.method_latency}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"config": config, "results": {"replay": stats}}, indent=2))
+    print(f"\nResults written to {out}")
+
+if __name__ == "__main__":
+    main()